@@ -21,23 +21,31 @@
 import traceback
 import threading
 import multiprocessing
-from Queue import Empty
+from Queue import Empty, Full
 from time import sleep
 from kivy.logger import Logger
 from autosportlabs.comms.commscommon import PortNotOpenException
+from autosportlabs.comms.sharedring import SharedRing
 
 STAY_ALIVE_TIMEOUT = 4
 COMMAND_CLOSE = 'CLOSE'
 COMMAND_KEEP_ALIVE = 'PING'
+RX_QUEUE_FULL_TIMEOUT = 1.0
+
+# how messages are passed between the connection process and the app
+TRANSPORT_QUEUE = 'queue'
+TRANSPORT_SHARED_MEMORY = 'shared_memory'
 
 def connection_process_message_reader(rx_queue, connection, should_run):
     Logger.debug('Comms: connection process message reader started')
 
     while should_run.is_set():
         try:
-            msg = connection.read_line()
-            if msg:
-                rx_queue.put(msg)
+            for msg in connection.read_lines():
+                if msg:
+                    rx_queue.put(msg, True, RX_QUEUE_FULL_TIMEOUT)
+        except Full:
+            Logger.warn('Comms: rx queue full, dropping message')
         except:
             Logger.error('Comms: Exception in connection_process_message_reader')
             Logger.debug(traceback.format_exc())
@@ -109,6 +117,9 @@ class Comms():
     CONNECT_TIMEOUT = 1.0
     DEFAULT_TIMEOUT = 1.0
     QUEUE_FULL_TIMEOUT = 1.0
+    TX_QUEUE_SIZE = 5
+    RX_RING_SIZE = 1024 * 1024
+    TX_RING_SIZE = 64 * 1024
     _timeout = DEFAULT_TIMEOUT
     device = None
     _connection = None
@@ -117,14 +128,30 @@ class Comms():
     _tx_queue = None
     _command_queue = None
 
-    def __init__(self, device, connection):
+    def __init__(self, device, connection, transport=TRANSPORT_QUEUE):
+        """
+        :param device the device to open
+        :type device string
+        :param connection the connection, opened in the connection process
+        :type connection object
+        :param transport how messages are passed to and from the connection process;
+        TRANSPORT_QUEUE or TRANSPORT_SHARED_MEMORY
+        :type transport string
+        """
         self.device = device
         self._connection = connection
+        self.transport = transport
         self.supports_streaming = False
+        # the shared memory ring allows a single producer
+        self._tx_lock = threading.Lock()
 
     def start_connection_process(self):
-        rx_queue = multiprocessing.Queue()
-        tx_queue = multiprocessing.Queue(5)
+        if self.transport == TRANSPORT_SHARED_MEMORY:
+            rx_queue = SharedRing(Comms.RX_RING_SIZE)
+            tx_queue = SharedRing(Comms.TX_RING_SIZE)
+        else:
+            rx_queue = multiprocessing.Queue()
+            tx_queue = multiprocessing.Queue(Comms.TX_QUEUE_SIZE)
         command_queue = multiprocessing.Queue()
         connection_process = multiprocessing.Process(target=connection_message_process, args=(self._connection, self.device, rx_queue, tx_queue, command_queue))
         connection_process.start()
@@ -162,16 +189,24 @@ class Comms():
                 Logger.error('Comms: Timeout joining connection process')
 
     def read_message(self):
+        # return waiting messages without checking the connection process on every message
+        rx_queue = self._rx_queue
+        if rx_queue is not None:
+            try:
+                return rx_queue.get_nowait()
+            except Empty:
+                pass
         if not self.isOpen():
             raise PortNotOpenException('Port Closed')
         try:
-            return self._rx_queue.get(True, self._timeout)
+            return rx_queue.get(True, self._timeout)
         except:  # returns Empty object if timeout is hit
             return None
 
     def write_message(self, message):
         if not self.isOpen(): raise PortNotOpenException('Port Closed')
-        self._tx_queue.put(message, True, Comms.QUEUE_FULL_TIMEOUT)
+        with self._tx_lock:
+            self._tx_queue.put(message, True, Comms.QUEUE_FULL_TIMEOUT)
 
     def is_wireless(self):
         """Returns if this comms object uses wireless communications or not.
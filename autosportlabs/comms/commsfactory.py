@@ -50,8 +50,10 @@ def socket_comm(device):
 
 def serial_comm(device):
     from autosportlabs.comms.serial.serialconnection import SerialConnection
-    from autosportlabs.comms.comms import Comms
-    return Comms(device, SerialConnection())
+    from autosportlabs.comms.comms import Comms, TRANSPORT_QUEUE, TRANSPORT_SHARED_MEMORY
+    # serial runs in a separate process; share memory with it where the mapping is inherited on fork
+    transport = TRANSPORT_QUEUE if platform == 'win' else TRANSPORT_SHARED_MEMORY
+    return Comms(device, SerialConnection(), transport=transport)
 
 
 def android_comm(device):
@@ -0,0 +1,109 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+
+__all__ = ('LineFramer',)
+
+DEFAULT_TERMINATOR = '\r\n'
+
+
+class LineFramer(object):
+    """
+    Splits a stream of received data into lines.
+
+    Received data is appended to a single buffer, and the search for the terminator
+    resumes from where the previous search stopped, so each byte is scanned once
+    however the lines are split across reads.
+    """
+
+    def __init__(self, terminator=DEFAULT_TERMINATOR):
+        """
+        :param terminator the line terminator, which is not included in the returned lines
+        :type terminator string
+        """
+        self.terminator = terminator
+        self._buffer = bytearray()
+        # start of the first unreturned line, and where the terminator search resumes
+        self._start = 0
+        self._scan_offset = 0
+
+    def __len__(self):
+        """
+        :return the number of buffered bytes not yet returned as lines
+        """
+        return len(self._buffer) - self._start
+
+    def clear(self):
+        self._buffer = bytearray()
+        self._start = 0
+        self._scan_offset = 0
+
+    def feed(self, data):
+        """
+        Add received data
+        :param data the received data
+        :type data string
+        """
+        self._buffer.extend(data)
+
+    def next_line(self):
+        """
+        Get the next complete line
+        :return the line, or None if no complete line has been received
+        """
+        buf = self._buffer
+        terminator = self.terminator
+        end = buf.find(terminator, self._scan_offset)
+        if end < 0:
+            # the terminator may be split across reads
+            self._scan_offset = max(self._start, len(buf) - len(terminator) + 1)
+            self._compact()
+            return None
+        line = str(buf[self._start:end])
+        self._start = self._scan_offset = end + len(terminator)
+        return line
+
+    def read_lines(self):
+        """
+        Get every complete line received
+        :return list of lines, empty if no complete line has been received
+        """
+        lines = []
+        buf = self._buffer
+        terminator = self.terminator
+        find = buf.find
+        start = self._start
+        end = find(terminator, self._scan_offset)
+        while end >= 0:
+            lines.append(str(buf[start:end]))
+            start = end + len(terminator)
+            end = find(terminator, start)
+        self._start = start
+        self._scan_offset = max(start, len(buf) - len(terminator) + 1)
+        self._compact()
+        return lines
+
+    def _compact(self):
+        # drop the returned lines from the buffer, once there are enough to be worth moving the rest
+        start = self._start
+        if start > 0 and (start == len(self._buffer) or start >= 4096):
+            del self._buffer[:start]
+            self._scan_offset -= start
+            self._start = 0
@@ -0,0 +1,290 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+import asyncore
+import errno
+import heapq
+import select
+import socket
+import threading
+import traceback
+from collections import deque
+from time import time
+from kivy.logger import Logger
+from autosportlabs.util.threadutil import safe_thread_exit
+
+__all__ = ('IoLoop', 'LoopTimer', 'get_io_loop')
+
+
+def _socketpair():
+    """
+    A connected pair of sockets, for waking the loop from other threads
+    """
+    if hasattr(socket, 'socketpair'):
+        return socket.socketpair()
+    # windows: connect a pair over the loopback interface
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        writer = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        writer.connect(listener.getsockname())
+        reader, address = listener.accept()
+        return reader, writer
+    finally:
+        listener.close()
+
+
+class _Waker(asyncore.dispatcher):
+    """
+    Wakes the loop out of its poll when work is posted from another thread
+    """
+
+    def __init__(self, socket_map):
+        reader, self._writer = _socketpair()
+        self._writer.setblocking(0)
+        asyncore.dispatcher.__init__(self, sock=reader, map=socket_map)
+        self._lock = threading.Lock()
+        self._woken = False
+
+    def wake(self):
+        with self._lock:
+            if self._woken:
+                return
+            self._woken = True
+        try:
+            self._writer.send('x')
+        except socket.error as e:
+            # a full buffer means the loop is already due to wake
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        with self._lock:
+            self._woken = False
+        try:
+            self.recv(4096)
+        except socket.error:
+            pass
+
+    def close(self):
+        asyncore.dispatcher.close(self)
+        self._writer.close()
+
+
+class LoopTimer(object):
+    """
+    A callback scheduled on an IoLoop. Returned by IoLoop.call_later and IoLoop.call_repeating
+    """
+
+    def __init__(self, deadline, callback, args, interval=None):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.interval = interval
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class IoLoop(object):
+    """
+    Runs non-blocking socket channels, timers and posted callbacks on a single thread.
+
+    Channels are asyncore dispatchers created with map=io_loop.socket_map. The loop sleeps
+    in a single poll until a socket is ready, a timer is due or work is posted with
+    call_soon_threadsafe, so an idle connection costs no wake-ups.
+
+    Channels are only touched from the loop thread; other threads post work to it with
+    call_soon_threadsafe.
+    """
+    # the longest the loop sleeps with nothing scheduled
+    MAX_POLL_TIMEOUT = 30.0
+
+    def __init__(self):
+        self.socket_map = {}
+        self._timers = []
+        self._timer_sequence = 0
+        self._callbacks = deque()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        self._waker = _Waker(self.socket_map)
+        self._use_poll = hasattr(select, 'poll')
+        # number of times the loop has woken, for measuring
+        self.wakeups = 0
+
+    def start(self):
+        """
+        Start the loop in its own thread
+        """
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name='IoLoop')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stop the loop and close every channel
+        :param timeout the time to wait for the loop thread to exit, or None to wait indefinitely
+        :type timeout float
+        """
+        with self._lock:
+            running = self._running
+            self._running = False
+        if running:
+            self._waker.wake()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    def is_running(self):
+        return self._running
+
+    def in_loop_thread(self):
+        return threading.current_thread() is self._thread
+
+    def call_soon_threadsafe(self, callback, *args):
+        """
+        Run a callback on the loop thread
+        :param callback the function to call
+        :type callback function
+        """
+        self._callbacks.append((callback, args))
+        if not self.in_loop_thread():
+            self._waker.wake()
+
+    def call_later(self, delay, callback, *args):
+        """
+        Run a callback on the loop thread after a delay. May be called from any thread
+        :param delay the delay in seconds
+        :type delay float
+        :param callback the function to call
+        :type callback function
+        :return LoopTimer, which can be cancelled
+        """
+        return self._schedule(LoopTimer(time() + delay, callback, args))
+
+    def call_repeating(self, interval, callback, *args):
+        """
+        Run a callback on the loop thread every interval, until the returned timer is cancelled
+        :param interval the interval in seconds
+        :type interval float
+        :param callback the function to call
+        :type callback function
+        :return LoopTimer, which can be cancelled
+        """
+        return self._schedule(LoopTimer(time() + interval, callback, args, interval))
+
+    def _schedule(self, timer):
+        with self._lock:
+            self._timer_sequence += 1
+            heapq.heappush(self._timers, (timer.deadline, self._timer_sequence, timer))
+        if not self.in_loop_thread():
+            self._waker.wake()
+        return timer
+
+    def _poll_timeout(self):
+        if len(self._callbacks) > 0:
+            return 0
+        with self._lock:
+            timers = self._timers
+            while len(timers) > 0 and timers[0][2].cancelled:
+                heapq.heappop(timers)
+            if len(timers) == 0:
+                return self.MAX_POLL_TIMEOUT
+            return min(self.MAX_POLL_TIMEOUT, max(0, timers[0][0] - time()))
+
+    def _run_callback(self, callback, args):
+        try:
+            callback(*args)
+        except Exception as e:
+            Logger.error('IoLoop: Exception in callback {}: {}'.format(callback, e))
+            Logger.debug(traceback.format_exc())
+
+    def _run_timers(self):
+        now = time()
+        due = []
+        with self._lock:
+            timers = self._timers
+            while len(timers) > 0 and timers[0][0] <= now:
+                due.append(heapq.heappop(timers)[2])
+        for timer in due:
+            if timer.cancelled:
+                continue
+            self._run_callback(timer.callback, timer.args)
+            if timer.interval is not None and not timer.cancelled:
+                # keep to the schedule, unless the loop fell behind by a whole interval
+                timer.deadline = max(timer.deadline + timer.interval, now)
+                self._schedule(timer)
+
+    def _run_callbacks(self):
+        callbacks = self._callbacks
+        for i in range(len(callbacks)):
+            callback, args = callbacks.popleft()
+            self._run_callback(callback, args)
+
+    def _run(self):
+        Logger.info('IoLoop: starting')
+        poll = asyncore.poll2 if self._use_poll else asyncore.poll
+        socket_map = self.socket_map
+        try:
+            while self._running:
+                poll(self._poll_timeout(), socket_map)
+                self.wakeups += 1
+                self._run_callbacks()
+                self._run_timers()
+        except Exception as e:
+            Logger.error('IoLoop: Exception in loop: {}'.format(e))
+            Logger.debug(traceback.format_exc())
+        finally:
+            self._running = False
+            for channel in socket_map.values():
+                try:
+                    channel.close()
+                except Exception:
+                    Logger.debug(traceback.format_exc())
+            Logger.info('IoLoop: exited')
+            safe_thread_exit()
+
+
+_io_loop = None
+_io_loop_lock = threading.Lock()
+
+
+def get_io_loop():
+    """
+    Get the loop shared by the app's connections, starting it on first use
+    :return IoLoop
+    """
+    global _io_loop
+    with _io_loop_lock:
+        if _io_loop is None or not _io_loop.is_running():
+            _io_loop = IoLoop()
+            _io_loop.start()
+        return _io_loop
@@ -22,6 +22,7 @@ import serial
 from serial import SerialException
 from serial.tools import list_ports
 from autosportlabs.comms.commscommon import PortNotOpenException, CommsErrorException
+from autosportlabs.comms.framing import LineFramer
 from kivy.logger import Logger
 
 
@@ -34,7 +35,7 @@ class SerialConnection():
     ser = None
 
     def __init__(self, **kwargs):
-        pass
+        self._framer = LineFramer()
 
     def get_available_devices(self):
         Logger.debug("SerialConnection: getting available devices")
@@ -50,12 +51,14 @@ class SerialConnection():
         return self.ser != None
 
     def open(self, device):
+        self._framer.clear()
         self.ser = serial.Serial(device, timeout=self.timeout, write_timeout=self.writeTimeout)
 
     def close(self):
         if self.ser != None:
             self.ser.close()
         self.ser = None
+        self._framer.clear()
 
     def read(self, count):
         ser = self.ser
@@ -68,16 +71,44 @@ class SerialConnection():
             else:
                 raise
 
+    def _read_available(self):
+        """
+        Read everything waiting in the receive buffer, or wait up to the read timeout for the next byte
+        :return True if any data was read
+        """
+        ser = self.ser
+        if ser == None: raise PortNotOpenException()
+        data = self.read(max(1, ser.in_waiting))
+        if data == '':
+            return False
+        self._framer.feed(data)
+        return True
+
     def read_line(self):
-        msg = ''
+        """
+        Read the next line
+        :return the line, or None if the read timed out
+        """
+        framer = self._framer
         while True:
-            c = self.read(1)
-            if c == '':
+            line = framer.next_line()
+            if line is not None:
+                return line
+            if not self._read_available():
                 return None
-            msg += c
-            if msg[-2:] == '\r\n':
-                msg = msg[:-2]
-                return msg
+
+    def read_lines(self):
+        """
+        Read every complete line received, waiting for at least one
+        :return list of lines, empty if the read timed out
+        """
+        framer = self._framer
+        while True:
+            lines = framer.read_lines()
+            if len(lines) > 0:
+                return lines
+            if not self._read_available():
+                return lines
 
     def write(self, data):
         try:
@@ -0,0 +1,243 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+import ctypes
+import mmap
+import os
+import struct
+from collections import deque
+from time import time
+from Queue import Empty, Full
+from multiprocessing import Lock, Semaphore
+
+__all__ = ('SharedRing',)
+
+# the ring header: head and tail counters on separate cache lines, then the waiting flags.
+# These are accessed through ctypes, which stores each value whole; struct.pack_into
+# clears the field before packing, so the other process could read a zero
+_HEAD_OFFSET = 0
+_TAIL_OFFSET = 64
+_READER_WAITING_OFFSET = 128
+_WRITER_WAITING_OFFSET = 192
+_DATA_OFFSET = 256
+
+_LENGTH = struct.Struct('<I')
+
+# upper bound on a single doorbell wait, covering a wakeup missed between processes
+DOORBELL_MAX_WAIT = 0.25
+
+
+class SharedRing(object):
+    """
+    Single producer, single consumer ring of messages in shared memory.
+    Used in place of a multiprocessing.Queue between the connection process and
+    the app, avoiding a pickle and a pipe write per message.
+
+    Messages are stored as a length prefix followed by the message bytes. The producer
+    only advances the head counter and the consumer only advances the tail counter.
+    The counters are published and read under a shared lock, which is held only for the
+    access itself: its acquire and release are the memory barriers that order the message
+    bytes against the counters on weakly ordered CPUs such as ARM. A side waiting on an empty or full ring sets its waiting
+    flag and sleeps on a doorbell semaphore, which the other side rings only when the flag is set.
+    The consumer takes every message available each time it reads the head counter.
+
+    Provides the put / get subset of the Queue interface, raising Queue.Full and Queue.Empty.
+    """
+    DEFAULT_CAPACITY = 1024 * 1024
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        """
+        :param capacity the size of the ring, in bytes
+        :type capacity int
+        """
+        self.capacity = capacity
+        # windows shares the mapping by name; elsewhere the anonymous mapping is inherited by the child process
+        self._tagname = 'SharedRing-{}-{}'.format(os.getpid(), id(self)) if os.name == 'nt' else None
+        self._readable = Semaphore(0)
+        self._writable = Semaphore(0)
+        self._fence = Lock()
+        self._map()
+
+    def _map(self):
+        if self._tagname is None:
+            self._mm = mmap.mmap(-1, _DATA_OFFSET + self.capacity)
+        else:
+            self._mm = mmap.mmap(-1, _DATA_OFFSET + self.capacity, tagname=self._tagname)
+        self._head = ctypes.c_uint64.from_buffer(self._mm, _HEAD_OFFSET)
+        self._tail = ctypes.c_uint64.from_buffer(self._mm, _TAIL_OFFSET)
+        self._reader_waiting = ctypes.c_int.from_buffer(self._mm, _READER_WAITING_OFFSET)
+        self._writer_waiting = ctypes.c_int.from_buffer(self._mm, _WRITER_WAITING_OFFSET)
+        # messages taken from the ring, not yet returned by get
+        self._received = deque()
+
+    def __getstate__(self):
+        return (self.capacity, self._tagname, self._readable, self._writable, self._fence)
+
+    def __setstate__(self, state):
+        self.capacity, self._tagname, self._readable, self._writable, self._fence = state
+        self._map()
+
+    def _load(self, counter):
+        with self._fence:
+            return counter.value
+
+    def _store(self, counter, value):
+        with self._fence:
+            counter.value = value
+
+    def qsize(self):
+        """
+        :return the number of bytes waiting to be read, including length prefixes
+        """
+        return self._load(self._head) - self._load(self._tail)
+
+    def empty(self):
+        return len(self._received) == 0 and self.qsize() == 0
+
+    def _copy_in(self, position, data):
+        capacity = self.capacity
+        start = position % capacity
+        end = start + len(data)
+        if end <= capacity:
+            self._mm[_DATA_OFFSET + start:_DATA_OFFSET + end] = data
+        else:
+            split = capacity - start
+            self._mm[_DATA_OFFSET + start:_DATA_OFFSET + capacity] = data[:split]
+            self._mm[_DATA_OFFSET:_DATA_OFFSET + end - capacity] = data[split:]
+
+    def _copy_out(self, position, length):
+        capacity = self.capacity
+        start = position % capacity
+        end = start + length
+        if end <= capacity:
+            return self._mm[_DATA_OFFSET + start:_DATA_OFFSET + end]
+        return self._mm[_DATA_OFFSET + start:_DATA_OFFSET + capacity] + self._mm[_DATA_OFFSET:_DATA_OFFSET + end - capacity]
+
+    @staticmethod
+    def _ring(waiting, doorbell):
+        if waiting.value:
+            waiting.value = 0
+            doorbell.release()
+
+    @staticmethod
+    def _wait(ready, waiting, doorbell, block, timeout):
+        """
+        Wait until ready() returns True
+        :return True if ready, False on timeout
+        """
+        if ready():
+            return True
+        if not block:
+            return False
+        deadline = None if timeout is None else time() + timeout
+        while True:
+            waiting.value = 1
+            # the other side may have moved on before it saw the waiting flag
+            if ready():
+                waiting.value = 0
+                doorbell.acquire(False)
+                return True
+            wait = DOORBELL_MAX_WAIT
+            if deadline is not None:
+                wait = min(wait, deadline - time())
+                if wait <= 0:
+                    waiting.value = 0
+                    return ready()
+            doorbell.acquire(True, wait)
+
+    def put(self, message, block=True, timeout=None):
+        """
+        Put a message into the ring
+        :param message the message
+        :type message string
+        :param block wait for space if the ring is full
+        :type block bool
+        :param timeout the maximum time to wait, in seconds, or None to wait indefinitely
+        :type timeout float
+        """
+        size = _LENGTH.size + len(message)
+        capacity = self.capacity
+        # only this side advances the head
+        head = self._head.value
+        if capacity - (head - self._load(self._tail)) < size:
+            if size > capacity:
+                raise ValueError('Message of {} bytes exceeds ring capacity {}'.format(len(message), capacity))
+            tail = self._tail
+            ready = lambda: capacity - (head - self._load(tail)) >= size
+            if not self._wait(ready, self._writer_waiting, self._writable, block, timeout):
+                raise Full
+
+        frame = _LENGTH.pack(len(message)) + message
+        start = head % capacity
+        if start + size <= capacity:
+            self._mm[_DATA_OFFSET + start:_DATA_OFFSET + start + size] = frame
+        else:
+            self._copy_in(head, frame)
+        # publish the message only once its bytes are in place
+        self._store(self._head, head + size)
+        if self._reader_waiting.value:
+            self._ring(self._reader_waiting, self._readable)
+
+    def put_nowait(self, message):
+        self.put(message, False)
+
+    def _receive(self):
+        """
+        Take every message currently in the ring
+        :return True if any messages were taken
+        """
+        # only this side advances the tail
+        tail = self._tail.value
+        head = self._load(self._head)
+        if head == tail:
+            return False
+        data = self._copy_out(tail, head - tail)
+        # free the space only once the bytes are copied out
+        self._store(self._tail, head)
+        self._ring(self._writer_waiting, self._writable)
+
+        received = self._received
+        unpack_from = _LENGTH.unpack_from
+        offset = 0
+        end = len(data)
+        while offset < end:
+            length = unpack_from(data, offset)[0]
+            offset += _LENGTH.size
+            received.append(data[offset:offset + length])
+            offset += length
+        return True
+
+    def get(self, block=True, timeout=None):
+        """
+        Get the next message from the ring
+        :param block wait for a message if the ring is empty
+        :type block bool
+        :param timeout the maximum time to wait, in seconds, or None to wait indefinitely
+        :type timeout float
+        :return the message
+        """
+        received = self._received
+        if len(received) == 0 and not self._receive():
+            if not self._wait(self._receive, self._reader_waiting, self._readable, block, timeout):
+                raise Empty
+        return received.popleft()
+
+    def get_nowait(self):
+        return self.get(False)
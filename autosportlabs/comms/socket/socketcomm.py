@@ -19,63 +19,146 @@
 # this code. If not, see <http://www.gnu.org/licenses/>.
 
 from kivy.logger import Logger
+import asyncore
+import errno
+import logging
 import threading
 import Queue
-from Queue import Empty
-from time import sleep
 import traceback
+from time import time
 from autosportlabs.comms.commscommon import PortNotOpenException
-from autosportlabs.util.threadutil import safe_thread_exit
+from autosportlabs.comms.framing import LineFramer
+from autosportlabs.comms.ioloop import get_io_loop
+from autosportlabs.comms.socket.socketconnection import SocketConnection, InvalidAddressException, READ_TIMEOUT, \
+    check_address
 import socket
 
 
+class _DeviceChannel(asyncore.dispatcher):
+    """
+    Non-blocking socket to a RC device, run by the IoLoop.
+    Received lines are pushed to the SocketComm's rx queue; the tx buffer is written as the socket allows.
+    """
+
+    def __init__(self, comm, socket_map):
+        asyncore.dispatcher.__init__(self, map=socket_map)
+        self._comm = comm
+        self._framer = LineFramer()
+        self._tx_buffer = bytearray()
+        self.last_rx_time = time()
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+
+    def send_data(self, data):
+        self._tx_buffer.extend(data)
+        # write now where the socket allows, rather than waiting for the next poll
+        if self.connected:
+            self.handle_write()
+
+    def writable(self):
+        return not self.connected or len(self._tx_buffer) > 0
+
+    def handle_connect(self):
+        Logger.info('SocketComm: connected to {}'.format(self.addr))
+
+    def handle_read(self):
+        data = self.recv(SocketConnection.MSG_RECEIVE_BUFFER_SIZE)
+        if not data:
+            return
+        self.last_rx_time = time()
+        framer = self._framer
+        framer.feed(data)
+        rx_queue = self._comm._rx_queue
+        for msg in framer.read_lines():
+            if msg:
+                rx_queue.put(msg)
+
+    def handle_write(self):
+        tx_buffer = self._tx_buffer
+        if len(tx_buffer) == 0:
+            return
+        sent = self.send(tx_buffer)
+        if sent > 0:
+            del tx_buffer[:sent]
+            self._comm._tx_sent(sent)
+
+    def handle_close(self):
+        Logger.info('SocketComm: connection closed by device')
+        self.close()
+
+    def handle_error(self):
+        t, v, tb = asyncore.compact_traceback()[1:]
+        if isinstance(v, socket.error) and v.errno == errno.ECONNRESET:
+            Logger.error('SocketComm: connection reset: {}'.format(v))
+        else:
+            Logger.error('SocketComm: error on connection to {}: {} {}'.format(self._comm.device, t, v))
+            Logger.debug(tb)
+        self.close()
+
+    def close(self):
+        asyncore.dispatcher.close(self)
+        self._comm._channel_closed(self)
+
+
 class SocketComm(object):
     """
     Responsible for communicating with a socket connection to a RC device
-     Starts up threads for reading/writing data and pushes/reads data to queues
+     The connection is run by the shared IoLoop; received messages are pushed onto the rx queue
+     and written messages are buffered for the loop to write as the socket allows
     """
     CONNECT_TIMEOUT = 1.0
     DEFAULT_TIMEOUT = 1.0
     QUEUE_FULL_TIMEOUT = 1.0
-    TX_QUEUE_SIZE = 5
+    # pending tx bytes at which writers wait for the socket to drain
+    TX_BUFFER_SIZE = 16384
     KEEP_ALIVE_TIMEOUT_S = 4
-    COMMAND_CLOSE = 'CLOSE'
-    COMMAND_KEEP_ALIVE = 'PING'
+    # close the connection when nothing has been received for this long
+    READ_IDLE_TIMEOUT = 8.0
 
     _timeout = DEFAULT_TIMEOUT
-    _connection_process = None
     _rx_queue = None
-    _tx_queue = None
-    _command_queue = None
 
-    def __init__(self, connection, device):
+    def __init__(self, connection, device, io_loop=None, port=SocketConnection.PORT):
         """Initializes SocketComm, does not open any sockets
         :param connection The connection object to use
         :param device The IP address of the device to connect to
+        :param io_loop The loop to run the connection on, or None for the shared loop
+        :param port The port to connect to
         :type connection SocketConnection
         :type device String
+        :type io_loop IoLoop
+        :type port int
         :return None
         """
         self.device = device
+        self.port = port
         self._connection = connection
+        # without an explicit loop, the shared loop is fetched on each open, in case it has stopped
+        self._shared_loop = io_loop is None
+        self._io_loop = io_loop
+        self._channel = None
+        self._open = False
+        self._closed = threading.Event()
+        self._tx_pending = 0
+        self._tx_condition = threading.Condition()
+        self._last_keep_alive = 0
+        self._connect_timer = None
+        self._check_timer = None
         self.supports_streaming = False
         Logger.info('SocketComm: init')
 
     def start_connection_process(self):
-        """Starts the connection process to the device, starting up a Thread for communication over Queues
+        """Starts the connection to the device on the IoLoop
         :return None
         """
-        rx_queue = Queue.Queue()
-        tx_queue = Queue.Queue(self.TX_QUEUE_SIZE)
-        command_queue = Queue.Queue()
-        connection_thread = threading.Thread(target=self._connection_message_thread, args=(self._connection,
-                                                                                           self.device, rx_queue,
-                                                                                           tx_queue, command_queue))
-        connection_thread.start()
-        self._rx_queue = rx_queue
-        self._tx_queue = tx_queue
-        self._command_queue = command_queue
-        self._connection_process = connection_thread
+        if self._shared_loop:
+            self._io_loop = get_io_loop()
+        self._rx_queue = Queue.Queue()
+        with self._tx_condition:
+            self._tx_pending = 0
+        self._last_keep_alive = time()
+        self._closed.clear()
+        self._open = True
+        self._io_loop.call_soon_threadsafe(self._connect)
 
     def get_available_devices(self):
         """Returns a List of ips that a RC device was found on
@@ -84,10 +167,11 @@ class SocketComm(object):
         return self._connection.get_available_devices()
 
     def isOpen(self):
-        """Returns True if the RC connection is open, False if not
+        """Returns True if the RC connection is open, False if not.
+        The connection is not open once the IoLoop running it has stopped
         :return Boolean
         """
-        return self._connection_process is not None and self._connection_process.is_alive()
+        return self._open and self._io_loop.is_running()
 
     def open(self):
         """Starts the connection process to the RC device
@@ -97,13 +181,10 @@ class SocketComm(object):
             self.start_connection_process()
 
     def keep_alive(self):
-        """Puts a command into the command queue to keep the connection alive
+        """Marks the connection as still in use
         :return None
         """
-        try:
-            self._command_queue.put_nowait(self.COMMAND_KEEP_ALIVE)
-        except:
-            pass
+        self._last_keep_alive = time()
 
     def close(self):
         """Closes the socket connection with the RC device
@@ -111,13 +192,13 @@ class SocketComm(object):
         """
         Logger.debug('SocketComm: close()')
         if self.isOpen():
-            try:
-                Logger.debug('SocketComm: closing connection process')
-                self._command_queue.put_nowait(self.COMMAND_CLOSE)
-                self._connection_process.join(self._timeout * 2)
-                Logger.debug('SocketComm: connection process joined')
-            except:
-                Logger.debug('SocketComm: Timeout joining connection process')
+            Logger.debug('SocketComm: closing connection')
+            if self._io_loop.in_loop_thread():
+                self._close_channel()
+            else:
+                self._io_loop.call_soon_threadsafe(self._close_channel)
+                if not self._closed.wait(self._timeout * 2):
+                    Logger.debug('SocketComm: Timeout closing connection')
 
     def read_message(self):
         """Reads a message from the RX queue and returns it
@@ -131,11 +212,21 @@ class SocketComm(object):
             return None
 
     def write_message(self, message):
-        """Writes a message to the TX queue, which is then written by the tx thread
+        """Buffers a message to be written by the IoLoop.
+        Blocks while the socket is behind by more than TX_BUFFER_SIZE bytes
         :return: None
         """
         if not self.isOpen(): raise PortNotOpenException('Port Closed')
-        self._tx_queue.put(message, True, SocketComm.QUEUE_FULL_TIMEOUT)
+        condition = self._tx_condition
+        with condition:
+            if self._tx_pending >= self.TX_BUFFER_SIZE:
+                condition.wait(self.QUEUE_FULL_TIMEOUT)
+                if self._tx_pending >= self.TX_BUFFER_SIZE:
+                    raise Queue.Full()
+            self._tx_pending += len(message)
+        if Logger.isEnabledFor(logging.DEBUG):
+            Logger.debug("SocketComm: writing message {}".format(message))
+        self._io_loop.call_soon_threadsafe(self._send, message)
 
     def is_wireless(self):
         """Returns if this comms object uses wireless communications or not.
@@ -143,119 +234,82 @@ class SocketComm(object):
         """
         return True
 
-    def _connection_thread_message_reader(self, rx_queue, connection, should_run):
-        """This method is designed to be run in a thread, it will loop infinitely as long as should_run.is_set()
-        returns True. In its loop it will attempt to read data from the socket connection
-
-        :param rx_queue Queue for pushing data read from the socket onto
-        :param connection Socket connection to read data from
-        :param should_run Event to check on each loop to determine if to continue reading
-        :type rx_queue threading.Queue
-        :type connection SocketConnection
-        :type should_run threading.Event
-        :return: None
-        """
-        Logger.debug('SocketComm: connection thread message reader started')
-
-        while should_run.is_set():
-            try:
-                msg = connection.read_line(should_run)
-                if msg:
-                    rx_queue.put(msg)
-            except:
-                Logger.error('SocketComm: Exception in connection_process_message_reader')
-                Logger.debug(traceback.format_exc())
-                should_run.clear()
-                sleep(0.5)
-        Logger.debug('SocketComm: connection process message reader exited')
-        safe_thread_exit()
-
-    def _connection_thread_message_writer(self, tx_queue, connection, should_run):
-        """This method is designed to be run in a thread, it will loop infinitely as long as should_run.is_set()
-        returns True. In its loop it will attempt to write pending data from the socket connection
-
-        :param tx_queue Queue for pulling data to be written to the socket
-        :param connection Socket connection to write data to
-        :param should_run Event to check on each loop to determine if to continue writing
-        :type tx_queue threading.Queue
-        :type connection SocketConnection
-        :type should_run threading.Event
-        :return: None
-        """
-        Logger.info('SocketComm: connection thread message writer started')
-        while should_run.is_set():
-            try:
-                message = tx_queue.get(True, 1.0)
-                if message:
-                    Logger.debug("SocketComm: writing message {}".format(message))
-                    connection.write(message)
-            except Empty:
-                pass
-            except Exception as e:
-                Logger.error('SocketComm: Exception in connection_thread_message_writer ' + str(e))
-                Logger.debug(traceback.format_exc())
-                should_run.clear()
-                sleep(0.5)
-        Logger.debug('SocketComm: connection thread message writer exited')
-        safe_thread_exit()
-
-    def _connection_message_thread(self, connection, address, rx_queue, tx_queue, command_queue):
-        """
-        'Manager' method that is run in a thread that starts up the read and write threads for the socket
-         connection. Watches the command_queue to know when to stop
-
-        :param connection: Socket connection
-        :param address: IP address to connect to
-        :param rx_queue: Receive queue
-        :param tx_queue: Transmit queue
-        :param command_queue: Command queue
-        :return: None
-        """
-        Logger.info('SocketComm: connection process starting')
+    # The following are run on the IoLoop
 
+    def _connect(self):
+        Logger.info('SocketComm: connecting to {}'.format(self.device))
+        io_loop = self._io_loop
+        try:
+            check_address(self.device)
+            channel = _DeviceChannel(self, io_loop.socket_map)
+        except InvalidAddressException as e:
+            Logger.error('SocketComm: Exception setting up connection: ' + str(e))
+            self._set_closed()
+            return
+        except socket.error as e:
+            Logger.error('SocketComm: socket error setting up connection: ' + str(type(e)) + str(e))
+            self._set_closed()
+            return
+        self._channel = channel
+        self._connect_timer = io_loop.call_later(READ_TIMEOUT, self._check_connected, channel)
+        self._check_timer = io_loop.call_repeating(self.KEEP_ALIVE_TIMEOUT_S, self._check_connection)
         try:
-            connection.open(address)
-            connection.flushInput()
-            connection.flushOutput()
-
-            reader_writer_should_run = threading.Event()
-            reader_writer_should_run.set()
-
-            reader_thread = threading.Thread(target=self._connection_thread_message_reader, args=(rx_queue, connection,
-                                                                                            reader_writer_should_run))
-            reader_thread.start()
-
-            writer_thread = threading.Thread(target=self._connection_thread_message_writer, args=(tx_queue, connection,
-                                                                                            reader_writer_should_run))
-            writer_thread.start()
-
-            while reader_writer_should_run.is_set():
-                try:
-                    command = command_queue.get(True, self.KEEP_ALIVE_TIMEOUT_S)
-                    if command == self.COMMAND_CLOSE:
-                        Logger.debug('SocketComm: connection thread: got close command')
-                        reader_writer_should_run.clear()
-                except Empty:
-                    Logger.debug('SocketComm: keep alive timeout')
-            Logger.debug('SocketComm: connection worker exiting')
-
-            reader_thread.join()
-            writer_thread.join()
-
-            try:
-                connection.close()
-            except:
-                Logger.error('SocketComm: Exception closing connection worker connection')
-                Logger.error(traceback.format_exc())
-        except socket.timeout as e:
-            Logger.error("SocketComm: got timeout connecting to {}".format(address))
+            channel.connect((self.device, self.port))
         except socket.error as e:
-            Logger.error("SocketComm: got exception connecting to {}".format(address))
-            Logger.error('SocketComm: socket error setting up connection thread: ' + str(type(e)) + str(e))
-        except Exception as e:
-            Logger.error('SocketComm: Exception setting up connection thread: ' + str(type(e)) + str(e))
-            Logger.debug(traceback.format_exc())
+            Logger.error("SocketComm: got exception connecting to {}".format(self.device))
+            Logger.error('SocketComm: socket error setting up connection: ' + str(type(e)) + str(e))
+            channel.close()
+
+    def _check_connected(self, channel):
+        if channel is self._channel and not channel.connected:
+            Logger.error("SocketComm: got timeout connecting to {}".format(self.device))
+            channel.close()
+
+    def _send(self, message):
+        channel = self._channel
+        if channel is not None:
+            channel.send_data(message)
+
+    def _tx_sent(self, count):
+        condition = self._tx_condition
+        with condition:
+            self._tx_pending = max(0, self._tx_pending - count)
+            condition.notify_all()
+
+    def _check_connection(self):
+        channel = self._channel
+        if channel is None:
+            return
+        now = time()
+        if not channel.connected:
+            return
+        if now - channel.last_rx_time > self.READ_IDLE_TIMEOUT:
+            Logger.error('SocketComm: nothing received for {}s, closing'.format(self.READ_IDLE_TIMEOUT))
+            channel.close()
+            return
+        if now - self._last_keep_alive > self.KEEP_ALIVE_TIMEOUT_S:
+            Logger.debug('SocketComm: keep alive timeout')
+
+    def _close_channel(self):
+        channel = self._channel
+        if channel is not None:
+            channel.close()
+        else:
+            self._set_closed()
 
-        Logger.debug('SocketComm: connection worker exited')
-        safe_thread_exit()
+    def _channel_closed(self, channel):
+        if channel is self._channel:
+            self._channel = None
+            self._set_closed()
 
+    def _set_closed(self):
+        for timer in (self._connect_timer, self._check_timer):
+            if timer is not None:
+                timer.cancel()
+        self._connect_timer = self._check_timer = None
+        self._open = False
+        with self._tx_condition:
+            self._tx_pending = 0
+            self._tx_condition.notify_all()
+        self._closed.set()
+        Logger.debug('SocketComm: connection closed')
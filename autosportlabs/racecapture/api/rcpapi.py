@@ -19,27 +19,26 @@
 # this code. If not, see <http://www.gnu.org/licenses/>.
 
 import io
-import json
+import logging
 import traceback
 import Queue
+from collections import deque
 from time import sleep
 from threading import Thread, RLock, Event
 from autosportlabs.racecapture.config.rcpconfig import *
 from autosportlabs.comms.commscommon import PortNotOpenException, CommsErrorException
 from autosportlabs.util.threadutil import safe_thread_exit, ThreadSafeDict
+from autosportlabs.util.jsoncodec import JsonCodec
+from autosportlabs.racecapture.data.sampledata import BINARY_SAMPLE_MARKER
 from autosportlabs.racecapture.config.rcpconfig import Capabilities
+from autosportlabs.racecapture.config.configdiff import ConfigSnapshot, build_write_plan, \
+    TRACK_ADD_MODE_IN_PROGRESS, TRACK_ADD_MODE_COMPLETE, SCRIPT_ADD_MODE_IN_PROGRESS, SCRIPT_ADD_MODE_COMPLETE
 from autosportlabs.racecapture.api.apicontext import ApiDispatcher
 from functools import partial
 from kivy.clock import Clock
-from kivy.logger import Logger
+from kivy.logger import Logger, LOG_LEVELS
 from traceback import print_stack
 
-TRACK_ADD_MODE_IN_PROGRESS = 1
-TRACK_ADD_MODE_COMPLETE = 2
-
-SCRIPT_ADD_MODE_IN_PROGRESS = 1
-SCRIPT_ADD_MODE_COMPLETE = 2
-
 DEFAULT_LEVEL2_RETRIES = 3
 DEFAULT_MSG_RX_TIMEOUT = 1
 
@@ -50,19 +49,32 @@ DEFAULT_READ_RETRIES = 2
 COMMS_KEEP_ALIVE_TIMEOUT = 2
 
 NO_DATA_AVAILABLE_DELAY = 0.1
+
+# config sections read on every connect, regardless of the device config cache
+UNCACHED_CONFIGS = ('ver', 'capabilities')
+
+# number of commands of a sequence sent ahead of their replies. 1 waits for
+# each reply before sending the next command
+DEFAULT_COMMAND_WINDOW = 1
+
+# message name binary sample frames are dispatched under
+BINARY_SAMPLE_MSG = 'sbin'
 class RcpCmd:
     name = None
     cmd = None
     payload = None
     index = None
     option = None
-    def __init__(self, name, cmd, payload=None, index=None, option=None, last=None):
+    def __init__(self, name, cmd, payload=None, index=None, option=None, last=None, barrier=False):
         self.name = name
         self.cmd = cmd
         self.payload = payload
         self.index = index
         self.option = option
         self.last = last
+        # a barrier command commits earlier commands on the device, so it is only
+        # sent once every command before it in the sequence has been acknowledged
+        self.barrier = barrier
 
 class CommandSequence():
     command_list = None
@@ -102,6 +114,12 @@ class RcpApi:
         self._disconnect_listeners = []
         self._connect_listeners = []
         self.connected_version = None
+        self._codec = JsonCodec()
+        self.command_window = kwargs.get('command_window', DEFAULT_COMMAND_WINDOW)
+        # configuration last read from / written to the connected device
+        self._config_snapshot = None
+        # optional DeviceConfigCache for skipping unchanged config sections on connect
+        self.config_cache = kwargs.get('config_cache')
 
         if on_disconnect:
             self.add_disconnect_listener(on_disconnect)
@@ -117,6 +135,14 @@ class RcpApi:
         '''
         return self.connected_version is not None
 
+    @property
+    def codec(self):
+        '''
+        The codec used for messages; exposes per message decode counters
+        :returns JsonCodec
+        '''
+        return self._codec
+
     def add_disconnect_listener(self, func):
         self._disconnect_listeners.append(func)
 
@@ -139,6 +165,7 @@ class RcpApi:
 
     def recover_connection(self):
         self.connected_version = None
+        self._config_snapshot = None
         self._notify_disconnect_listeners()
 
         if self._enable_autodetect.is_set():
@@ -223,20 +250,24 @@ class RcpApi:
     def msg_rx_worker(self):
         Logger.info('RCPAPI: msg_rx_worker starting')
         comms = self.comms
+        codec = self._codec
+        trace_level = LOG_LEVELS['trace']
         error_count = 0
         while self._running.is_set():
             msg = None
             try:
                 msg = comms.read_message()
                 if msg:
-                    # clean incoming string, and drop illegal characters
-                    msg = unicode(msg, errors='ignore')
-                    msg_json = json.loads(msg, strict=False)
-
-                    if 's' in msg_json:
-                        Logger.trace('RCPAPI: Rx: ' + str(msg))
+                    if msg.startswith(BINARY_SAMPLE_MARKER):
+                        # binary sample frames are decoded by the listener against the channel meta
+                        msg_json = {BINARY_SAMPLE_MSG: msg}
                     else:
-                        Logger.debug('RCPAPI: Rx: ' + str(msg))
+                        # the codec drops illegal characters from the incoming string
+                        msg_json = codec.decode(msg)
+
+                    level = trace_level if 's' in msg_json or BINARY_SAMPLE_MSG in msg_json else logging.DEBUG
+                    if Logger.isEnabledFor(level):
+                        Logger.log(level, 'RCPAPI: Rx: ' + str(msg))
                     Clock.schedule_once(lambda dt: self.on_rx(True))
                     error_count = 0
                     self._dispatch_message(msg_json)
@@ -272,7 +303,7 @@ class RcpApi:
         self.comms.write_message(' ')
 
     def notifyProgress(self, count, total):
-        if self.on_progress:
+        if self.on_progress and total > 0:
             Clock.schedule_once(lambda dt: self.on_progress((float(count) / float(total)) * 100))
 
     def executeSingle(self, cmd, win_callback, fail_callback):
@@ -308,60 +339,11 @@ class RcpApi:
 
                 if not comms.isOpen(): self.run_auto_detect()
 
-                q = self.cmdSequenceQueue
-
                 responseResults = {}
-                cmdCount = 0
-                cmdLength = len(command_list)
-                self.notifyProgress(cmdCount, cmdLength)
                 try:
-                    for rcpCmd in command_list:
-                        payload = rcpCmd.payload
-                        index = rcpCmd.index
-                        option = rcpCmd.option
-                        last = rcpCmd.last
-
-                        level2Retry = 0
-                        name = rcpCmd.name
-                        result = None
-
-                        self.addListener(name, self.rcpCmdComplete)
-                        while not result and level2Retry <= self.level_2_retries:
-                            args = []
-                            if payload is not None:
-                                args.append(payload)
-                            if index is not None:
-                                args.append(index)
-                            if option is not None:
-                                args.append(option)
-                            if last is not None:
-                                args.append(last)
-                            rcpCmd.cmd(*args)
-                            retry = 0
-                            while not result and retry < DEFAULT_READ_RETRIES:
-                                try:
-                                    result = q.get(True, self.msg_rx_timeout)
-                                    msgName = result.keys()[0]
-                                    if not msgName == name:
-                                        Logger.warn('RCPAPI: rx message did not match expected name ' + str(name) + '; ' + str(msgName))
-                                        result = None
-                                except Exception as e:
-                                    Logger.warn('RCPAPI: Read message timeout waiting for {}'.format(name))
-                                    self.recoverTimeout()
-                                    retry += 1
-                            if not result:
-                                Logger.warn('RCPAPI: Level 2 retry for (' + str(level2Retry) + ') ' + name)
-                                level2Retry += 1
-
-
-                        if not result:
-                            raise Exception('Timeout waiting for ' + name)
-
-
-                        responseResults[name] = result[name]
-                        self.removeListener(name, self.rcpCmdComplete)
-                        cmdCount += 1
-                        self.notifyProgress(cmdCount, cmdLength)
+                    replies = self._run_command_sequence(command_list)
+                    for rcpCmd, reply in zip(command_list, replies):
+                        responseResults[rcpCmd.name] = reply[rcpCmd.name]
 
                     if rootName:
                         callback = self.callback_factory(winCallback, {rootName: responseResults})
@@ -392,6 +374,106 @@ class RcpApi:
         Logger.info('RCPAPI: cmd_sequence_worker exiting')
         safe_thread_exit()
 
+    def _send_rcp_cmd(self, rcpCmd):
+        args = []
+        if rcpCmd.payload is not None:
+            args.append(rcpCmd.payload)
+        if rcpCmd.index is not None:
+            args.append(rcpCmd.index)
+        if rcpCmd.option is not None:
+            args.append(rcpCmd.option)
+        if rcpCmd.last is not None:
+            args.append(rcpCmd.last)
+        rcpCmd.cmd(*args)
+
+    def _read_reply(self, name):
+        q = self.cmdSequenceQueue
+        for retry in range(DEFAULT_READ_RETRIES):
+            try:
+                return q.get(True, self.msg_rx_timeout)
+            except Queue.Empty:
+                Logger.warn('RCPAPI: Read message timeout waiting for {}'.format(name))
+                self.recoverTimeout()
+        return None
+
+    def _run_command_sequence(self, command_list):
+        """
+        Sends a sequence of commands and collects their replies. Up to command_window
+        commands are sent ahead of their replies. The device replies in the order commands
+        are sent, so each reply is matched to its send by position: sends before it whose reply
+        has a different name are taken as lost, and a reply to a command that was sent again
+        after it completed is discarded. If the oldest outstanding command times out,
+        every outstanding command is sent again, in order, up to level_2_retries times.
+        :param command_list the commands to send
+        :type command_list list of RcpCmd
+        :return list of replies, in command order
+        """
+        command_count = len(command_list)
+        window = max(1, self.command_window)
+        replies = [None] * command_count
+        attempts = [0] * command_count
+        in_flight = deque()
+        # command indexes in the order they were sent, awaiting their replies
+        sent = deque()
+        next_index = 0
+        completed = 0
+        # drop replies left over from an earlier sequence
+        while not self.cmdSequenceQueue.empty():
+            self.cmdSequenceQueue.get_nowait()
+
+        def send(index):
+            self._send_rcp_cmd(command_list[index])
+            attempts[index] += 1
+            sent.append(index)
+
+        names = set([rcpCmd.name for rcpCmd in command_list])
+        for name in names:
+            self.addListener(name, self.rcpCmdComplete)
+        try:
+            self.notifyProgress(completed, command_count)
+            while completed < command_count:
+                while next_index < command_count and len(in_flight) < window:
+                    rcpCmd = command_list[next_index]
+                    if rcpCmd.barrier and len(in_flight) > 0:
+                        break
+                    send(next_index)
+                    in_flight.append(next_index)
+                    next_index += 1
+                    if rcpCmd.barrier:
+                        break
+
+                oldest = in_flight[0]
+                name = command_list[oldest].name
+                reply = self._read_reply(name)
+                if reply is None:
+                    if attempts[oldest] > self.level_2_retries:
+                        raise Exception('Timeout waiting for ' + name)
+                    Logger.warn('RCPAPI: Level 2 retry for (' + str(attempts[oldest] - 1) + ') ' + name)
+                    for index in in_flight:
+                        send(index)
+                    continue
+
+                msgName = reply.keys()[0]
+                while len(sent) > 0 and command_list[sent[0]].name != msgName:
+                    sent.popleft()
+                if len(sent) == 0:
+                    Logger.warn('RCPAPI: rx message did not match expected name ' + str(name) + '; ' + str(msgName))
+                    continue
+
+                index = sent.popleft()
+                if replies[index] is not None:
+                    # the reply to a command sent again, after the first reply arrived
+                    continue
+
+                in_flight.remove(index)
+                replies[index] = reply
+                completed += 1
+                self.notifyProgress(completed, command_count)
+        finally:
+            for name in names:
+                self.removeListener(name, self.rcpCmdComplete)
+        return replies
+
     def callback_factory(self, callback, *args):
         """
         This function returns a function that when called, will call the argument callback with the remaining arguments
@@ -417,10 +499,10 @@ class RcpApi:
 
             comms = self.comms
 
-            cmdStr = json.dumps(cmd, separators=(',', ':')) + \
-                                                 self.COMMAND_DELIMETER
+            cmdStr = self._codec.encode(cmd) + self.COMMAND_DELIMETER
 
-            Logger.debug('RCPAPI: Tx: ' + cmdStr)
+            if Logger.isEnabledFor(logging.DEBUG):
+                Logger.debug('RCPAPI: Tx: ' + cmdStr)
             comms.write_message(cmdStr)
         except Exception as e:
             Logger.debug(traceback.format_exc())
@@ -450,6 +532,7 @@ class RcpApi:
 
     def getRcpCfgCallback(self, cfg, rcpCfgJson, winCallback):
         cfg.fromJson(rcpCfgJson)
+        self._config_snapshot = ConfigSnapshot.from_config(cfg)
         winCallback(cfg)
 
     def getRcpCfg(self, cfg, winCallback, failCallback):
@@ -504,99 +587,67 @@ class RcpApi:
             if capabilities.has_camera_control:
                 cmdSequence.append(RcpCmd('camCtrlCfg', self.get_camera_control_config))
 
-            self._queue_multiple(cmdSequence, 'rcpCfg', lambda rcpJson: self.getRcpCfgCallback(cfg, rcpJson, winCallback), failCallback)
+            serial = self.connected_version.serial if self.connected_version else None
+            if capabilities.has_config_hashes and self.config_cache is not None and serial:
+                self.executeSingle(RcpCmd('cfgHash', self.get_config_hashes),
+                                   lambda hashes_json: query_changed_configs(cmdSequence, serial,
+                                                                             hashes_json.get('cfgHash') or {}),
+                                   failCallback)
+            else:
+                self._queue_multiple(cmdSequence, 'rcpCfg', lambda rcpJson: self.getRcpCfgCallback(cfg, rcpJson, winCallback), failCallback)
+
+        def query_changed_configs(cmdSequence, serial, hashes):
+            # only read the sections whose hash differs from the cached copy
+            cached = self.config_cache.load(serial, hashes)
+            changedSequence = [c for c in cmdSequence if c.name in UNCACHED_CONFIGS or c.name not in cached]
+            Logger.info('RCPAPI: Reading {} of {} config sections; the rest are unchanged since the last read'.format(
+                len(changedSequence), len(cmdSequence)))
+
+            def changed_configs_read(rcpJson):
+                sections = rcpJson.get('rcpCfg', {})
+                try:
+                    self.config_cache.store(serial, hashes, sections)
+                except Exception as e:
+                    Logger.warn('RCPAPI: Could not update device config cache: {}'.format(e))
+                merged = dict(cached)
+                merged.update(sections)
+                self.getRcpCfgCallback(cfg, {'rcpCfg': merged}, winCallback)
+
+            self._queue_multiple(changedSequence, 'rcpCfg', changed_configs_read, failCallback)
 
         # First we need to get capabilities, then figure out what to query
         self.executeSingle(RcpCmd('capabilities', self.getCapabilities), query_available_configs, failCallback)
 
+    def get_config_hashes(self):
+        self.sendGet('getCfgHash')
+
     def get_capabilities(self, success_cb, fail_cb):
         # Capabilities object also needs version info
         self.executeSingle(RcpCmd('capabilities', self.getCapabilities), success_cb, fail_cb)
 
     def writeRcpCfg(self, cfg, winCallback=None, failCallback=None):
-        cmdSequence = []
-
-        connCfg = cfg.connectivityConfig
-        if connCfg.stale:
-            cmdSequence.append(RcpCmd('setConnCfg', self.setConnectivityCfg, connCfg.toJson()))
-
-        gpsCfg = cfg.gpsConfig
-        if gpsCfg.stale:
-            cmdSequence.append(RcpCmd('setGpsCfg', self.setGpsCfg, gpsCfg.toJson()))
-
-        lapCfg = cfg.lapConfig
-        if lapCfg.stale:
-            cmdSequence.append(RcpCmd('setLapCfg', self.setLapCfg, lapCfg.toJson()))
-
-        imuCfg = cfg.imuConfig
-        for i in range(imuCfg.channelCount):
-            imuChannel = imuCfg.channels[i]
-            if imuChannel.stale:
-                cmdSequence.append(RcpCmd('setImuCfg', self.setImuCfg, imuChannel.toJson(), i))
-
-        analogCfg = cfg.analogConfig
-        for i in range(analogCfg.channelCount):
-            analogChannel = analogCfg.channels[i]
-            if analogChannel.stale:
-                cmdSequence.append(RcpCmd('setAnalogCfg', self.setAnalogCfg, analogChannel.toJson(), i))
-
-        timerCfg = cfg.timerConfig
-        for i in range(timerCfg.channelCount):
-            timerChannel = timerCfg.channels[i]
-            if timerChannel.stale:
-                cmdSequence.append(RcpCmd('setTimerCfg', self.setTimerCfg, timerChannel.toJson(), i))
-
-        gpioCfg = cfg.gpioConfig
-        for i in range(gpioCfg.channelCount):
-            gpioChannel = gpioCfg.channels[i]
-            if gpioChannel.stale:
-                cmdSequence.append(RcpCmd('setGpioCfg', self.setGpioCfg, gpioChannel.toJson(), i))
-
-        pwmCfg = cfg.pwmConfig
-        for i in range(pwmCfg.channelCount):
-            pwmChannel = pwmCfg.channels[i]
-            if pwmChannel.stale:
-                cmdSequence.append(RcpCmd('setPwmCfg', self.setPwmCfg, pwmChannel.toJson(), i))
-
-        canCfg = cfg.canConfig
-        if canCfg.stale:
-            cmdSequence.append(RcpCmd('setCanCfg', self.setCanCfg, canCfg.toJson()))
-
-        obd2Cfg = cfg.obd2Config
-        if obd2Cfg.stale:
-            self.sequence_write_obd2_channels(obd2Cfg.toJson(), cmdSequence)
-
-        can_channels = cfg.can_channels
-        if can_channels.stale:
-            self.sequence_write_can_channels(can_channels.to_json_dict(), cmdSequence)
-
-        trackCfg = cfg.trackConfig
-        if trackCfg.stale:
-            cmdSequence.append(RcpCmd('setTrackCfg', self.setTrackCfg, trackCfg.toJson()))
-
-        scriptCfg = cfg.scriptConfig
-        if scriptCfg.stale:
-            self.sequenceWriteScript(scriptCfg.toJson(), cmdSequence)
-
-        trackDb = cfg.trackDb
-        if trackDb.stale:
-            self.sequenceWriteTrackDb(trackDb.toJson(), cmdSequence)
-
-        wifi_config = cfg.wifi_config
-        if wifi_config.stale:
-            cmdSequence.append(RcpCmd('setWifiCfg', self.set_wifi_config, wifi_config.to_json()))
-
-        sdlog_control_config = cfg.sd_logging_control_config
-        if sdlog_control_config.stale:
-            cmdSequence.append(RcpCmd('setSdLogCtrlCfg', self.set_sdlog_control_config, sdlog_control_config.to_json_dict()))
-
-        camera_control_config = cfg.camera_control_config
-        if camera_control_config.stale:
-            cmdSequence.append(RcpCmd('setCamCtrlCfg', self.set_camera_control_config, camera_control_config.to_json_dict()))
-
-        cmdSequence.append(RcpCmd('flashCfg', self.sendFlashConfig))
-
-        self._queue_multiple(cmdSequence, 'setRcpCfg', winCallback, failCallback)
+        """
+        Writes the stale parts of the configuration to the device. Once the configuration
+        has been read from the device, only the channels, script pages and tracks that differ
+        from what was read are written, and flashCfg is skipped if nothing it persists changed.
+        :param cfg the configuration to write
+        :type cfg RcpConfig
+        :return WritePlan describing the commands sent
+        """
+        encode = lambda msg: self._codec.encode(msg) + self.COMMAND_DELIMETER
+        plan = build_write_plan(cfg, self._config_snapshot, encode)
+        Logger.info('RCPAPI: Writing config: {}'.format(plan))
+
+        cmdSequence = [RcpCmd(c.name, self.sendCommand, c.msg, barrier=c.barrier) for c in plan.commands]
+
+        def write_win(result):
+            if self._config_snapshot is not None:
+                self._config_snapshot = self._config_snapshot.updated(plan.written_values)
+            if winCallback:
+                winCallback(result)
+
+        self._queue_multiple(cmdSequence, 'setRcpCfg', write_win, failCallback)
+        return plan
 
     def resetDevice(self, bootloader=False, reset_delay=0):
         if bootloader:
@@ -680,11 +731,12 @@ class RcpApi:
             index = 0
             if channels_len > 0:
                 for c in channels:
-                    cmd_sequence.append(RcpCmd('setObd2Cfg', self.set_obd2_channel_config, [c], index, enabled, index == channels_len - 1))
+                    last = index == channels_len - 1
+                    cmd_sequence.append(RcpCmd('setObd2Cfg', self.set_obd2_channel_config, [c], index, enabled, last, barrier=last))
                     index += 1
             else:
                 # if we've removed all channels, send message with empty channel array
-                cmd_sequence.append(RcpCmd('setObd2Cfg', self.set_obd2_channel_config, [], index, enabled, True))
+                cmd_sequence.append(RcpCmd('setObd2Cfg', self.set_obd2_channel_config, [], index, enabled, True, barrier=True))
 
     def set_obd2_channel_config(self, obd2_channels, index, enabled, last):
         """
@@ -707,11 +759,12 @@ class RcpApi:
             index = 0
             if channels_len > 0:
                 for c in channels:
-                    cmd_sequence.append(RcpCmd('setCanChanCfg', self.set_can_channel_config, [c], index, enabled, index == channels_len - 1))
+                    last = index == channels_len - 1
+                    cmd_sequence.append(RcpCmd('setCanChanCfg', self.set_can_channel_config, [c], index, enabled, last, barrier=last))
                     index += 1
             else:
                 # if we've removed all channels, send message with empty channel array
-                cmd_sequence.append(RcpCmd('setCanChanCfg', self.set_can_channel_config, [], index, enabled, True))
+                cmd_sequence.append(RcpCmd('setCanChanCfg', self.set_can_channel_config, [], index, enabled, True, barrier=True))
 
     def set_can_channel_config(self, can_channels, index, enabled, last):
         """
@@ -750,8 +803,18 @@ class RcpApi:
     def set_camera_control_config(self, camera_control_config):
         self.sendSet('setCamCtrlCfg', camera_control_config)
 
-    def start_telemetry(self, rate):
-        self.sendSet('setTelemetry', {'rate': rate})
+    def start_telemetry(self, rate, binary=False):
+        '''
+        Starts streaming samples from the device
+        :param rate the sample rate, in Hz
+        :type rate int
+        :param binary True to request binary sample frames; requires Capabilities.has_binary_streaming
+        :type binary bool
+        '''
+        telemetry = {'rate': rate}
+        if binary:
+            telemetry['bin'] = 1
+        self.sendSet('setTelemetry', telemetry)
 
     def stop_telemetry(self):
         self.sendSet('setTelemetry', {'rate': 0})
@@ -776,10 +839,12 @@ class RcpApi:
                 scr = script[:256]
                 script = script[256:]
                 mode = SCRIPT_ADD_MODE_IN_PROGRESS if len(script) > 0 else SCRIPT_ADD_MODE_COMPLETE
-                cmdSequence.append(RcpCmd('setScriptCfg', self.setScriptPage, scr, page, mode))
+                cmdSequence.append(RcpCmd('setScriptCfg', self.setScriptPage, scr, page, mode,
+                                          barrier=mode == SCRIPT_ADD_MODE_COMPLETE))
                 page = page + 1
             else:
-                cmdSequence.append(RcpCmd('setScriptCfg', self.setScriptPage, script, page, SCRIPT_ADD_MODE_COMPLETE))
+                cmdSequence.append(RcpCmd('setScriptCfg', self.setScriptPage, script, page, SCRIPT_ADD_MODE_COMPLETE,
+                                          barrier=True))
                 break
 
     def sendRunScript(self):
@@ -818,10 +883,11 @@ class RcpApi:
                 trackCount = len(tracksJson)
                 for trackJson in tracksJson:
                     mode = TRACK_ADD_MODE_IN_PROGRESS if index < trackCount - 1 else TRACK_ADD_MODE_COMPLETE
-                    cmdSequence.append(RcpCmd('addTrackDb', self.addTrackDb, trackJson, index, mode))
+                    cmdSequence.append(RcpCmd('addTrackDb', self.addTrackDb, trackJson, index, mode,
+                                              barrier=mode == TRACK_ADD_MODE_COMPLETE))
                     index += 1
             else:
-                cmdSequence.append(RcpCmd('addTrackDb', self.addTrackDb, [], index, TRACK_ADD_MODE_COMPLETE))
+                cmdSequence.append(RcpCmd('addTrackDb', self.addTrackDb, [], index, TRACK_ADD_MODE_COMPLETE, barrier=True))
 
     def addTrackDb(self, trackJson, index, mode):
         return self.sendCommand({'addTrackDb':
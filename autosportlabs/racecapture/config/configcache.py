@@ -0,0 +1,103 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import json
+from kivy.logger import Logger
+
+__all__ = ('DeviceConfigCache',)
+
+
+class DeviceConfigCache(object):
+    """
+    On-disk cache of the configuration read from each device, keyed by device serial number.
+    Each config section is stored with the hash the device reported for it, and is only
+    returned while the device still reports the same hash.
+    """
+    CACHE_SUBDIR = 'device_configs'
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def _get_path(self, serial):
+        safe_serial = ''.join(c for c in serial if c.isalnum() or c in '-_')
+        return os.path.join(self.cache_dir, safe_serial + '.json')
+
+    def _read(self, serial):
+        path = self._get_path(serial)
+        if not os.path.isfile(path):
+            return {}
+        try:
+            with open(path) as cache_file:
+                return json.load(cache_file).get('sections', {})
+        except Exception as e:
+            Logger.warn('DeviceConfigCache: Ignoring unreadable cache {}: {}'.format(path, e))
+            return {}
+
+    def load(self, serial, hashes):
+        """
+        Load the cached config sections that are unchanged on the device
+        :param serial the device serial number
+        :type serial string
+        :param hashes the current hash of each config section, as reported by the device
+        :type hashes dict
+        :return dict of section name => section json
+        """
+        sections = {}
+        for name, entry in self._read(serial).iteritems():
+            section_hash = hashes.get(name)
+            if section_hash is not None and entry.get('hash') == section_hash:
+                sections[name] = entry.get('cfg')
+        return sections
+
+    def store(self, serial, hashes, sections):
+        """
+        Store config sections read from the device. Previously cached sections
+        are kept as long as their hash is unchanged.
+        :param serial the device serial number
+        :type serial string
+        :param hashes the current hash of each config section, as reported by the device
+        :type hashes dict
+        :param sections dict of section name => section json, as read from the device
+        :type sections dict
+        """
+        cached = self._read(serial)
+        entries = dict((name, entry) for name, entry in cached.iteritems()
+                       if hashes.get(name) is not None and entry.get('hash') == hashes.get(name))
+        for name, section in sections.iteritems():
+            section_hash = hashes.get(name)
+            if section_hash is not None:
+                entries[name] = {'hash': section_hash, 'cfg': section}
+
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        path = self._get_path(serial)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as cache_file:
+            json.dump({'sections': entries}, cache_file, separators=(',', ':'))
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(temp_path, path)
+
+    def clear(self, serial):
+        path = self._get_path(serial)
+        if os.path.exists(path):
+            os.remove(path)
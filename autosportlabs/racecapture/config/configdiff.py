@@ -0,0 +1,286 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Write plans for sending an RcpConfig to the device. A ConfigSnapshot records the
+configuration last read from (or written to) the device; build_write_plan compares
+the edited configuration against it so only the changed channels, pages and tracks
+are sent.
+"""
+
+import json
+from copy import deepcopy
+
+__all__ = ('ConfigSnapshot', 'WriteCommand', 'WritePlan', 'build_write_plan')
+
+SCRIPT_PAGE_SIZE = 256
+
+TRACK_ADD_MODE_IN_PROGRESS = 1
+TRACK_ADD_MODE_COMPLETE = 2
+
+SCRIPT_ADD_MODE_IN_PROGRESS = 1
+SCRIPT_ADD_MODE_COMPLETE = 2
+
+# these are stored by the device when their final command arrives; everything
+# else is only persisted by flashCfg
+SELF_PERSISTING_COMMANDS = ('setScriptCfg', 'addTrackDb')
+
+
+def _channel_values(name, channel_config):
+    return [((name, i), channel_config.channels[i].toJson(), channel_config.channels[i].stale)
+            for i in range(channel_config.channelCount)]
+
+
+def _config_values(rcp_config):
+    """
+    The values written for each part of the configuration, in write order. Keys are
+    (command name, channel index), with a channel index of None for whole sections.
+    :return list of (key, value, stale) tuples
+    """
+    cfg = rcp_config
+    values = [(('setConnCfg', None), cfg.connectivityConfig.toJson(), cfg.connectivityConfig.stale),
+              (('setGpsCfg', None), cfg.gpsConfig.toJson(), cfg.gpsConfig.stale),
+              (('setLapCfg', None), cfg.lapConfig.toJson(), cfg.lapConfig.stale)]
+    values += _channel_values('setImuCfg', cfg.imuConfig)
+    values += _channel_values('setAnalogCfg', cfg.analogConfig)
+    values += _channel_values('setTimerCfg', cfg.timerConfig)
+    values += _channel_values('setGpioCfg', cfg.gpioConfig)
+    values += _channel_values('setPwmCfg', cfg.pwmConfig)
+    values.append((('setCanCfg', None), cfg.canConfig.toJson(), cfg.canConfig.stale))
+
+    obd2_json = cfg.obd2Config.toJson()['obd2Cfg']
+    values.append((('setObd2Cfg', None), (obd2_json['en'], obd2_json['pids']), cfg.obd2Config.stale))
+    can_channels_json = cfg.can_channels.to_json_dict()['canChanCfg']
+    values.append((('setCanChanCfg', None), (can_channels_json['en'], can_channels_json['chans']),
+                   cfg.can_channels.stale))
+
+    values.append((('setTrackCfg', None), cfg.trackConfig.toJson(), cfg.trackConfig.stale))
+    values.append((('setScriptCfg', None), cfg.scriptConfig.toJson()['scriptCfg']['data'], cfg.scriptConfig.stale))
+    values.append((('addTrackDb', None), cfg.trackDb.toJson()['trackDb']['tracks'], cfg.trackDb.stale))
+    values.append((('setWifiCfg', None), cfg.wifi_config.to_json(), cfg.wifi_config.stale))
+    values.append((('setSdLogCtrlCfg', None), cfg.sd_logging_control_config.to_json_dict(),
+                   cfg.sd_logging_control_config.stale))
+    values.append((('setCamCtrlCfg', None), cfg.camera_control_config.to_json_dict(),
+                   cfg.camera_control_config.stale))
+    return values
+
+
+class ConfigSnapshot(object):
+    """
+    The configuration values known to be on the device
+    """
+
+    def __init__(self, values=None):
+        self._values = {} if values is None else values
+
+    @classmethod
+    def from_config(cls, rcp_config):
+        """
+        Snapshot the current values of a configuration
+        :param rcp_config the configuration, as read from the device
+        :type rcp_config RcpConfig
+        :return ConfigSnapshot
+        """
+        return cls(dict((key, deepcopy(value)) for key, value, stale in _config_values(rcp_config)))
+
+    def get(self, key):
+        return self._values.get(key)
+
+    def updated(self, values):
+        """
+        A copy of this snapshot with the specified values replaced
+        :param values dict of key => value
+        :type values dict
+        :return ConfigSnapshot
+        """
+        snapshot_values = dict(self._values)
+        snapshot_values.update(values)
+        return ConfigSnapshot(snapshot_values)
+
+
+class WriteCommand(object):
+    """
+    A single command of a write plan. name is the command name the device replies with
+    """
+
+    def __init__(self, name, msg, barrier=False):
+        self.name = name
+        self.msg = msg
+        self.barrier = barrier
+
+    @property
+    def persistent(self):
+        return self.name not in SELF_PERSISTING_COMMANDS
+
+
+class WritePlan(object):
+    """
+    The commands needed to write a configuration, and what was saved compared to
+    writing every stale section in full
+    """
+
+    def __init__(self, commands, full_commands, written_values, encode):
+        self.commands = commands
+        self.written_values = written_values
+        self.command_count = len(commands)
+        self.bytes = sum(len(encode(c.msg)) for c in commands)
+        self.commands_saved = len(full_commands) - self.command_count
+        self.bytes_saved = sum(len(encode(c.msg)) for c in full_commands) - self.bytes
+
+    def __str__(self):
+        return '{} commands, {} bytes ({} commands, {} bytes unchanged)'.format(self.command_count, self.bytes,
+                                                                             self.commands_saved, self.bytes_saved)
+
+
+def _section_command(name, index, value):
+    if index is None:
+        return WriteCommand(name, {name: value})
+    return WriteCommand(name, {name: {str(index): value}})
+
+
+def _changed_indexes(items, previous):
+    """
+    Indexes of the items differing from the previous list. The final item is included whenever
+    anything changed, since the device takes the item count from the final item written.
+    """
+    if previous is None:
+        return range(len(items))
+    changed = [i for i, item in enumerate(items) if i >= len(previous) or item != previous[i]]
+    final = len(items) - 1
+    if (len(changed) > 0 or len(items) != len(previous)) and final >= 0 and final not in changed:
+        changed.append(final)
+    return changed
+
+
+def _channel_list_commands(name, items_name, value, previous):
+    enabled, items = value
+    if previous is None:
+        indexes = range(len(items))
+    else:
+        previous_enabled, previous_items = previous
+        if enabled == previous_enabled and items == previous_items:
+            return []
+        indexes = _changed_indexes(items, previous_items)
+        if len(indexes) == 0 and len(items) > 0:
+            # only the enabled flag changed, which is sent with every channel
+            indexes = [len(items) - 1]
+
+    if len(items) == 0:
+        # if we've removed all channels, send message with empty channel array
+        return [WriteCommand(name, {name: {'en': enabled, 'index': 0, items_name: [], 'last': True}}, barrier=True)]
+
+    commands = []
+    for index in indexes:
+        last = index == len(items) - 1
+        payload = {'en': enabled, 'index': index, items_name: [items[index]]}
+        if last:
+            payload['last'] = True
+        commands.append(WriteCommand(name, {name: payload}, barrier=last))
+    return commands
+
+
+def _script_pages(script):
+    pages = []
+    while True:
+        if len(script) >= SCRIPT_PAGE_SIZE:
+            page = script[:SCRIPT_PAGE_SIZE]
+            script = script[SCRIPT_PAGE_SIZE:]
+            pages.append((page, SCRIPT_ADD_MODE_IN_PROGRESS if len(script) > 0 else SCRIPT_ADD_MODE_COMPLETE))
+        else:
+            pages.append((script, SCRIPT_ADD_MODE_COMPLETE))
+            return pages
+
+
+def _script_commands(script, previous):
+    pages = _script_pages(script)
+    indexes = _changed_indexes(pages, None if previous is None else _script_pages(previous))
+    commands = []
+    for index in indexes:
+        data, mode = pages[index]
+        commands.append(WriteCommand('setScriptCfg',
+                                     {'setScriptCfg': {'data': data, 'page': index, 'mode': mode}},
+                                     barrier=mode == SCRIPT_ADD_MODE_COMPLETE))
+    return commands
+
+
+def _track_db_commands(tracks, previous):
+    if len(tracks) == 0:
+        if previous is not None and len(previous) == 0:
+            return []
+        return [WriteCommand('addTrackDb', {'addTrackDb': {'index': 0, 'mode': TRACK_ADD_MODE_COMPLETE, 'track': []}},
+                             barrier=True)]
+    commands = []
+    for index in _changed_indexes(tracks, previous):
+        mode = TRACK_ADD_MODE_IN_PROGRESS if index < len(tracks) - 1 else TRACK_ADD_MODE_COMPLETE
+        commands.append(WriteCommand('addTrackDb',
+                                     {'addTrackDb': {'index': index, 'mode': mode, 'track': tracks[index]}},
+                                     barrier=mode == TRACK_ADD_MODE_COMPLETE))
+    return commands
+
+
+def _write_commands(key, value, previous):
+    name, index = key
+    if name == 'setObd2Cfg':
+        return _channel_list_commands(name, 'pids', value, previous)
+    if name == 'setCanChanCfg':
+        return _channel_list_commands(name, 'chans', value, previous)
+    if name == 'setScriptCfg':
+        return _script_commands(value, previous)
+    if name == 'addTrackDb':
+        return _track_db_commands(value, previous)
+    if previous is not None and value == previous:
+        return []
+    return [_section_command(name, index, value)]
+
+
+def _compact_encode(msg):
+    return json.dumps(msg, separators=(',', ':'))
+
+
+def build_write_plan(rcp_config, snapshot=None, encode=_compact_encode):
+    """
+    Plans the commands for writing the stale parts of a configuration. Without a snapshot every
+    stale section is written in full; with one, only what differs from the snapshot is written.
+    flashCfg is only sent when something it persists was written.
+    :param rcp_config the configuration to write
+    :type rcp_config RcpConfig
+    :param snapshot the configuration known to be on the device
+    :type snapshot ConfigSnapshot
+    :param encode function encoding a message, used for counting bytes
+    :type encode function
+    :return WritePlan
+    """
+    commands = []
+    full_commands = []
+    written_values = {}
+    for key, value, stale in _config_values(rcp_config):
+        if not stale:
+            continue
+        full_commands += _write_commands(key, value, None)
+        previous = None if snapshot is None else snapshot.get(key)
+        commands += _write_commands(key, value, previous)
+        written_values[key] = deepcopy(value)
+
+    flash = WriteCommand('flashCfg', {'flashCfg': None}, barrier=True)
+    full_commands.append(flash)
+    if snapshot is None or any(c.persistent for c in commands):
+        commands.append(flash)
+    return WritePlan(commands, full_commands, written_values, encode)
@@ -1479,6 +1479,14 @@ class Capabilities(object):
     def has_streaming(self):
         return 'telemstream' in self.flags
 
+    @property
+    def has_binary_streaming(self):
+        return 'binstream' in self.flags
+
+    @property
+    def has_config_hashes(self):
+        return 'cfghash' in self.flags
+
     @property
     def has_camera_control(self):
         return 'camctl' in self.flags
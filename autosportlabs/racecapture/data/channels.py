@@ -69,10 +69,14 @@ class ChannelMeta(object):
 
 class ChannelMetaCollection(object):
     channel_metas = []
+    # incremented whenever channel metas are reloaded. Kept on the class,
+    # as the channel_metas list is shared by every collection
+    version = 0
 
     def fromJson(self, metaJson):
         channel_metas = self.channel_metas
         del channel_metas[:]
+        ChannelMetaCollection.version += 1
         for ch in metaJson:
             channel_meta = ChannelMeta()
             channel_meta.fromJson(ch)
@@ -18,10 +18,19 @@
 # have received a copy of the GNU General Public License along with
 # this code. If not, see <http://www.gnu.org/licenses/>.
 
-from autosportlabs.racecapture.data.channels import ChannelMeta, ChannelMetaCollection
+import base64
+import binascii
+import struct
+import zlib
+from autosportlabs.racecapture.data.channels import ChannelMeta, ChannelMetaCollection, CHANNEL_TYPE_GPS, \
+    CHANNEL_TYPE_TIME
 
 class SampleMetaException(Exception):
     pass
+
+
+class BinarySampleException(Exception):
+    pass
         
 class SampleValue(object):
     def __init__(self, value, channelMeta):
@@ -29,19 +38,193 @@ class SampleValue(object):
         self.channelMeta = channelMeta
 
 STARTING_BITMAP = 1
-        
+
+# number of channels covered by each bitmask field
+BITMASK_FIELD_CHANNELS = 32
+
+
+class SampleDecoder(object):
+    """
+    Decoding plan for sample data packets, compiled once per set of channel metas.
+    The bit position of every channel is resolved up front, so decoding a packet
+    writes the values straight into a dict of channel name => value without
+    creating intermediate objects.
+    """
+
+    def __init__(self, channel_metas):
+        channel_count = len(channel_metas)
+        self.bitmask_field_count = max(0, (channel_count - 1) // BITMASK_FIELD_CHANNELS) + 1
+        self.max_field_count = channel_count + self.bitmask_field_count
+
+        # per bitmask field: (mask with every channel bit set, [(mask, channel name)])
+        fields = []
+        for start in range(0, max(channel_count, 1), BITMASK_FIELD_CHANNELS):
+            channels = [(1 << bit, meta.name) for bit, meta in enumerate(channel_metas[start:start + BITMASK_FIELD_CHANNELS])]
+            fields.append(((1 << len(channels)) - 1, channels))
+        self._fields = fields
+
+    def decode(self, data, values):
+        """
+        Decodes the values present in a sample data packet
+        :param data the 'd' array of the sample packet
+        :type data list
+        :param values the dict to fill with channel name => value; cleared first
+        :type values dict
+        """
+        field_count = len(data)
+        bitmask_field_count = self.bitmask_field_count
+        if field_count > self.max_field_count or field_count < bitmask_field_count:
+            raise SampleMetaException('Unexpected data packet count {}; channel meta expects between {} and {} channels'.format(field_count, bitmask_field_count, self.max_field_count))
+
+        values.clear()
+        bitmask_index = field_count - bitmask_field_count
+        field_index = 0
+        for full_mask, channels in self._fields:
+            bitmask = int(data[bitmask_index])
+            bitmask_index += 1
+            if bitmask & full_mask == full_mask:
+                # every channel in this field is present
+                for mask, name in channels:
+                    values[name] = float(data[field_index])
+                    field_index += 1
+            else:
+                for mask, name in channels:
+                    if bitmask & mask:
+                        values[name] = float(data[field_index])
+                        field_index += 1
+
+
+# Binary sample frames arrive as a line starting with this marker, followed by the base64
+# encoded frame, as the transports deliver CRLF terminated lines
+BINARY_SAMPLE_MARKER = '!'
+BINARY_SAMPLE_VERSION = 1
+# version, flags, channel count, tick
+BINARY_SAMPLE_HEADER = '<BBHI'
+# channels of these types, or whose range at their precision exceeds what
+# float32 represents exactly, are packed as float64
+BINARY_SAMPLE_WIDE_TYPES = (CHANNEL_TYPE_GPS, CHANNEL_TYPE_TIME)
+FLOAT32_EXACT_RANGE = 1 << 24
+
+NAN = float('nan')
+
+
+def _is_wide_channel(meta):
+    if meta.type in BINARY_SAMPLE_WIDE_TYPES:
+        return True
+    try:
+        scale = max(abs(float(meta.min)), abs(float(meta.max))) * 10 ** int(meta.precision or 0)
+    except (TypeError, ValueError):
+        return True
+    return scale > FLOAT32_EXACT_RANGE
+
+
+class BinarySampleCodec(object):
+    """
+    Compact binary sample framing, compiled once per set of channel metas.
+    A frame holds the value of every channel in meta order, packed as float32
+    or float64, with NaN for channels not updated in the sample, followed by
+    a CRC32 of the frame.
+    """
+
+    def __init__(self, channel_metas):
+        self._names = [meta.name for meta in channel_metas]
+        self._header = struct.Struct(BINARY_SAMPLE_HEADER)
+        self._struct = struct.Struct(BINARY_SAMPLE_HEADER + ''.join(['d' if _is_wide_channel(meta) else 'f'
+                                                                     for meta in channel_metas]))
+        self._crc = struct.Struct('<I')
+
+    @property
+    def frame_size(self):
+        return self._struct.size + self._crc.size
+
+    def encode(self, tick, values):
+        """
+        Encodes a sample as a binary frame line
+        :param tick the sample tick
+        :type tick int
+        :param values channel name => value for the channels present in the sample
+        :type values dict
+        :return string
+        """
+        frame = self._struct.pack(BINARY_SAMPLE_VERSION, 0, len(self._names), tick,
+                                  *[values.get(name, NAN) for name in self._names])
+        frame += self._crc.pack(zlib.crc32(frame) & 0xffffffff)
+        return BINARY_SAMPLE_MARKER + base64.b64encode(frame)
+
+    def decode(self, line, values):
+        """
+        Decodes a binary frame line
+        :param line the frame line, including the marker
+        :type line string
+        :param values the dict to fill with channel name => value; cleared first
+        :type values dict
+        :return the sample tick
+        """
+        try:
+            frame = base64.b64decode(line[len(BINARY_SAMPLE_MARKER):])
+        except (TypeError, binascii.Error):
+            raise BinarySampleException('Invalid binary sample encoding')
+
+        if len(frame) != self.frame_size:
+            if len(frame) >= self._header.size:
+                version, flags, channel_count, tick = self._header.unpack_from(frame)
+                if version == BINARY_SAMPLE_VERSION and channel_count != len(self._names):
+                    raise SampleMetaException('Unexpected binary sample channel count {}; channel meta expects {}'.format(channel_count, len(self._names)))
+            raise BinarySampleException('Unexpected binary sample size {}; expected {}'.format(len(frame), self.frame_size))
+
+        payload = frame[:self._struct.size]
+        if zlib.crc32(payload) & 0xffffffff != self._crc.unpack_from(frame, self._struct.size)[0]:
+            raise BinarySampleException('Binary sample CRC mismatch')
+
+        fields = self._struct.unpack(payload)
+        if fields[0] != BINARY_SAMPLE_VERSION:
+            raise BinarySampleException('Unsupported binary sample version {}'.format(fields[0]))
+        if fields[2] != len(self._names):
+            raise SampleMetaException('Unexpected binary sample channel count {}; channel meta expects {}'.format(fields[2], len(self._names)))
+
+        values.clear()
+        for name, value in zip(self._names, fields[4:]):
+            # NaN marks a channel that was not updated
+            if value == value:
+                values[name] = value
+        return fields[3]
+
+
 class Sample(object):
     tick = 0
-    samples = []
     metas = ChannelMetaCollection()
     updated_meta = False
     
     def __init__(self, **kwargs):
         self.tick = kwargs.get('tick', self.tick)
-        self.samples = kwargs.get('samples', self.samples)
+        # channel name => value for the channels present in the last sample
+        self.values = {}
+        self._sample_values = None
+        self._decoder = None
+        self._binary_codec = None
+        self._compiled_metas = None
+        self._compiled_version = None
+        self.samples = kwargs.get('samples', [])
         self.metas = kwargs.get('channelMetas', self.metas)
         self.updated_meta = len(self.metas.channel_metas) > 0
-        
+
+    @property
+    def samples(self):
+        """
+        The channels present in the last sample as a list of SampleValue.
+        Built on demand; consumers on the hot path should read values instead.
+        """
+        if self._sample_values is None:
+            values = self.values
+            self._sample_values = [SampleValue(values[meta.name], meta) for meta in self.metas.channel_metas
+                                   if meta.name in values]
+        return self._sample_values
+
+    @samples.setter
+    def samples(self, samples):
+        self._sample_values = samples
+        self.values = dict((sample.channelMeta.name, sample.value) for sample in samples)
+
     def fromJson(self, json):
         if json:
             sample = json.get('s')
@@ -56,43 +239,45 @@ class Sample(object):
                     self.updated_meta = False
                 if dataJson:
                     self.processData(dataJson)
-    
+
+    def fromBinary(self, frame):
+        """
+        Reads a binary sample frame. Binary frames never carry channel meta.
+        :param frame the frame line, including the marker
+        :type frame string
+        """
+        self._sample_values = None
+        self.updated_meta = False
+        self.tick = self.get_binary_codec().decode(frame, self.values)
+
+    def _check_compiled_metas(self):
+        metas = self.metas
+        if self._compiled_metas is not metas or self._compiled_version != metas.version:
+            self._decoder = None
+            self._binary_codec = None
+            self._compiled_metas = metas
+            self._compiled_version = metas.version
+
+    def get_decoder(self):
+        """
+        Gets the decoder for the current channel metas, compiling it if the metas changed
+        :return SampleDecoder
+        """
+        self._check_compiled_metas()
+        if self._decoder is None:
+            self._decoder = SampleDecoder(self.metas.channel_metas)
+        return self._decoder
+
+    def get_binary_codec(self):
+        """
+        Gets the binary frame codec for the current channel metas, compiling it if the metas changed
+        :return BinarySampleCodec
+        """
+        self._check_compiled_metas()
+        if self._binary_codec is None:
+            self._binary_codec = BinarySampleCodec(self.metas.channel_metas)
+        return self._binary_codec
+
     def processData(self, dataJson):
-        metas = self.metas.channel_metas
-        channelConfigCount = len(metas) 
-        bitmaskFieldCount = max(0, (channelConfigCount - 1) / 32) + 1       
-        
-        maxFieldCount = channelConfigCount + bitmaskFieldCount
-                
-        fieldData = dataJson
-        fieldDataSize = len(fieldData)
-        if fieldDataSize > maxFieldCount or fieldDataSize < bitmaskFieldCount:
-            raise SampleMetaException('Unexpected data packet count {}; channel meta expects between {} and {} channels'.format(fieldDataSize, bitmaskFieldCount, maxFieldCount))
-
-        bitmaskFields = []
-        for i in range(fieldDataSize - bitmaskFieldCount, fieldDataSize):
-            bitmaskFields.append(int(fieldData[i]))
-        
-        samples = self.samples
-        del samples[:]
-        
-        channelConfigIndex = 0
-        bitmapIndex = 0
-        fieldIndex = 0
-        mask_index = 0
-        channelConfigCount = len(metas)
-        while channelConfigIndex < channelConfigCount:
-            if mask_index >= 32:            
-                mask_index = 0;
-                bitmapIndex += 1
-                if bitmapIndex > len(bitmaskFields):
-                    raise Exception("channel count overflowed number of bitmap fields available")
-            
-            mask = 1 << mask_index
-            if (bitmaskFields[bitmapIndex] & mask) != 0:
-                value = float(fieldData[fieldIndex])
-                fieldIndex += 1
-                sample = SampleValue(value, metas[channelConfigIndex])
-                samples.append(sample)
-            channelConfigIndex += 1
-            mask_index += 1
+        self._sample_values = None
+        self.get_decoder().decode(dataJson, self.values)
@@ -19,7 +19,8 @@
 # this code. If not, see <http://www.gnu.org/licenses/>.
 
 from datetime import datetime
-from threading import Thread
+from threading import Thread, Event
+import time
 from kivy.clock import Clock
 from kivy.logger import Logger
 from kivy.event import EventDispatcher
@@ -32,6 +33,52 @@ import Queue
 from Queue import Empty, Full
 
 
+class SessionWriteStats(object):
+    """
+    Throughput and latency counters for the session recorder's database writes
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.samples_written = 0
+        self.batches_written = 0
+        self.write_time = 0.0
+        self.max_batch_latency = 0.0
+        self.last_batch_latency = 0.0
+
+    def record_batch(self, sample_count, elapsed):
+        """
+        Records a completed batch write
+        :param sample_count the number of samples in the batch
+        :type sample_count int
+        :param elapsed the time taken to write the batch, in seconds
+        :type elapsed float
+        """
+        self.samples_written += sample_count
+        self.batches_written += 1
+        self.write_time += elapsed
+        self.last_batch_latency = elapsed
+        self.max_batch_latency = max(self.max_batch_latency, elapsed)
+
+    @property
+    def samples_per_second(self):
+        """
+        Write throughput, in samples per second of time spent writing
+        """
+        return self.samples_written / self.write_time if self.write_time > 0 else 0.0
+
+    @property
+    def average_batch_latency(self):
+        return self.write_time / self.batches_written if self.batches_written > 0 else 0.0
+
+    def __str__(self):
+        return 'samples: {}, batches: {}, {:.0f} samples/sec, batch latency avg {:.1f}ms max {:.1f}ms'.format(
+            self.samples_written, self.batches_written, self.samples_per_second,
+            self.average_batch_latency * 1000.0, self.max_batch_latency * 1000.0)
+
+
 class SessionRecorder(EventDispatcher):
     """
     Handles starting/stopping session recording and other related tasks
@@ -60,11 +107,13 @@ class SessionRecorder(EventDispatcher):
         self._sample_queue = Queue.Queue(
             maxsize=SessionRecorder.SAMPLE_QUEUE_MAX_SIZE)
         self._recorder_thread = None
+        self._recorder_stopped = None
         self._sample_queue_full = False
         self._sample_last_send = datetime(1,1,1)
         self._sample_send_delay = SessionRecorder.SAMPLE_QUEUE_MIN_SEND_DELAY_MS
 
         self._sample_accumulator = {}
+        self._write_stats = SessionWriteStats()
         self._datastore = datastore
         self._databus = databus
         self._rcapi = rcpapi
@@ -109,6 +158,13 @@ class SessionRecorder(EventDispatcher):
     def on_recording(self, recording):
         pass
 
+    @property
+    def write_stats(self):
+        """
+        The SessionWriteStats for the current (or last) recorded session
+        """
+        return self._write_stats
+
     def start(self, session_name=None):
         """
         Starts recording a new session.
@@ -124,11 +180,17 @@ class SessionRecorder(EventDispatcher):
             Logger.info("SessionRecorder: starting new session")
             self._current_session_id = self._datastore.init_session(
                 self._create_session_name(), self._channels)
+            # the previous session's worker may still be finishing, so each session
+            # gets its own queue, stats and stop event
+            self._sample_queue = Queue.Queue(maxsize=SessionRecorder.SAMPLE_QUEUE_MAX_SIZE)
+            self._write_stats = SessionWriteStats()
+            self._recorder_stopped = Event()
             self.dispatch('on_recording', True)
             self.recording = True
             self._sample_accumulator = {}
 
-            t = Thread(target=self._session_recorder_worker)
+            t = Thread(target=self._session_recorder_worker,
+                       args=(self._current_session_id, self._sample_queue, self._write_stats, self._recorder_stopped))
             t.daemon = True
             t.start()
             self._recorder_thread = t
@@ -151,17 +213,21 @@ class SessionRecorder(EventDispatcher):
 
     def _actual_stop(self, dt):
         """
-        Stops recording the current session, does any additional post-processing necessary
+        Stops recording the current session. The recorder worker writes the remaining samples
+        and finalizes the session in the background, then on_recording is dispatched
         :return: None
         """
         if self.recording:
             Logger.info("SessionRecorder: stopping session")
             self.recording = False
-            if self._recorder_thread is not None:
-                self._recorder_thread.join()
+            if self._recorder_stopped is not None:
+                self._recorder_stopped.set()
             self._recorder_thread = None
-
             self._current_session_id = None
+
+    def _on_session_finalized(self, dt):
+        # a new session may have started while the last one was finalized
+        if not self.recording:
             self.dispatch('on_recording', False)
 
     @property
@@ -220,45 +286,49 @@ class SessionRecorder(EventDispatcher):
         self._current_view = view_name
         self._check_should_record()
 
-    def _session_recorder_worker(self):
+    def _session_recorder_worker(self, session_id, sample_queue, write_stats, stopped):
         Logger.info('SessionRecorder: session recorder worker starting')
         try:
-            # reset our sample data dict
-            qsize = 0
-            insert_counter = 0
-            sample_queue = self._sample_queue
+            batch = []
+            qsize = sample_queue.qsize()
             index = 0
             # will drain the queue before exiting thread
-            while self.recording or qsize > 0:
+            while not stopped.is_set() or qsize > 0 or len(batch) > 0:
                 try:
-                    sample_data = sample_queue.get(
-                        True, SessionRecorder.SAMPLE_QUEUE_GET_TIMEOUT)
-                    self._datastore.insert_sample_nocommit(
-                        sample_data, self._current_session_id)
-                    insert_counter += 1
+                    batch.append(sample_queue.get(
+                        True, SessionRecorder.SAMPLE_QUEUE_GET_TIMEOUT))
                     qsize = sample_queue.qsize()
-                    # since the commit is slow, only do the commit once the queue empty to prevent overrunning the buffer.
-                    if (qsize == 0) or (insert_counter >= SessionRecorder.SAMPLE_QUEUE_UNCOMMITTED_INSERT_LIMIT):
-                        self._datastore.commit()
-                        insert_counter = 0
-                    
-                    if qsize > 0 and index % SessionRecorder.SAMPLE_QUEUE_BACKLOG_LOG_INTERVAL == 0:
-                        Logger.info( 'SessionRecorder: queue backlog: {}, commit backlog: {}, sample send delay: {}ms'
-				.format(qsize, insert_counter, self._sample_send_delay ))
+                    index += 1
+                except Empty:
+                    qsize = 0
 
-                    if insert_counter > (SessionRecorder.SAMPLE_QUEUE_UNCOMMITTED_INSERT_LIMIT*SessionRecorder.SAMPLE_QUEUE_BACKLOG_LOG_THRESHOLD):
-                        Logger.debug( 'SessionRecorder: commit backlog: {}'.format(insert_counter))
+                # since the commit is slow, only write the batch once the queue is empty
+                # or the batch is full, to prevent overrunning the buffer.
+                if len(batch) > 0 and ((qsize == 0) or (len(batch) >= SessionRecorder.SAMPLE_QUEUE_UNCOMMITTED_INSERT_LIMIT)):
+                    start = time.time()
+                    self._datastore.insert_samples(batch, session_id)
+                    write_stats.record_batch(len(batch), time.time() - start)
+                    batch = []
 
-                    if qsize > (SessionRecorder.SAMPLE_QUEUE_MAX_SIZE*SessionRecorder.SAMPLE_QUEUE_BACKLOG_LOG_THRESHOLD):
-                        Logger.debug( 'SessionRecorder: queue backlog: {}'.format(qsize))
+                if qsize > 0 and index % SessionRecorder.SAMPLE_QUEUE_BACKLOG_LOG_INTERVAL == 0:
+                    Logger.info('SessionRecorder: queue backlog: {}, commit backlog: {}, sample send delay: {}ms, {}'
+                                .format(qsize, len(batch), self._sample_send_delay, write_stats))
+
+                if qsize > (SessionRecorder.SAMPLE_QUEUE_MAX_SIZE * SessionRecorder.SAMPLE_QUEUE_BACKLOG_LOG_THRESHOLD):
+                    Logger.debug('SessionRecorder: queue backlog: {}'.format(qsize))
 
-                    index += 1
-                except Empty:
-                    pass
         except Exception as e:
             Logger.error(
                 'SessionRecorder: Exception in session recorder worker ' + str(e))
+
+        try:
+            Logger.info('SessionRecorder: session write stats: {}'.format(write_stats))
+            # post-processing reads the whole session, so it is kept off the UI thread
+            self._datastore.finalize_session(session_id)
+        except Exception as e:
+            Logger.error('SessionRecorder: Exception finalizing session ' + str(e))
         finally:
+            Clock.schedule_once(self._on_session_finalized)
             safe_thread_exit()
 
         Logger.info('SessionRecorder: session recorder worker ending')
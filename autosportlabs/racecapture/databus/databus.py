@@ -19,19 +19,47 @@
 # this code. If not, see <http://www.gnu.org/licenses/>.
 
 from kivy.clock import Clock
-from time import sleep
+from time import sleep, time
 from kivy.logger import Logger
 from threading import Thread, Event, Lock
 from autosportlabs.racecapture.data.channels import ChannelMeta
-from autosportlabs.racecapture.data.sampledata import Sample, SampleMetaException, ChannelMetaCollection
+from autosportlabs.racecapture.data.sampledata import Sample, SampleMetaException, BinarySampleException, \
+    ChannelMetaCollection
 from autosportlabs.racecapture.databus.filter.bestlapfilter import BestLapFilter
 from autosportlabs.racecapture.databus.filter.laptimedeltafilter import LaptimeDeltaFilter
+from autosportlabs.racecapture.databus.filter.pipeline import FilterPipeline
+from autosportlabs.racecapture.databus.filter.computedchannel import ComputedChannel
+from autosportlabs.racecapture.databus.history import ChannelHistory
 from autosportlabs.util.threadutil import safe_thread_exit
 from autosportlabs.racecapture.config.rcpconfig import Capabilities
+from autosportlabs.racecapture.api.rcpapi import BINARY_SAMPLE_MSG
 from utils import is_mobile_platform
 
 DEFAULT_DATABUS_UPDATE_INTERVAL = 0.02  # 50Hz UI update rate
 
+# how often the notification counters are recalculated, in seconds
+STATS_INTERVAL = 1.0
+
+# seconds of channel history kept, and the sample rate used to size the history buffers
+DEFAULT_HISTORY_SECONDS = 10.0
+DEFAULT_HISTORY_RATE = 50
+
+_MISSING = object()
+
+
+class DataSnapshot(object):
+    """
+    Channel data published by the producer thread for the UI thread.
+    A snapshot is never modified once published; changed holds every channel
+    that changed since the last snapshot the UI thread consumed.
+    """
+    __slots__ = ('version', 'data', 'changed')
+
+    def __init__(self, version, data, changed):
+        self.version = version
+        self.data = data
+        self.changed = changed
+
 class DataBusFactory(object):
     def create_standard_databus(self, system_channels):
         databus = DataBus()
@@ -39,6 +67,50 @@ class DataBusFactory(object):
         databus.add_data_filter(LaptimeDeltaFilter(system_channels))
         return databus
 
+class RateLimitedListener(object):
+    """
+    Wraps a channel listener so it is called at most max_rate times per second.
+    A value arriving too soon is held back and delivered once the interval has passed.
+    """
+
+    def __init__(self, callback, max_rate):
+        self.callback = callback
+        self.interval = 1.0 / max_rate
+        self.last_time = None
+        self.pending = False
+        self.pending_value = None
+
+    def __eq__(self, other):
+        if isinstance(other, RateLimitedListener):
+            return self.callback == other.callback
+        return self.callback == other
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def notify(self, value, now):
+        """
+        Deliver a value, or hold it if the listener was called too recently
+        :return True if the listener was called
+        """
+        if self.last_time is None or now - self.last_time >= self.interval:
+            self.last_time = now
+            self.pending = False
+            self.pending_value = None
+            self.callback(value)
+            return True
+        self.pending = True
+        self.pending_value = value
+        return False
+
+    def flush(self, now):
+        """
+        Deliver the held value if the interval has passed
+        :return True if the listener was called
+        """
+        return self.pending and self.notify(self.pending_value, now)
+
+
 class DataBus(object):
     """Central hub for current sample data. Receives data from DataBusPump
     Also contains the periodic updater for listeners. Updates occur in the UI thread via Clock.schedule_interval
@@ -48,6 +120,15 @@ class DataBus(object):
     Typical use:
     (CHANNEL LISTENERS) => DataBus.addChannelListener()  -- listeners receive updates with a particular channel's value
     (META LISTENERS) => DataBus.addMetaListener() -- Listeners receive updates with meta data
+    (HISTORY) => DataBus.get_channel_history() -- a shared ring buffer of a channel's recent values
+    (COMPUTED CHANNELS) => DataBus.add_computed_channel() -- channels derived from other channels
+
+    Only channels whose value changed since the previous update are notified; sample listeners
+    are called when any channel changed.
+
+    Threading: update_samples runs in the producer thread and publishes an immutable
+    DataSnapshot; notify_listeners picks up the latest snapshot in the UI thread and runs
+    the listeners without holding update_lock, so a slow listener never stalls ingest.
 
     Note: DataBus must be started via start_update before any data flows
     """
@@ -56,15 +137,39 @@ class DataBus(object):
     sample = None
     channel_listeners = {}
     meta_listeners = []
-    meta_updated = False
-    data_filters = []
     sample_listeners = []
     _polling = False
     rcp_meta_read = False
 
-    def __init__(self, **kwargs):
+    def __init__(self, history_seconds=DEFAULT_HISTORY_SECONDS, history_rate=DEFAULT_HISTORY_RATE, **kwargs):
         super(DataBus, self).__init__(**kwargs)
+        self.history_seconds = history_seconds
+        self.history_rate = history_rate
+        # channel => ChannelHistory; replaced rather than modified, as the producer iterates it
+        self._histories = {}
+        # serializes producers; never held while listeners run
         self.update_lock = Lock()
+        # filters deriving channels from other channels, run in the producer thread
+        self._pipeline = FilterPipeline()
+        # producer side: channels changed since the snapshot last consumed by the UI thread
+        self._pending_changes = set()
+        self._snapshot = DataSnapshot(0, dict(self.channel_data), frozenset())
+        self.version = 0
+        self._consumed_version = 0
+        self._meta_version = 0
+        self._notified_meta_version = 0
+        # channel listeners awaiting their first value, and rate limited listeners holding a value
+        self._new_listeners = []
+        self._pending_listeners = []
+        self._rate_limited_channels = set()
+        self._now = 0
+
+        self.notification_count = 0
+        self.notifications_per_sec = 0
+        self.changed_channels_per_sec = 0
+        self._stats_start = None
+        self._stats_notifications = 0
+        self._stats_changes = 0
 
     def start_update(self, interval=DEFAULT_DATABUS_UPDATE_INTERVAL):
         if self._polling:
@@ -77,101 +182,207 @@ class DataBus(object):
         Clock.unschedule(self.notify_listeners)
         self._polling = False
 
+    @property
+    def data_filters(self):
+        """
+        :return list of data filters, in the order they are run
+        """
+        return self._pipeline.filters
+
     def _update_datafilter_meta(self, datafilter):
-        channel_metas = self.channel_metas
-        metas = datafilter.get_channel_meta(channel_metas)
+        metas = datafilter.get_channel_meta(self.channel_metas)
         cm = self.channel_metas
         for channel, meta in metas.iteritems():
             cm[channel] = meta
+        self._pipeline.add_outputs(datafilter, metas.keys())
 
     def update_channel_meta(self, metas):
         """update channel metadata information
         This should be called when the channel information has changed
         """
-        try:
-            self.update_lock.acquire()
-            # update channel metadata
-            cd = self.channel_data
-            cm = self.channel_metas
+        with self.update_lock:
             # clear our list of channel data values, in case channels
             # were removed on this metadata update
-            cd.clear()
+            self.channel_data.clear()
 
-            # clear and reload our channel metas
-            cm.clear()
+            # publish a new dict of channel metas; the UI thread may still be reading the old one
+            cm = {}
             for meta in metas.channel_metas:
                 cm[meta.name] = meta
+            self.channel_metas = cm
 
             # add channel meta for existing filters
             for f in self.data_filters:
                 self._update_datafilter_meta(f)
 
-            self.meta_updated = True
+            self._meta_version += 1
             self.rcp_meta_read = True
-        finally:
-            self.update_lock.release()
 
     def addSampleListener(self, callback):
         self.sample_listeners.append(callback)
 
     def update_samples(self, sample):
-        """Update channel data with new samples
+        """Update channel data with new samples, and publish a snapshot for the UI thread
         """
-        try:
-            self.update_lock.acquire()
+        with self.update_lock:
             cd = self.channel_data
-            for sample_item in sample.samples:
-                channel = sample_item.channelMeta.name
-                value = sample_item.value
-                cd[channel] = value
-
-            # apply filters to updated data
-            for f in self.data_filters:
-                f.filter(cd)
-        finally:
-            self.update_lock.release()
+            values = sample.values
+            get = cd.get
+            changed = [channel for channel, value in values.iteritems() if get(channel, _MISSING) != value]
+            if len(changed) > 0:
+                cd.update(values)
+
+            # derive channels from the updated data
+            changed.extend(self._pipeline.run(cd, changed))
+
+            if len(changed) > 0:
+                self._publish(changed)
+
+            histories = self._histories
+            if len(histories) > 0:
+                now = time()
+                for channel, history in histories.iteritems():
+                    value = cd.get(channel)
+                    if value is not None:
+                        history.append(now, value)
+
+    def _publish(self, changed):
+        # start a fresh change set once the UI thread has consumed the latest snapshot,
+        # otherwise carry the unconsumed changes forward so none are missed
+        if self._consumed_version == self.version:
+            pending = set(changed)
+            self._pending_changes = pending
+        else:
+            pending = self._pending_changes
+            pending.update(changed)
+        version = self.version + 1
+        # a single reference assignment, so the UI thread sees either snapshot whole
+        self._snapshot = DataSnapshot(version, dict(self.channel_data), frozenset(pending))
+        self.version = version
 
     def notify_listeners(self, dt):
+        now = time()
+        self._now = now
+        notifications = self.notification_count
+
+        meta_version = self._meta_version
+        if meta_version != self._notified_meta_version:
+            self._notified_meta_version = meta_version
+            self.notify_meta_listeners(self.channel_metas)
+
+        snapshot = self._snapshot
+        data = snapshot.data
+        changed = ()
+        if snapshot.version != self._consumed_version:
+            self._consumed_version = snapshot.version
+            changed = snapshot.changed
+            channel_listeners = self.channel_listeners
+            rate_limited_channels = self._rate_limited_channels
+            for channel in changed:
+                listeners = channel_listeners.get(channel)
+                if listeners:
+                    value = data.get(channel, _MISSING)
+                    if value is _MISSING:
+                        continue
+                    if channel in rate_limited_channels:
+                        self.notify_channel_listeners(channel, value)
+                    else:
+                        for listener in listeners:
+                            listener(value)
+                        self.notification_count += len(listeners)
+
+        if len(self._new_listeners) > 0:
+            new_listeners = self._new_listeners
+            self._new_listeners = []
+            for channel, listener in new_listeners:
+                value = data.get(channel, _MISSING)
+                # listeners of changed channels were just notified
+                if value is not _MISSING and channel not in changed:
+                    self._call_channel_listener(listener, value)
+
+        if len(self._pending_listeners) > 0:
+            for listener in self._pending_listeners:
+                if listener.flush(now):
+                    self.notification_count += 1
+            self._pending_listeners = [l for l in self._pending_listeners if l.pending]
+
+        if len(changed) > 0:
+            for listener in self.sample_listeners:
+                listener(data)
+                self.notification_count += 1
 
-        try:
-            self.update_lock.acquire()
-            if self.meta_updated:
-                cm = self.channel_metas
-                self.notify_meta_listeners(cm)
-                self.meta_updated = False
-
-            cd = self.channel_data
-            for channel, value in cd.iteritems():
-                self.notify_channel_listeners(channel, value)
+        self._update_stats(now, self.notification_count - notifications, len(changed))
 
-            for listener in self.sample_listeners:
-                listener(cd)
-        finally:
-            self.update_lock.release()
+    def _update_stats(self, now, notifications, changes):
+        if self._stats_start is None:
+            self._stats_start = now
+            return
+        self._stats_notifications += notifications
+        self._stats_changes += changes
+        elapsed = now - self._stats_start
+        if elapsed >= STATS_INTERVAL:
+            self.notifications_per_sec = self._stats_notifications / elapsed
+            self.changed_channels_per_sec = self._stats_changes / elapsed
+            self._stats_start = now
+            self._stats_notifications = 0
+            self._stats_changes = 0
+
+    def _call_channel_listener(self, listener, value):
+        if isinstance(listener, RateLimitedListener):
+            if listener.notify(value, self._now):
+                self.notification_count += 1
+            elif not any(l is listener for l in self._pending_listeners):
+                self._pending_listeners.append(listener)
+        else:
+            listener(value)
+            self.notification_count += 1
 
     def notify_channel_listeners(self, channel, value):
         listeners = self.channel_listeners.get(str(channel))
         if listeners:
-            for listener in listeners:
-                listener(value)
+            if channel in self._rate_limited_channels:
+                for listener in listeners:
+                    self._call_channel_listener(listener, value)
+            else:
+                for listener in listeners:
+                    listener(value)
+                self.notification_count += len(listeners)
 
     def notify_meta_listeners(self, channelMeta):
         for listener in self.meta_listeners:
             listener(channelMeta)
 
-    def addChannelListener(self, channel, callback):
+    def addChannelListener(self, channel, callback, max_rate=None):
+        """
+        Add a listener for a channel's value. The listener receives the channel's current value
+        on the next update, then each time the value changes.
+        :param channel the channel name
+        :type channel string
+        :param callback function called with the channel value
+        :type callback function
+        :param max_rate the maximum number of calls per second, or None for every change
+        :type max_rate float
+        """
+        if max_rate is None:
+            listener = callback
+        else:
+            listener = RateLimitedListener(callback, max_rate)
+            self._rate_limited_channels.add(channel)
         listeners = self.channel_listeners.get(channel)
         if listeners == None:
-            listeners = [callback]
+            listeners = [listener]
             self.channel_listeners[channel] = listeners
         else:
-            listeners.append(callback)
+            listeners.append(listener)
+        self._new_listeners.append((channel, listener))
 
     def removeChannelListener(self, channel, callback):
         try:
             listeners = self.channel_listeners.get(channel)
             if listeners:
                 listeners.remove(callback)
+            self._pending_listeners = [l for l in self._pending_listeners if l != callback]
+            self._new_listeners = [(c, l) for c, l in self._new_listeners if not (c == channel and l == callback)]
         except:
             pass
 
@@ -204,8 +415,67 @@ class DataBus(object):
         self.meta_listeners.append(callback)
 
     def add_data_filter(self, datafilter):
-        self.data_filters.append(datafilter)
-        self._update_datafilter_meta(datafilter)
+        """
+        Add a filter deriving channels from other channels. See FilterPipeline
+        :param datafilter the filter
+        :type datafilter object
+        """
+        with self.update_lock:
+            self._pipeline.add(datafilter)
+            self._update_datafilter_meta(datafilter)
+            self._meta_version += 1
+
+    def remove_data_filter(self, datafilter):
+        with self.update_lock:
+            self._pipeline.remove(datafilter)
+
+    def add_computed_channel(self, name, inputs, function, channel_meta=None):
+        """
+        Add a channel computed from other channels. The value is computed in the
+        producer thread whenever an input changes, and is available to listeners like any other channel.
+        :param name the name of the computed channel
+        :type name string
+        :param inputs the names of the channels the value is computed from
+        :type inputs list
+        :param function called with the input values, returning the channel value
+        :type function function
+        :param channel_meta the meta data for the computed channel
+        :type channel_meta ChannelMeta
+        :return ComputedChannel, which can be passed to remove_data_filter
+        """
+        computed_channel = ComputedChannel(name, inputs, function, channel_meta)
+        self.add_data_filter(computed_channel)
+        return computed_channel
+
+    def get_channel_history(self, channel):
+        """
+        Get the history of a channel's recent values. History is recorded from the first
+        request onwards, and the same ChannelHistory is shared by every caller.
+        :param channel the channel name
+        :type channel string
+        :return ChannelHistory
+        """
+        history = self._histories.get(channel)
+        if history is None:
+            with self.update_lock:
+                history = self._histories.get(channel)
+                if history is None:
+                    history = ChannelHistory(self.history_seconds * self.history_rate)
+                    histories = dict(self._histories)
+                    histories[channel] = history
+                    self._histories = histories
+        return history
+
+    def remove_channel_history(self, channel):
+        """
+        Stop recording history for the specified channel
+        :param channel the channel name
+        :type channel string
+        """
+        with self.update_lock:
+            histories = dict(self._histories)
+            histories.pop(channel, None)
+            self._histories = histories
 
     def getMeta(self):
         return self.channel_metas
@@ -274,7 +544,7 @@ class DataBusPump(object):
     def _start_telemetry(self):
         capabilities = self.rc_capabilities
         if capabilities is not None and capabilities.has_streaming:
-            self._rc_api.start_telemetry(self.current_sample_rate)
+            self._rc_api.start_telemetry(self.current_sample_rate, binary=capabilities.has_binary_streaming)
 
     def start(self, data_bus, rc_api, session_recorder, auto_streaming_supported):
         Logger.debug("DataBusPump: start()")
@@ -297,6 +567,7 @@ class DataBusPump(object):
         self._session_recorder = session_recorder
         session_recorder.bind(on_recording=self._on_session_recording)
         rc_api.addListener('s', self.on_sample)
+        rc_api.addListener(BINARY_SAMPLE_MSG, self.on_binary_sample)
         rc_api.addListener('meta', self.on_meta)
         rc_api.add_connect_listener(self.on_connect)
         rc_api.add_disconnect_listener(self.on_disconnect)
@@ -399,6 +670,18 @@ class DataBusPump(object):
             # this is to prevent repeated sample meta requests
             self._request_meta_handler()
 
+    def on_binary_sample(self, sample_msg, source):
+        sample = self.sample
+        try:
+            sample.fromBinary(sample_msg[BINARY_SAMPLE_MSG])
+            self._data_bus.update_samples(sample)
+            self._sample_event.set()
+        except SampleMetaException:
+            # binary frames carry no meta; fetch it before decoding more frames
+            self._request_meta_handler()
+        except BinarySampleException as e:
+            Logger.warning('DataBusPump: Dropping binary sample: {}'.format(e))
+
     def _request_meta_handler(self):
             if self._meta_is_stale_counter <= 0:
                 Logger.info('DataBusPump: Sample Meta is stale, requesting meta')
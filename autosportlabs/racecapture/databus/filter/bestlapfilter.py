@@ -23,6 +23,8 @@ class BestLapFilter(object):
     """Update BestLap if laptime is present and is faster than the current best"""
     BEST_LAPTIME_KEY = 'BestLap'
     LAPTIME_KEY = 'LapTime'
+    inputs = (LAPTIME_KEY,)
+    outputs = (BEST_LAPTIME_KEY,)
     best_laptime = 0
     best_laptime_meta = None
     def __init__(self, system_channels):
@@ -0,0 +1,62 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+from autosportlabs.racecapture.data.channels import ChannelMeta
+
+__all__ = ('ComputedChannel',)
+
+
+class ComputedChannel(object):
+    """
+    A channel computed from other channels in the DataBus pump thread.
+    The function is called with the input channel values, in the order the
+    inputs are listed, whenever one of them changes.
+    """
+
+    def __init__(self, name, inputs, function, channel_meta=None):
+        """
+        :param name the name of the computed channel
+        :type name string
+        :param inputs the names of the channels the value is computed from
+        :type inputs list
+        :param function called with the input values, returning the channel value
+        :type function function
+        :param channel_meta the meta data for the computed channel
+        :type channel_meta ChannelMeta
+        """
+        self.name = name
+        self.inputs = tuple(inputs)
+        self.outputs = (name,)
+        self.function = function
+        self.channel_meta = ChannelMeta(name=name) if channel_meta is None else channel_meta
+
+    def reset(self):
+        pass
+
+    def get_channel_meta(self, channel_meta):
+        metas = {}
+        if all(channel in channel_meta for channel in self.inputs):
+            metas[self.name] = self.channel_meta
+        return metas
+
+    def filter(self, channel_data):
+        values = [channel_data.get(channel) for channel in self.inputs]
+        if None not in values:
+            channel_data[self.name] = self.function(*values)
@@ -31,6 +31,8 @@ class LaptimeDeltaFilter(object):
     PREDTIME_KEY        = 'PredTime'
     BEST_LAPTIME_KEY    = 'BestLap'
     LAP_DELTA_KEY       = 'LapDelta'
+    inputs = (LAPTIME_KEY, PREDTIME_KEY, BEST_LAPTIME_KEY)
+    outputs = (LAP_DELTA_KEY,)
     lap_delta_meta = None
     
     def __init__(self, system_channels):
@@ -0,0 +1,144 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+from kivy.logger import Logger
+
+__all__ = ('FilterPipeline',)
+
+_MISSING = object()
+
+
+class _FilterEntry(object):
+    __slots__ = ('data_filter', 'inputs', 'outputs', 'failing')
+
+    def __init__(self, data_filter, inputs, outputs):
+        self.data_filter = data_filter
+        self.inputs = inputs
+        self.outputs = outputs
+        # set while the filter raises, so a persistent error is logged once
+        self.failing = False
+
+
+class FilterPipeline(object):
+    """
+    Runs DataBus filters that derive channels from other channels.
+
+    A filter declares the channels it reads and writes with 'inputs' and 'outputs'
+    attributes. Filters are run in dependency order, so a filter reading another
+    filter's output runs after it, and a filter is only run when one of its inputs changed.
+    A filter that does not declare inputs is run on every sample.
+    A filter that raises is skipped for that sample, leaving its outputs unchanged.
+    """
+
+    def __init__(self):
+        self._entries = []
+        # the entries in dependency order; replaced rather than modified, as the producer iterates it
+        self._ordered = []
+
+    @property
+    def filters(self):
+        """
+        :return list of filters in the order they are run
+        """
+        return [entry.data_filter for entry in self._ordered]
+
+    def add(self, data_filter):
+        """
+        Add a filter to the pipeline
+        :param data_filter the filter, providing filter(channel_data) and optionally inputs and outputs
+        :type data_filter object
+        """
+        inputs = getattr(data_filter, 'inputs', None)
+        outputs = getattr(data_filter, 'outputs', None)
+        self._entries.append(_FilterEntry(data_filter,
+                                          None if inputs is None else frozenset(inputs),
+                                          frozenset() if outputs is None else frozenset(outputs)))
+        self._sort()
+
+    def remove(self, data_filter):
+        self._entries = [entry for entry in self._entries if entry.data_filter is not data_filter]
+        self._sort()
+
+    def add_outputs(self, data_filter, channels):
+        """
+        Record additional channels written by a filter, for filters that do not declare their outputs
+        :param data_filter the filter
+        :type data_filter object
+        :param channels the channel names written by the filter
+        :type channels iterable
+        """
+        for entry in self._entries:
+            if entry.data_filter is data_filter and not entry.outputs.issuperset(channels):
+                entry.outputs = entry.outputs.union(channels)
+                self._sort()
+
+    def _sort(self):
+        # topological sort, keeping the order filters were added where there is no dependency
+        remaining = list(self._entries)
+        ordered = []
+        while len(remaining) > 0:
+            pending_outputs = set()
+            for entry in remaining:
+                pending_outputs.update(entry.outputs)
+            for entry in remaining:
+                # a filter is ready once no other remaining filter writes one of its inputs
+                others = pending_outputs.difference(entry.outputs)
+                if entry.inputs is None or others.isdisjoint(entry.inputs):
+                    break
+            else:
+                Logger.warn('FilterPipeline: circular dependency between filters {}'.format(
+                    [e.data_filter for e in remaining]))
+                ordered.extend(remaining)
+                break
+            ordered.append(entry)
+            remaining.remove(entry)
+        self._ordered = ordered
+
+    def run(self, channel_data, changed):
+        """
+        Run the filters affected by the changed channels
+        :param channel_data the current channel values, updated in place
+        :type channel_data dict
+        :param changed the channels that changed with this sample
+        :type changed list
+        :return list of filter output channels whose value changed
+        """
+        changed_outputs = []
+        changed_channels = set(changed)
+        for entry in self._ordered:
+            inputs = entry.inputs
+            if inputs is not None and changed_channels.isdisjoint(inputs):
+                continue
+            outputs = entry.outputs
+            previous = [(channel, channel_data.get(channel, _MISSING)) for channel in outputs]
+            try:
+                entry.data_filter.filter(channel_data)
+            except Exception as e:
+                # skip this filter's outputs; the rest of the sample is still published
+                if not entry.failing:
+                    Logger.error('FilterPipeline: error in filter {}: {}'.format(entry.data_filter, e))
+                    entry.failing = True
+                continue
+            entry.failing = False
+            for channel, value in previous:
+                if channel_data.get(channel, _MISSING) != value:
+                    changed_outputs.append(channel)
+                    changed_channels.add(channel)
+        return changed_outputs
@@ -0,0 +1,136 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+from array import array
+from bisect import bisect_left
+from threading import Lock
+
+__all__ = ('ChannelHistory',)
+
+
+class ChannelHistory(object):
+    """
+    Fixed size history of a channel's values, stored in array backed ring buffers.
+    Appending is O(1); once full, the oldest value is overwritten.
+    Values are appended by the DataBus producer thread and may be queried from any thread.
+    """
+
+    def __init__(self, capacity):
+        """
+        :param capacity the maximum number of values held
+        :type capacity int
+        """
+        capacity = max(1, int(capacity))
+        self.capacity = capacity
+        self._times = array('d', [0.0] * capacity)
+        self._values = array('d', [0.0] * capacity)
+        # index of the next write, and number of values held
+        self._head = 0
+        self._count = 0
+        self._lock = Lock()
+
+    def __len__(self):
+        return self._count
+
+    def append(self, timestamp, value):
+        """
+        Append a value. Timestamps are expected to be non-decreasing.
+        :param timestamp the time of the value, in seconds
+        :type timestamp float
+        :param value the channel value
+        :type value float
+        """
+        with self._lock:
+            head = self._head
+            self._times[head] = timestamp
+            self._values[head] = value
+            head += 1
+            self._head = 0 if head == self.capacity else head
+            if self._count < self.capacity:
+                self._count += 1
+
+    def clear(self):
+        with self._lock:
+            self._head = 0
+            self._count = 0
+
+    def _ordered(self, column):
+        # the held values, oldest first
+        count = self._count
+        head = self._head
+        if count < self.capacity:
+            return column[:count]
+        return column[head:] + column[:head]
+
+    def get_window(self, seconds=None, now=None):
+        """
+        Get the values within the most recent window of time
+        :param seconds the length of the window, or None for all held values
+        :type seconds float
+        :param now the end of the window; defaults to the most recent timestamp
+        :type now float
+        :return tuple of (timestamps, values) arrays, oldest first
+        """
+        with self._lock:
+            times = self._ordered(self._times)
+            values = self._ordered(self._values)
+        if seconds is None or len(times) == 0:
+            return times, values
+        end = times[-1] if now is None else now
+        start = bisect_left(times, end - seconds)
+        return times[start:], values[start:]
+
+    def get_values(self, seconds=None, now=None):
+        """
+        Get the values within the most recent window of time
+        :return array of values, oldest first
+        """
+        return self.get_window(seconds, now)[1]
+
+    def get_latest(self):
+        """
+        :return tuple of (timestamp, value) for the most recent value, or None if empty
+        """
+        with self._lock:
+            if self._count == 0:
+                return None
+            index = self._head - 1
+            return self._times[index], self._values[index]
+
+    def get_min(self, seconds=None, now=None):
+        """
+        :return the minimum value within the window, or None if the window is empty
+        """
+        values = self.get_values(seconds, now)
+        return min(values) if len(values) > 0 else None
+
+    def get_max(self, seconds=None, now=None):
+        """
+        :return the maximum value within the window, or None if the window is empty
+        """
+        values = self.get_values(seconds, now)
+        return max(values) if len(values) > 0 else None
+
+    def get_mean(self, seconds=None, now=None):
+        """
+        :return the mean value within the window, or None if the window is empty
+        """
+        values = self.get_values(seconds, now)
+        return sum(values) / len(values) if len(values) > 0 else None
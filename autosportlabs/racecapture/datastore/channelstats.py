@@ -0,0 +1,195 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+
+__all__ = ('ChannelStats', 'ChannelSummary', 'LocationSummary')
+
+
+class ChannelSummary(object):
+    """
+    Summary statistics for a channel across one or more sessions
+    """
+
+    def __init__(self, sample_count=0, value_sum=None, min_value=None, max_value=None,
+                 positive_min=None, positive_max=None):
+        self.sample_count = sample_count
+        self.value_sum = value_sum
+        self.min_value = min_value
+        self.max_value = max_value
+        self.positive_min = positive_min
+        self.positive_max = positive_max
+
+    @property
+    def average(self):
+        if self.sample_count == 0 or self.value_sum is None:
+            return None
+        return float(self.value_sum) / self.sample_count
+
+    def add(self, sample_count, value_sum, min_value, max_value, positive_min, positive_max):
+        """
+        Combines the statistics of another session into this summary
+        """
+        if sample_count == 0:
+            return
+        self.sample_count += sample_count
+        self.value_sum = value_sum if self.value_sum is None else self.value_sum + value_sum
+        self.min_value = _combine(min, self.min_value, min_value)
+        self.max_value = _combine(max, self.max_value, max_value)
+        self.positive_min = _combine(min, self.positive_min, positive_min)
+        self.positive_max = _combine(max, self.positive_max, positive_max)
+
+
+class LocationSummary(object):
+    """
+    Summary of the valid (non zero) GPS fixes across one or more sessions
+    """
+
+    def __init__(self):
+        self.sample_count = 0
+        self.latitude_sum = None
+        self.longitude_sum = None
+        self.min_latitude = None
+        self.max_latitude = None
+        self.min_longitude = None
+        self.max_longitude = None
+
+    @property
+    def center(self):
+        if self.sample_count == 0:
+            return (None, None)
+        return (float(self.latitude_sum) / self.sample_count, float(self.longitude_sum) / self.sample_count)
+
+    @property
+    def bounds(self):
+        if self.sample_count == 0:
+            return None
+        return ((self.min_latitude, self.min_longitude), (self.max_latitude, self.max_longitude))
+
+    def add(self, sample_count, latitude_sum, longitude_sum, min_latitude, max_latitude, min_longitude, max_longitude):
+        if sample_count == 0:
+            return
+        self.sample_count += sample_count
+        self.latitude_sum = latitude_sum if self.latitude_sum is None else self.latitude_sum + latitude_sum
+        self.longitude_sum = longitude_sum if self.longitude_sum is None else self.longitude_sum + longitude_sum
+        self.min_latitude = _combine(min, self.min_latitude, min_latitude)
+        self.max_latitude = _combine(max, self.max_latitude, max_latitude)
+        self.min_longitude = _combine(min, self.min_longitude, min_longitude)
+        self.max_longitude = _combine(max, self.max_longitude, max_longitude)
+
+
+def _combine(func, current, value):
+    if current is None:
+        return value
+    if value is None:
+        return current
+    return func(current, value)
+
+
+class ChannelStats(object):
+    """
+    Persistent per-session, per-channel statistics, so channel ranges and the
+    location center are read from a small table instead of aggregating the
+    session's datapoints every time they are needed.
+    """
+
+    def __init__(self, connection, read_connection=None):
+        self._conn = connection
+        self._read_conn = connection if read_connection is None else read_connection
+
+    def write_session(self, session_id, channel_rows, location_row=None):
+        """
+        Replaces the statistics for a session
+        :param channel_rows list of (name, sample_count, value_sum, min_value, max_value, positive_min, positive_max)
+        :type channel_rows list
+        :param location_row tuple of (sample_count, latitude_sum, longitude_sum, min_latitude, max_latitude,
+        min_longitude, max_longitude), or None if the session has no location channels
+        :type location_row tuple
+        """
+        self.delete_session(session_id)
+        self._conn.executemany("""INSERT INTO session_channel_stats
+            (session_id, name, sample_count, value_sum, min_value, max_value, positive_min, positive_max)
+            VALUES (?,?,?,?,?,?,?,?)""", [(session_id,) + tuple(row) for row in channel_rows])
+        if location_row is not None:
+            self._conn.execute("""INSERT INTO session_location_stats
+                (session_id, sample_count, latitude_sum, longitude_sum, min_latitude, max_latitude,
+                min_longitude, max_longitude)
+                VALUES (?,?,?,?,?,?,?,?)""", (session_id,) + tuple(location_row))
+
+    def set_computed(self, session_id, computed=True):
+        self._conn.execute('UPDATE session SET stats_computed = ? WHERE id = ?', (1 if computed else 0, session_id))
+
+    def get_uncomputed_sessions(self, session_ids=None):
+        """
+        Gets the sessions whose statistics have not been computed
+        :param session_ids the sessions to check, or None for all sessions
+        :type session_ids list
+        :return list of session ids
+        """
+        sql = 'SELECT id FROM session WHERE stats_computed = 0'
+        params = []
+        if session_ids:
+            sql += ' AND id IN({})'.format(','.join(['?'] * len(session_ids)))
+            params = list(session_ids)
+        return [row[0] for row in self._read_conn.execute(sql, params)]
+
+    def get_channel_summary(self, channel, session_ids=None):
+        """
+        Combines the statistics of a channel across sessions, skipping sessions whose
+        statistics are not computed
+        :param channel the channel name
+        :type channel string
+        :param session_ids the sessions to include, or None for all sessions
+        :type session_ids list
+        :return ChannelSummary
+        """
+        sql = """SELECT sample_count, value_sum, min_value, max_value, positive_min, positive_max
+            FROM session_channel_stats WHERE name = ? AND session_id IN(SELECT id FROM session WHERE stats_computed = 1)"""
+        params = [channel]
+        if session_ids:
+            sql += ' AND session_id IN({})'.format(','.join(['?'] * len(session_ids)))
+            params.extend(session_ids)
+        summary = ChannelSummary()
+        for row in self._read_conn.execute(sql, params):
+            summary.add(*row)
+        return summary
+
+    def get_location_summary(self, session_ids=None):
+        """
+        Combines the location statistics across sessions, skipping sessions whose
+        statistics are not computed
+        :param session_ids the sessions to include, or None for all sessions
+        :type session_ids list
+        :return LocationSummary
+        """
+        sql = """SELECT sample_count, latitude_sum, longitude_sum, min_latitude, max_latitude,
+            min_longitude, max_longitude FROM session_location_stats
+            WHERE session_id IN(SELECT id FROM session WHERE stats_computed = 1)"""
+        params = []
+        if session_ids:
+            sql += ' AND session_id IN({})'.format(','.join(['?'] * len(session_ids)))
+            params = list(session_ids)
+        summary = LocationSummary()
+        for row in self._read_conn.execute(sql, params):
+            summary.add(*row)
+        return summary
+
+    def delete_session(self, session_id):
+        self._conn.execute('DELETE FROM session_channel_stats WHERE session_id = ?', (session_id,))
+        self._conn.execute('DELETE FROM session_location_stats WHERE session_id = ?', (session_id,))
@@ -0,0 +1,205 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+import math
+import zlib
+from array import array
+
+__all__ = ('ColumnStore', 'ChunkWriter', 'pack_values', 'unpack_values')
+
+# Typecodes used for packing channel chunks. Float32 is preferred, but
+# we fall back to float64 for any chunk that would not survive the
+# round trip (e.g. Utc timestamps, high resolution GPS coordinates)
+FLOAT32 = 'f'
+FLOAT64 = 'd'
+
+NAN = float('nan')
+
+
+def pack_values(values):
+    """
+    Packs a list of channel values into a compressed binary blob.
+    None values are stored as NaN.
+    :param values the list of values to pack
+    :type values list
+    :return tuple of (typecode, blob)
+    """
+    floats = [NAN if v is None else float(v) for v in values]
+    packed = array(FLOAT32, floats)
+    for original, narrowed in zip(floats, packed):
+        if original != narrowed and not (math.isnan(original) and math.isnan(narrowed)):
+            packed = array(FLOAT64, floats)
+            break
+    return packed.typecode, zlib.compress(packed.tostring())
+
+
+def unpack_values(typecode, blob):
+    """
+    Unpacks a blob created by pack_values back into a list of values.
+    NaN values are returned as None.
+    :param typecode the array typecode the blob was packed with
+    :type typecode string
+    :param blob the compressed data
+    :type blob buffer
+    :return list of values
+    """
+    values = array(str(typecode))
+    values.fromstring(zlib.decompress(bytes(blob)))
+    return [None if v != v else v for v in values]
+
+
+class ChunkWriter(object):
+    """
+    Accumulates records for a session and writes them as per-channel chunks.
+    Records are expected in the same order as the channel names provided.
+    """
+
+    def __init__(self, column_store, session_id, channel_names):
+        self._column_store = column_store
+        self._session_id = session_id
+        self._channel_names = list(channel_names)
+        self._columns = [[] for c in self._channel_names]
+        self._chunk_index = column_store.get_chunk_count(session_id)
+
+    def append(self, record):
+        columns = self._columns
+        for index in range(len(columns)):
+            columns[index].append(record[index])
+        if len(columns[0]) >= self._column_store.chunk_size:
+            self.flush()
+
+    def flush(self):
+        columns = self._columns
+        if len(columns) == 0 or len(columns[0]) == 0:
+            return
+
+        self._column_store.write_chunk(self._session_id,
+                                       self._chunk_index,
+                                       self._channel_names,
+                                       columns)
+        self._chunk_index += 1
+        self._columns = [[] for c in self._channel_names]
+
+
+class ColumnStore(object):
+    """
+    Per-session, per-channel storage of channel data. Each channel's data is stored in
+    compressed chunks so that reading a few channels out of many only touches
+    the bytes for those channels.
+    """
+    DEFAULT_CHUNK_SIZE = 4096
+
+    def __init__(self, connection, chunk_size=DEFAULT_CHUNK_SIZE, read_connection=None):
+        self._conn = connection
+        self._read_conn = connection if read_connection is None else read_connection
+        self.chunk_size = chunk_size
+
+    def create_writer(self, session_id, channel_names):
+        """
+        Create a ChunkWriter for appending records to the specified session
+        :param session_id the session to write
+        :type session_id int
+        :param channel_names the ordered list of channel names for each record
+        :type channel_names list
+        :return ChunkWriter
+        """
+        return ChunkWriter(self, session_id, channel_names)
+
+    def get_chunk_count(self, session_id):
+        c = self._conn.cursor()
+        c.execute('SELECT MAX(chunk_index) FROM channel_chunk WHERE session_id = ?', (session_id,))
+        res = c.fetchone()
+        return 0 if res is None or res[0] is None else res[0] + 1
+
+    def write_chunk(self, session_id, chunk_index, channel_names, columns):
+        rows = []
+        for name, values in zip(channel_names, columns):
+            typecode, blob = pack_values(values)
+            rows.append((session_id, name, chunk_index, len(values), typecode, buffer(blob)))
+
+        self._conn.executemany("""INSERT INTO channel_chunk
+            (session_id, name, chunk_index, sample_count, typecode, data)
+            VALUES (?,?,?,?,?,?)""", rows)
+
+    def has_session(self, session_id):
+        c = self._conn.cursor()
+        c.execute('SELECT 1 FROM channel_chunk WHERE session_id = ? LIMIT 1', (session_id,))
+        return c.fetchone() is not None
+
+    def get_channel_names(self, session_id):
+        c = self._conn.cursor()
+        c.execute('SELECT DISTINCT name FROM channel_chunk WHERE session_id = ?', (session_id,))
+        return [row[0] for row in c.fetchall()]
+
+    def get_sample_count(self, session_id):
+        c = self._read_conn.cursor()
+        c.execute("""SELECT SUM(sample_count) FROM
+            (SELECT sample_count FROM channel_chunk WHERE session_id = ? GROUP BY chunk_index)""", (session_id,))
+        res = c.fetchone()
+        return 0 if res is None or res[0] is None else res[0]
+
+    def read_channel(self, session_id, channel):
+        """
+        Reads the values for a channel in the specified session.
+        :param session_id the session to read
+        :type session_id int
+        :param channel the channel to read
+        :type channel string
+        :return list of values, or None if the channel is not stored for this session
+        """
+        c = self._read_conn.cursor()
+        values = None
+        for typecode, data in c.execute("""SELECT typecode, data FROM channel_chunk WHERE session_id = ? AND name = ?
+                ORDER BY chunk_index ASC""", (session_id, channel)):
+            if values is None:
+                values = []
+            values.extend(unpack_values(typecode, data))
+        return values
+
+    def read_channels(self, session_id, channels):
+        """
+        Reads multiple channels for a session. Channels that are not stored
+        for this session are filled with None values.
+        :param session_id the session to read
+        :type session_id int
+        :param channels list of channel names
+        :type channels list
+        :return dict of channel name => list of values
+        """
+        columns = {}
+        missing = []
+        sample_count = 0
+        for channel in channels:
+            values = self.read_channel(session_id, channel)
+            if values is None:
+                missing.append(channel)
+            else:
+                columns[channel] = values
+                sample_count = len(values)
+
+        if len(missing) > 0:
+            if len(columns) == 0:
+                sample_count = self.get_sample_count(session_id)
+            for channel in missing:
+                columns[channel] = [None] * sample_count
+        return columns
+
+    def delete_session(self, session_id):
+        self._conn.execute('DELETE FROM channel_chunk WHERE session_id = ?', (session_id,))
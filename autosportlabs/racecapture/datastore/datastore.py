@@ -26,8 +26,23 @@ import os
 import os.path
 import time
 import datetime
+import multiprocessing
+from array import array
 from kivy.logger import Logger
 from collections import OrderedDict
+from autosportlabs.racecapture.datastore.columnstore import ColumnStore
+from autosportlabs.racecapture.datastore.lapindex import LapIndex, LAP_INDEX_CHANNELS
+from autosportlabs.racecapture.datastore.channelstats import ChannelStats
+
+# NumPy is optional; when unavailable typed datasets fall back to the
+# standard library array module
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+NAN = float('nan')
 
 
 class InvalidChannelException(Exception):
@@ -126,6 +141,242 @@ def _smooth_dataset(dset, smoothing_rate):
     return new_dset
 
 
+def _to_array(values, integer=False):
+    """
+    Converts a sequence of values into a contiguous typed array.
+    None values become NaN for float arrays.
+    :param values the values to convert
+    :type values sequence
+    :param integer True to create an integer array instead of float
+    :type integer bool
+    :return numpy.ndarray if NumPy is available, otherwise array.array
+    """
+    if numpy is not None:
+        return numpy.array(values, dtype=numpy.int64 if integer else numpy.float64)
+    if integer:
+        return array('l', values)
+    return array('d', [NAN if v is None else v for v in values])
+
+
+def _smooth_linear_array(values, smoothing_rate):
+    """
+    Vectorized equivalent of _smooth_dataset. Every nth point is kept and the
+    points in between are linearly interpolated. The interpolated points are
+    accumulated in the same order as _smooth_dataset so the output is identical.
+    """
+    count = len(values)
+    dpoints = values[0::smoothing_rate]
+    segments = len(dpoints) - 1
+    if segments < 1:
+        # not enough samples to interpolate between
+        return values.copy()
+
+    starts = dpoints[:-1]
+    ends = dpoints[1:]
+    slopes = (starts - ends) / float(1 - (smoothing_rate + 1))
+    slopes[starts == ends] = 0
+
+    steps = numpy.empty((segments, smoothing_rate), dtype=numpy.float64)
+    steps[:, 0] = starts
+    steps[:, 1:] = slopes[:, numpy.newaxis]
+    smoothed = numpy.empty(count, dtype=numpy.float64)
+    head_length = segments * smoothing_rate
+    smoothed[:head_length] = numpy.cumsum(steps, axis=1).ravel()
+    smoothed[head_length] = dpoints[-1]
+
+    # interpolate the tail end between the last point and the last sample
+    tail_length = count - head_length - 1
+    if tail_length > 0:
+        start = smoothed[head_length]
+        finish = values[-1]
+        slope = 0 if start == finish else (start - finish) / float(1 - (tail_length + 1))
+        tail = numpy.empty(tail_length, dtype=numpy.float64)
+        tail[0] = start
+        tail[1:] = slope
+        smoothed[head_length:count - 1] = numpy.cumsum(tail)
+        smoothed[-1] = finish
+
+    return smoothed
+
+
+def _smoothing_window(smoothing_rate):
+    # centered windows need an odd number of samples
+    return smoothing_rate + 1 if smoothing_rate % 2 == 0 else smoothing_rate
+
+
+def _smooth_moving_average(values, smoothing_rate):
+    """
+    Centered moving average over a window of smoothing_rate samples
+    (rounded up to an odd size). Samples beyond the ends are padded with
+    the first and last values.
+    """
+    window = _smoothing_window(smoothing_rate)
+    half = window // 2
+    if numpy is not None:
+        padded = numpy.pad(values, half, mode='edge')
+        return numpy.convolve(padded, numpy.ones(window) / window, mode='valid')
+
+    if len(values) == 0:
+        return array('d')
+    padded = [values[0]] * half + list(values) + [values[-1]] * half
+    return array('d', [sum(padded[i:i + window]) / window for i in range(len(values))])
+
+
+def _smooth_savitzky_golay(values, smoothing_rate, polyorder=2):
+    """
+    Savitzky-Golay filter over a window of smoothing_rate samples (rounded
+    up to an odd size). Samples beyond the ends are padded with the first
+    and last values.
+    """
+    if numpy is None:
+        raise DatastoreException("Savitzky-Golay smoothing requires NumPy")
+
+    window = max(_smoothing_window(smoothing_rate), polyorder + 1 + polyorder % 2)
+    half = window // 2
+    x = numpy.arange(-half, half + 1, dtype=numpy.float64)
+    coefficients = numpy.linalg.pinv(numpy.vander(x, polyorder + 1, increasing=True))[0]
+    padded = numpy.pad(values, half, mode='edge')
+    return numpy.convolve(padded, coefficients[::-1], mode='valid')
+
+
+SMOOTHING_LINEAR = 'linear'
+SMOOTHING_MOVING_AVERAGE = 'moving_average'
+SMOOTHING_SAVITZKY_GOLAY = 'savitzky_golay'
+SMOOTHING_MODES = (SMOOTHING_LINEAR, SMOOTHING_MOVING_AVERAGE, SMOOTHING_SAVITZKY_GOLAY)
+
+
+def _smooth_array(values, smoothing_rate, mode=SMOOTHING_LINEAR):
+    """
+    Smooths a channel using the specified smoothing mode.
+    :param values the channel values; None / NaN values are not interpolated
+    :type values sequence
+    :param smoothing_rate the smoothing rate, must be 2 or greater
+    :type smoothing_rate int
+    :param mode one of SMOOTHING_MODES
+    :type mode string
+    :return typed array of smoothed values
+    """
+    if not smoothing_rate or smoothing_rate < 2:
+        raise DatastoreException("Invalid smoothing rate")
+
+    values = _to_array(values)
+    if mode == SMOOTHING_LINEAR:
+        if numpy is None:
+            return array('d', _smooth_dataset(values.tolist(), smoothing_rate))
+        return _smooth_linear_array(values, smoothing_rate)
+    if mode == SMOOTHING_MOVING_AVERAGE:
+        return _smooth_moving_average(values, smoothing_rate)
+    if mode == SMOOTHING_SAVITZKY_GOLAY:
+        return _smooth_savitzky_golay(values, smoothing_rate)
+    raise DatastoreException("Invalid smoothing mode: {}".format(mode))
+
+
+def _split_log_chunks(data_file, chunk_size):
+    """
+    Splits the remainder of a log file into byte ranges of roughly chunk_size,
+    aligned to line boundaries. The file position is left unchanged.
+    :param data_file the open log file, positioned at the first data line
+    :type data_file file
+    :param chunk_size the target size of each chunk in bytes
+    :type chunk_size int
+    :return list of (start, end) byte offsets
+    """
+    start_pos = data_file.tell()
+    size = os.fstat(data_file.fileno()).st_size
+    offsets = [start_pos]
+    while offsets[-1] + chunk_size < size:
+        data_file.seek(offsets[-1] + chunk_size)
+        data_file.readline()
+        position = data_file.tell()
+        if position >= size:
+            break
+        offsets.append(position)
+    offsets.append(size)
+    data_file.seek(start_pos)
+    return [(offsets[i], offsets[i + 1]) for i in range(len(offsets) - 1) if offsets[i + 1] > offsets[i]]
+
+
+def _parse_log_chunk(task):
+    """
+    Parses a chunk of a RaceCapture CSV log and carries values forward within the chunk.
+    Values at the start of the chunk that precede the first value of a channel are left
+    as None; they are resolved by the caller using the state of the previous chunks.
+    Runs in a worker process, so it must not touch the database or the logger.
+    :param task tuple of (path, start offset, end offset, expected channel count)
+    :type task tuple
+    :return tuple of (records, line count, list of unparseable line indexes,
+             list of (line index, line, channel count) for lines with an unexpected channel count)
+    """
+    path, start, end, channel_count = task
+    with open(path, 'rb') as data_file:
+        data_file.seek(start)
+        lines = data_file.read(end - start).split('\n')
+    if len(lines) > 0 and lines[-1] == '':
+        lines.pop()
+
+    records = []
+    bad_lines = []
+    bad_counts = []
+    last = [None] * channel_count
+    channel_range = range(channel_count)
+    for index, line in enumerate(lines):
+        try:
+            record = [None if x == '' else float(x) for x in line.strip().split(',')]
+        except Exception:
+            bad_lines.append(index)
+            continue
+
+        if len(record) != channel_count:
+            bad_counts.append((index, line, len(record)))
+            continue
+
+        for c in channel_range:
+            value = record[c]
+            if value is None:
+                record[c] = last[c]
+            else:
+                last[c] = value
+        records.append(record)
+
+    return records, len(lines), bad_lines, bad_counts
+
+
+def _create_export_row_formatter(channels):
+    """
+    Creates the function used to format export rows for the specified channels.
+    The per channel work (system channel check, sample interval) is resolved up front
+    so formatting a row is a single pass over the record.
+    :param channels the channels being exported, in record order
+    :type channels list of DatalogChannel
+    :return function(record, elapsed) returning a tuple of (sampled, line)
+    """
+    columns = []
+    for index, channel in enumerate(channels):
+        # first column of the record is session id, so skip it
+        if channel.name in DataStore.SYSTEM_CHANNELS:
+            columns.append((1 + index, None))
+        else:
+            columns.append((1 + index, DataStore.MAX_SAMPLE_RATE / channel.sample_rate))
+    columns = tuple(columns)
+
+    def format_row(record, elapsed):
+        sampled = False
+        values = []
+        for index, interval in columns:
+            value = record[index]
+            if interval is None:
+                # our system channels are in long integer format
+                values.append('' if value is None else str(long(value)))
+            elif elapsed % interval == 0:
+                values.append('' if value is None else str(value))
+                sampled = True
+            else:
+                values.append('')
+        return sampled, ','.join(values)
+
+    return format_row
+
+
 def _scrub_sql_value(value):
     """
     Takes a string and makes it safe for a sql parameter, and wraps it in double quotes.
@@ -143,36 +394,91 @@ def _scrub_sql_value(value):
 
 class DataSet(object):
 
-    def __init__(self, cursor, smoothing_map=None):
+    def __init__(self, cursor, smoothing_map=None, smoothing_mode=SMOOTHING_LINEAR):
         self._cur = cursor
         self._smoothing_map = smoothing_map
+        self._smoothing_mode = smoothing_mode
 
     @property
     def channels(self):
         return [x[0] for x in self._cur.description]
 
-    def fetch_columns(self, count=None):
-        chanmap = {}
-        channels = [x[0] for x in self._cur.description]
+    def _fetch_raw_columns(self, count=None):
+        channels = self.channels
 
         if count == None:
             dset = self._cur.fetchall()
         else:
             dset = self._cur.fetchmany(count)
+
+        chanmap = {}
         for c in channels:
             idx = channels.index(c)
-            chan_dataset = [x[idx] for x in dset]
+            chanmap[c] = [x[idx] for x in dset]
+        return chanmap
 
+    def fetch_columns(self, count=None):
+        chanmap = self._fetch_raw_columns(count)
+
+        for c, chan_dataset in chanmap.iteritems():
             # If we received a smoothing map and the smoothing rate of
             # the selected channel is > 1, smooth it out before
             # returning it to the user
             if self._smoothing_map and self._smoothing_map[c] > 1:
-                chan_dataset = _smooth_dataset(
-                    chan_dataset, self._smoothing_map[c])
-            chanmap[c] = chan_dataset
+                smoothed = _smooth_array(chan_dataset, self._smoothing_map[c], self._smoothing_mode)
+                chanmap[c] = [None if v != v else v for v in smoothed.tolist()]
 
         return chanmap
 
+    def _fetch_raw_arrays(self, count=None):
+        if numpy is None:
+            chanmap = self._fetch_raw_columns(count)
+            return dict((c, _to_array(values, c == 'session_id')) for c, values in chanmap.iteritems())
+
+        channels = self.channels
+        if count == None:
+            dset = self._cur.fetchall()
+        else:
+            dset = self._cur.fetchmany(count)
+
+        # convert the whole result set in one pass, then split it into
+        # contiguous per channel arrays
+        table = numpy.array(dset, dtype=numpy.float64).reshape(len(dset), len(channels))
+        chanmap = {}
+        for c in channels:
+            idx = channels.index(c)
+            column = numpy.ascontiguousarray(table[:, idx])
+            chanmap[c] = column.astype(numpy.int64) if c == 'session_id' else column
+        return chanmap
+
+    def fetch_arrays(self, count=None):
+        """
+        Fetches the dataset as one typed array per channel. Channel values are
+        float64 with NULL values represented as NaN; session_id is int64.
+        Uses NumPy arrays when available, otherwise array.array.
+        :param count the number of records to fetch, or None for all remaining records
+        :type count int
+        :return dict of channel name => array
+        """
+        chanmap = self._fetch_raw_arrays(count)
+
+        for c, chan_dataset in chanmap.iteritems():
+            if self._smoothing_map and self._smoothing_map[c] > 1:
+                chanmap[c] = _smooth_array(chan_dataset, self._smoothing_map[c], self._smoothing_mode)
+
+        return chanmap
+
+    def fetch_raw_records(self, count=None):
+        """
+        Fetches records as tuples in channel order, without smoothing
+        :param count the number of records to fetch, or None for all remaining records
+        :type count int
+        :return list of tuples
+        """
+        if count == None:
+            return self._cur.fetchall()
+        return self._cur.fetchmany(count)
+
     def fetch_records(self, count=None):
         chanmap = self.fetch_columns(count)
 
@@ -185,6 +491,40 @@ class DataSet(object):
         return zip(*zlist)
 
 
+class ColumnarDataSet(DataSet):
+    """
+    DataSet backed by channel columns read from the ColumnStore
+    instead of a database cursor
+    """
+
+    def __init__(self, channels, columns, smoothing_map=None, smoothing_mode=SMOOTHING_LINEAR):
+        super(ColumnarDataSet, self).__init__(None, smoothing_map, smoothing_mode)
+        self._channels = channels
+        self._columns = columns
+        self._position = 0
+
+    @property
+    def channels(self):
+        return self._channels[:]
+
+    def _fetch_raw_columns(self, count=None):
+        start = self._position
+        end = None if count is None else start + count
+        chanmap = {}
+        for c in self._channels:
+            chanmap[c] = self._columns[c][start:end]
+        self._position += len(chanmap[self._channels[0]])
+        return chanmap
+
+    def _fetch_raw_arrays(self, count=None):
+        chanmap = self._fetch_raw_columns(count)
+        return dict((c, _to_array(values, c == 'session_id')) for c, values in chanmap.iteritems())
+
+    def fetch_raw_records(self, count=None):
+        chanmap = self._fetch_raw_columns(count)
+        return zip(*[chanmap[c] for c in self._channels])
+
+
 class Session(object):
 
     def __init__(self, session_id, name, notes='', date=None):
@@ -196,10 +536,16 @@ class Session(object):
 
 class Lap(object):
 
-    def __init__(self, lap, session_id, lap_time):
+    def __init__(self, lap, session_id, lap_time, first_sample_id=None, last_sample_id=None,
+                 start_interval=None, end_interval=None, distance=None):
         self.lap = lap
         self.session_id = session_id
         self.lap_time = lap_time
+        self.first_sample_id = first_sample_id
+        self.last_sample_id = last_sample_id
+        self.start_interval = start_interval
+        self.end_interval = end_interval
+        self.distance = distance
 
 # Filter container class
 
@@ -315,20 +661,86 @@ class DataStore(object):
     # the log
     SYSTEM_CHANNELS = ['Interval', 'Utc']
 
+    # SQLite tuning profiles, selectable in preferences and applied when the
+    # database is opened. The pragmas are applied in order; page_size only takes
+    # effect for a newly created database.
+    TUNING_PROFILE_DEFAULT = 'Default'
+    TUNING_PROFILES = OrderedDict([
+        (TUNING_PROFILE_DEFAULT, []),
+        ('Performance', [('page_size', 4096),
+                         ('journal_mode', 'WAL'),
+                         ('synchronous', 'NORMAL'),
+                         ('cache_size', -16384),
+                         ('mmap_size', 64 * 1024 * 1024),
+                         ('temp_store', 'MEMORY')]),
+        ('Durable', [('page_size', 4096),
+                     ('journal_mode', 'WAL'),
+                     ('synchronous', 'FULL'),
+                     ('cache_size', -8192),
+                     ('mmap_size', 0),
+                     ('temp_store', 'DEFAULT')]),
+        ('Low Memory', [('page_size', 4096),
+                        ('journal_mode', 'WAL'),
+                        ('synchronous', 'NORMAL'),
+                        ('cache_size', -1024),
+                        ('mmap_size', 0),
+                        ('temp_store', 'FILE')])
+    ])
+
+    # Pragmas that apply to the database file rather than a connection
+    DATABASE_PRAGMAS = ['page_size', 'journal_mode', 'synchronous']
+
+    # Number of records read from the database per batch when exporting
+    EXPORT_BATCH_SIZE = 1000
+
+    # Channels aggregated per statement when computing channel statistics; each channel
+    # takes 6 result columns, and SQLite allows 2000 by default
+    STATS_BATCH_CHANNELS = 300
+
+    # Size in bytes of the log chunks parsed in parallel when importing
+    IMPORT_CHUNK_SIZE = 1024 * 1024
+
+    # Smaller logs are split into this many chunks, so import progress is reported as it goes
+    IMPORT_PROGRESS_STEPS = 20
+
+    # Smallest log chunk when splitting a small log for progress
+    IMPORT_MIN_CHUNK_SIZE = 16 * 1024
+
+    # Number of worker processes used to parse log chunks; None uses the CPU count
+    IMPORT_WORKERS = None
+
+    # SQLite page cache size used while importing, in KiB
+    IMPORT_CACHE_SIZE_KB = 16384
+
     # Channels to index on, WARNING: only [A-z] channel names with no spaces
     # will work currently
     EXTRA_INDEX_CHANNELS = ["CurrentLap"]
     val_filters = ['lt', 'gt', 'eq', 'lt_eq', 'gt_eq']
 
-    def __init__(self, databus=None):
+    def __init__(self, databus=None, columnar=False, tuning_profile=TUNING_PROFILE_DEFAULT):
         self._channels = []
         self._isopen = False
         self.datalogchanneltypes = {}
         self._ending_datalog_id = 0
         self._conn = None
+        self._read_conn = None
+        self.tuning_profile = tuning_profile
         self._databus = databus
+        self._columnar = columnar
+        self._column_store = None
+        self._smoothing_mode = SMOOTHING_LINEAR
+        self._datapoint_insert_sql = {}
+        self._lap_index = None
+        # session id => LapIndexer for sessions being recorded
+        self._lap_indexers = {}
+        self._channel_stats = None
+        # sessions being recorded, whose statistics are not final yet
+        self._recording_sessions = set()
 
     def close(self):
+        if self._read_conn is not self._conn:
+            self._read_conn.close()
+        self._read_conn = None
         self._conn.close()
         self._isopen = False
 
@@ -348,6 +760,15 @@ class DataStore(object):
         self._conn = sqlite_conn.connection
         sqlite_conn.detach()
 
+        pragmas = DataStore.TUNING_PROFILES[self._tuning_profile]
+        self._apply_pragmas(self._conn, pragmas)
+        self._read_conn = self._open_read_connection(db_path, pragmas)
+
+        self._column_store = ColumnStore(self._conn, read_connection=self._read_conn)
+        self._lap_index = LapIndex(self._conn, self._read_conn)
+        self._lap_indexers = {}
+        self._channel_stats = ChannelStats(self._conn, self._read_conn)
+        self._recording_sessions = set()
         self._populate_channel_list()
 
         self._isopen = True
@@ -356,6 +777,70 @@ class DataStore(object):
     def connection(self):
         return self._conn
 
+    @property
+    def read_connection(self):
+        """
+        The connection used for analysis queries. This is a separate read-only
+        connection when the database is in WAL mode, so reads never block the
+        session recorder; otherwise it is the main connection.
+        """
+        return self._read_conn
+
+    @property
+    def tuning_profile(self):
+        """
+        The name of the SQLite tuning profile, one of TUNING_PROFILES.
+        Takes effect the next time the database is opened.
+        """
+        return self._tuning_profile
+
+    @tuning_profile.setter
+    def tuning_profile(self, value):
+        if value not in DataStore.TUNING_PROFILES:
+            raise DatastoreException("Unknown tuning profile: {}".format(value))
+        self._tuning_profile = value
+
+    def _apply_pragmas(self, connection, pragmas):
+        for pragma, value in pragmas:
+            connection.execute('PRAGMA {} = {}'.format(pragma, value))
+            Logger.debug('DataStore: PRAGMA {} = {}'.format(pragma, value))
+
+    def _open_read_connection(self, db_path, pragmas):
+        journal_mode = self._conn.execute('PRAGMA journal_mode').fetchone()[0]
+        if journal_mode.lower() != 'wal' or db_path == ':memory:':
+            return self._conn
+
+        read_conn = sqlite3.connect(db_path, check_same_thread=False)
+        read_conn.execute('PRAGMA query_only = ON')
+        self._apply_pragmas(read_conn, [(pragma, value) for pragma, value in pragmas
+                                        if pragma not in DataStore.DATABASE_PRAGMAS])
+        return read_conn
+
+    @property
+    def columnar(self):
+        """
+        True if sessions are also stored in the columnar channel store,
+        which is then used to answer queries
+        """
+        return self._columnar
+
+    @columnar.setter
+    def columnar(self, value):
+        self._columnar = value
+
+    @property
+    def smoothing_mode(self):
+        """
+        The smoothing mode applied to channels with a smoothing rate, one of SMOOTHING_MODES
+        """
+        return self._smoothing_mode
+
+    @smoothing_mode.setter
+    def smoothing_mode(self, value):
+        if value not in SMOOTHING_MODES:
+            raise DatastoreException("Invalid smoothing mode: {}".format(value))
+        self._smoothing_mode = value
+
     def _populate_channel_list(self):
         del self._channels[:]
         channels = self.get_channel_list()
@@ -554,6 +1039,7 @@ class DataStore(object):
             base_sql = "INSERT INTO datapoint ({}) VALUES({});".format(','.join(['sample_id'] + [_scrub_sql_value(x.name) for x in channels]),
                                                                        ','.join(['?'] * (len(extrap_vals) + 1)))
             cursor.execute(base_sql, extrap_vals)
+            self._index_samples(session_id, [datalog_id], [dict(zip([x.name for x in channels], record))])
             self._conn.commit()
         except:  # rollback under any exception, then re-raise exception
             self._conn.rollback()
@@ -582,23 +1068,83 @@ class DataStore(object):
                 """INSERT INTO sample (session_id) VALUES (?)""", [session_id])
             sample_id = cursor.lastrowid
 
-            values = [sample_id]
-            names = []
-
-            for channel_name, value in sample.iteritems():
-                values.append(value)
-                names.append(channel_name)
+            names = tuple(sample.iterkeys())
+            cursor.execute(self._get_datapoint_insert_sql(names), [sample_id] + sample.values())
+            self._index_samples(session_id, [sample_id], [sample])
 
-            # Put together an insert statement containing the column names
-            base_sql = "INSERT INTO datapoint ({}) VALUES({});".format(','.join(['sample_id'] + [_scrub_sql_value(x) for x in names]),
-                                                                       ','.join(['?'] * (len(values))))
+        except:  # rollback under any exception, then re-raise exception
+            self._conn.rollback()
+            raise
 
-            cursor.execute(base_sql, values)
+    def insert_samples(self, samples, session_id):
+        """
+        Inserts a batch of samples and commits them in a single transaction.
+        Sample IDs are allocated up front so both the sample and datapoint
+        tables can be written with executemany.
+        :param samples list of samples, each a dict of channel name => value
+        :type samples list
+        :param session_id the session the samples belong to
+        :type session_id int
+        """
+        if len(samples) == 0:
+            return
 
+        cursor = self._conn.cursor()
+        try:
+            first_sample_id = self._get_last_table_id('sample') + 1
+            sample_ids = range(first_sample_id, first_sample_id + len(samples))
+            cursor.executemany("""INSERT INTO sample (id, session_id) VALUES (?, ?)""",
+                               [(sample_id, session_id) for sample_id in sample_ids])
+
+            # group consecutive samples with the same channels so each group
+            # is written with one statement
+            group_names = None
+            group = []
+            for sample_id, sample in zip(sample_ids, samples):
+                names = tuple(sample.iterkeys())
+                if names != group_names:
+                    if len(group) > 0:
+                        cursor.executemany(self._get_datapoint_insert_sql(group_names), group)
+                    group_names = names
+                    group = []
+                group.append([sample_id] + sample.values())
+            cursor.executemany(self._get_datapoint_insert_sql(group_names), group)
+            self._index_samples(session_id, sample_ids, samples)
+            self._conn.commit()
         except:  # rollback under any exception, then re-raise exception
             self._conn.rollback()
             raise
 
+    def _index_samples(self, session_id, sample_ids, samples):
+        """
+        Updates the lap index for samples being recorded into a session
+        """
+        indexer = self._lap_indexers.get(session_id)
+        if indexer is None:
+            indexer = self._lap_index.create_indexer(session_id)
+            self._lap_indexers[session_id] = indexer
+
+        for sample_id, sample in zip(sample_ids, samples):
+            if 'CurrentLap' in sample or 'LapCount' in sample:
+                indexer.add(sample_id, *[sample.get(c) for c in LAP_INDEX_CHANNELS])
+        indexer.flush()
+
+    def _get_datapoint_insert_sql(self, names):
+        """
+        Returns the datapoint INSERT statement for the specified channel names.
+        Statements are cached per channel set; reusing the same SQL also lets
+        sqlite3 reuse its prepared statement.
+        :param names the channel names, in value order
+        :type names tuple
+        :return string
+        """
+        sql = self._datapoint_insert_sql.get(names)
+        if sql is None:
+            sql = "INSERT INTO datapoint ({}) VALUES({});".format(','.join(['sample_id'] + [_scrub_sql_value(x) for x in names]),
+                                                                  ','.join(['?'] * (len(names) + 1)))
+            self._datapoint_insert_sql[names] = sql
+        return sql
+
     def _extrap_datapoints(self, datapoints):
         """
         Takes a list of datapoints, and returns a new list of extrapolated datapoints
@@ -790,6 +1336,11 @@ class DataStore(object):
             yield ds_to_yield
 
     def delete_session(self, session_id):
+        self._column_store.delete_session(session_id)
+        self._lap_index.delete_session(session_id)
+        self._lap_indexers.pop(session_id, None)
+        self._channel_stats.delete_session(session_id)
+        self._recording_sessions.discard(session_id)
         self._conn.execute(
             """DELETE FROM datapoint WHERE sample_id in (select id from sample where session_id = ?)""", (session_id,))
         self._conn.execute(
@@ -801,6 +1352,10 @@ class DataStore(object):
 
     def init_session(self, name, channel_metas=None, notes=''):
         session_id = self.create_session(name, notes)
+        # samples recorded into this session maintain the lap index as they are inserted
+        self._lap_index.set_indexed(session_id)
+        self._conn.commit()
+        self._recording_sessions.add(session_id)
 
         if channel_metas:
             session_channels = []
@@ -841,70 +1396,338 @@ class DataStore(object):
         takes a raw dataset in the form of a CSV file and inserts the data
         into the sqlite database.
 
+        The file is split into chunks which are parsed in a pool of worker
+        processes; the results are desparsified and inserted in file order.
+        Values are carried forward across chunk boundaries, and the leading
+        values of a channel are back-filled with its first value, matching
+        _desparsified_data_generator.
+
         This function is not thread-safe.
         """
 
         starting_datalog_id = self._get_last_table_id('sample') + 1
         self._ending_datalog_id = starting_datalog_id
 
-        def sample_iter(count, sample_id):
-            for x in range(count):
-                yield [sample_id]
-
-        def datapoint_iter(data, datalog_id):
-            for record in data:
-                record = [datalog_id] + record
-                datalog_id += 1
-                yield record
-            self._ending_datalog_id = datalog_id
-
-        # Create the generator for the desparsified data
-        newdata_gen = self._desparsified_data_generator(
-            data_file, warnings=warnings, progress_cb=progress_cb)
+        channel_count = len(headers)
+        data_size = os.fstat(data_file.fileno()).st_size - data_file.tell()
+        chunk_size = max(DataStore.IMPORT_MIN_CHUNK_SIZE,
+                         min(DataStore.IMPORT_CHUNK_SIZE, data_size // DataStore.IMPORT_PROGRESS_STEPS))
+        chunks = _split_log_chunks(data_file, chunk_size)
+        total_bytes = max(1, sum(end - start for start, end in chunks))
+        tasks = [(data_file.name, start, end, channel_count) for start, end in chunks]
 
         # Put together an insert statement containing the column names
-        datapoint_sql = "INSERT INTO datapoint ({}) VALUES ({});".format(','.join(['sample_id'] + [_scrub_sql_value(x.name) for x in headers]),
-                                                                         ','.join(['?'] * (len(headers) + 1)))
+        column_names = [_scrub_sql_value(x.name) for x in headers]
+        datapoint_sql = "INSERT INTO datapoint ({}) VALUES ({});".format(','.join(['sample_id'] + column_names),
+                                                                         ','.join(['?'] * (channel_count + 1)))
 
         # Relatively static insert statement for sample table
         sample_sql = "INSERT INTO sample (session_id) VALUES (?)"
 
-        # Use a generator to efficiently insert data into table, within a
-        # transaction
+        column_writer = None
+        if self._columnar:
+            column_writer = self._column_store.create_writer(
+                session_id, [x.name for x in headers])
+        rebuild_columns = False
+        # set when an earlier chunk's lap channel values are back-filled after the indexer saw them
+        rebuild_laps = False
+
+        header_names = [x.name for x in headers]
+        lap_indexer = None
+        lap_channel_indexes = None
+        if 'CurrentLap' in header_names:
+            lap_indexer = self._lap_index.create_indexer(session_id)
+            lap_channel_indexes = [header_names.index(c) if c in header_names else None for c in LAP_INDEX_CHANNELS]
+
+        # last value seen for each channel, carried into the next chunk
+        carry = [None] * channel_count
+        bytes_done = 0
+        line_offset = 0
+        datalog_id = starting_datalog_id
+
+        # only worth a worker pool once the log spans several full size chunks
+        pool = self._create_import_pool((data_size + DataStore.IMPORT_CHUNK_SIZE - 1) // DataStore.IMPORT_CHUNK_SIZE)
+        previous_pragmas = self._set_import_pragmas()
         cur = self._conn.cursor()
         try:
-            cur.executemany(
-                datapoint_sql, datapoint_iter(newdata_gen, starting_datalog_id))
-            cur.executemany(sample_sql, sample_iter(
-                self._ending_datalog_id - starting_datalog_id, session_id))
+            results = pool.imap(_parse_log_chunk, tasks) if pool is not None else (_parse_log_chunk(t) for t in tasks)
+            for (start, end), (records, line_count, bad_lines, bad_counts) in zip(chunks, results):
+                self._log_import_problems(line_offset, channel_count, bad_lines, bad_counts, warnings)
+                line_offset += line_count
+
+                record_count = len(records)
+                for c in range(channel_count):
+                    carry_value = carry[c]
+                    index = 0
+                    while index < record_count and records[index][c] is None:
+                        index += 1
+                    if index == 0 or (index == record_count and carry_value is None):
+                        pass
+                    elif carry_value is not None:
+                        for record in records[:index]:
+                            record[c] = carry_value
+                    else:
+                        # first value for this channel in the session; back-fill
+                        # the rows before it, including those already inserted
+                        first_value = records[index][c]
+                        for record in records[:index]:
+                            record[c] = first_value
+                        if datalog_id > starting_datalog_id:
+                            cur.execute('UPDATE datapoint SET {} = ? WHERE sample_id >= ? AND sample_id < ?'.format(column_names[c]),
+                                        (first_value, starting_datalog_id, datalog_id))
+                            rebuild_columns = True
+                            if lap_indexer is not None and c in lap_channel_indexes:
+                                rebuild_laps = True
+                    if record_count > 0:
+                        carry[c] = records[-1][c]
+
+                cur.executemany(datapoint_sql, ([datalog_id + i] + record for i, record in enumerate(records)))
+                cur.executemany(sample_sql, [(session_id,)] * record_count)
+
+                if lap_indexer is not None and not rebuild_laps:
+                    for i, record in enumerate(records):
+                        lap_indexer.add(datalog_id + i, *[None if c is None else record[c] for c in lap_channel_indexes])
+
+                datalog_id += record_count
+
+                if column_writer is not None and not rebuild_columns:
+                    for record in records:
+                        column_writer.append(record)
+
+                bytes_done += end - start
+                if progress_cb:
+                    progress_cb(float(bytes_done) / total_bytes * 100)
+
+            self._ending_datalog_id = datalog_id
+            if column_writer is not None and not rebuild_columns:
+                column_writer.flush()
+            if lap_indexer is not None and not rebuild_laps:
+                lap_indexer.flush()
+            self._lap_index.set_indexed(session_id)
             self._conn.commit()
         except:  # rollback under any exception, then re-raise exception
             self._conn.rollback()
+            if pool is not None:
+                pool.terminate()
             raise
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            self._restore_pragmas(previous_pragmas)
+
+        if column_writer is not None and rebuild_columns:
+            self.build_session_columns(session_id)
+        if rebuild_laps:
+            self.build_lap_index(session_id)
+
+    def _create_import_pool(self, chunk_count):
+        """
+        Creates the process pool for parsing log chunks, or returns None if the
+        import should be done in this process
+        """
+        workers = DataStore.IMPORT_WORKERS
+        if workers is None:
+            try:
+                workers = multiprocessing.cpu_count()
+            except NotImplementedError:
+                workers = 1
+        workers = min(workers, chunk_count)
+        if workers < 2:
+            return None
+        try:
+            return multiprocessing.Pool(workers)
+        except (OSError, ImportError) as e:
+            # some platforms (e.g. Android) do not support process pools
+            Logger.warn('DataStore: unable to create import worker pool, importing in process: {}'.format(e))
+            return None
+
+    def _log_import_problems(self, line_offset, channel_count, bad_lines, bad_counts, warnings):
+        for index in bad_lines:
+            Logger.warn('Datastore: could not parse logfile data at line {}'.format(line_offset + index))
+        for index, line, count in bad_counts:
+            warn_msg = 'Unexpected channel count in line {}. Expected {}, got {}'.format(
+                line_offset + index, channel_count, count)
+            if warnings is not None:
+                warnings.append((line, warn_msg))
+            Logger.warn("DataStore: {}".format(warn_msg))
+
+    def _set_import_pragmas(self):
+        """
+        Relaxes durability and enlarges the page cache for a bulk import.
+        :return the previous pragma values, for _restore_pragmas
+        """
+        previous = {}
+        for pragma, value in (('synchronous', 'OFF'),
+                              ('cache_size', -DataStore.IMPORT_CACHE_SIZE_KB),
+                              ('temp_store', 'MEMORY')):
+            previous[pragma] = self._conn.execute('PRAGMA {}'.format(pragma)).fetchone()[0]
+            self._conn.execute('PRAGMA {} = {}'.format(pragma, value))
+        return previous
+
+    def _restore_pragmas(self, pragmas):
+        for pragma, value in pragmas.iteritems():
+            self._conn.execute('PRAGMA {} = {}'.format(pragma, value))
+
+    def finalize_session(self, session_id):
+        """
+        Performs post-processing for a session once it has finished recording.
+        :param session_id the session that was recorded
+        :type session_id int
+        """
+        indexer = self._lap_indexers.pop(session_id, None)
+        if indexer is not None:
+            indexer.flush()
+            self._conn.commit()
 
-    def get_location_center(self, sessions=None):
+        self._recording_sessions.discard(session_id)
+        if not self._lap_index.is_indexed(session_id):
+            self.build_lap_index(session_id)
+        self.build_channel_stats(session_id)
 
-        if not (self.channel_exists('Latitude') and self.channel_exists('Longitude')):
-            return (0, 0)
+        if self._columnar and not self._column_store.has_session(session_id):
+            self.build_session_columns(session_id)
 
-        c = self._conn.cursor()
+    def build_session_columns(self, session_id):
+        """
+        Populates the columnar store for the specified session from the datapoint table.
+        Used for sessions recorded live, or imported before the columnar store was enabled.
+        :param session_id the session to convert
+        :type session_id int
+        """
+        channel_names = [c.name for c in self.get_channel_list(session_id)]
+        if len(channel_names) == 0:
+            return
+
+        column_store = self._column_store
+        column_store.delete_session(session_id)
+        writer = column_store.create_writer(session_id, channel_names)
+        dataset = self._query_rows([session_id], channel_names)
+        try:
+            while True:
+                # read the raw (unsmoothed) values
+                chanmap = dataset._fetch_raw_columns(column_store.chunk_size)
+                records = zip(*[chanmap[c] for c in channel_names])
+                if len(records) == 0:
+                    break
+                for record in records:
+                    writer.append(record)
+            writer.flush()
+            self._conn.commit()
+        except:  # rollback under any exception, then re-raise exception
+            self._conn.rollback()
+            raise
 
-        base_sql = 'SELECT AVG(Latitude), AVG(Longitude) from datapoint'
-        params = ','.join(['?'] * (len(sessions)))
+    def build_channel_stats(self, session_id):
+        """
+        (Re)computes the channel statistics for a session with a pass over its datapoints.
+        Called when a session is finalized or imported; sessions still being recorded are
+        computed but not marked as final.
+        :param session_id the session id
+        :type session_id int
+        """
+        channels = [c.name for c in self.get_channel_list(session_id) if self.channel_exists(c.name)]
+        has_location = 'Latitude' in channels and 'Longitude' in channels
+        channel_rows, location_row = self._query_channel_stats([session_id], channels, has_location)
+        try:
+            self._channel_stats.write_session(session_id, channel_rows, location_row)
+            self._channel_stats.set_computed(session_id, session_id not in self._recording_sessions)
+            self._conn.commit()
+        except:  # rollback under any exception, then re-raise exception
+            self._conn.rollback()
+            raise
 
-        if type(sessions) == list and len(sessions) > 0:
-            base_sql += """ JOIN sample ON datapoint.sample_id=sample.id WHERE sample.session_id IN({}) AND
-            datapoint.Latitude != 0 AND datapoint.Longitude != 0""".format(params)
+    def _query_channel_stats(self, session_ids, channels, location=False):
+        """
+        Aggregates channel statistics from the datapoints of the specified sessions,
+        in batches of STATS_BATCH_CHANNELS channels per statement.
+        :return tuple of (channel rows, location row) in the format of ChannelStats.write_session
+        """
+        session_clause = 'sample.session_id IN({})'.format(','.join(['?'] * len(session_ids)))
+        c = self._read_conn.cursor()
+        channel_rows = []
+        batch_size = DataStore.STATS_BATCH_CHANNELS
+        for start in range(0, len(channels), batch_size):
+            batch = channels[start:start + batch_size]
+            aggregates = []
+            for channel in batch:
+                column = 'datapoint.{}'.format(_scrub_sql_value(channel))
+                aggregates.append('COUNT({0}), SUM({0}), MIN({0}), MAX({0}), '
+                                  'MIN(CASE WHEN {0} > 0 THEN {0} END), MAX(CASE WHEN {0} > 0 THEN {0} END)'.format(column))
+            c.execute("""SELECT {} FROM datapoint JOIN sample ON datapoint.sample_id=sample.id
+                         WHERE {}""".format(', '.join(aggregates), session_clause), session_ids)
+            res = c.fetchone()
+            for index, channel in enumerate(batch):
+                channel_rows.append((channel,) + tuple(res[index * 6:index * 6 + 6]))
+
+        location_row = None
+        if location:
+            valid_fix = 'datapoint.Latitude != 0 AND datapoint.Longitude != 0'
+            c.execute("""SELECT COUNT(CASE WHEN {0} THEN 1 END),
+                         SUM(CASE WHEN {0} THEN datapoint.Latitude END),
+                         SUM(CASE WHEN {0} THEN datapoint.Longitude END),
+                         MIN(CASE WHEN {0} THEN datapoint.Latitude END),
+                         MAX(CASE WHEN {0} THEN datapoint.Latitude END),
+                         MIN(CASE WHEN {0} THEN datapoint.Longitude END),
+                         MAX(CASE WHEN {0} THEN datapoint.Longitude END)
+                         FROM datapoint JOIN sample ON datapoint.sample_id=sample.id
+                         WHERE {1}""".format(valid_fix, session_clause), session_ids)
+            location_row = tuple(c.fetchone())
+        return channel_rows, location_row
+
+    def _ensure_channel_stats(self, sessions=None):
+        """
+        Computes the statistics of sessions stored without them, e.g. before the statistics
+        existed or by a recording that was cut short, so later reads come from the statistics.
+        :return list of the sessions still recording, whose statistics are aggregated on each read
+        """
+        recording = []
+        for session_id in self._channel_stats.get_uncomputed_sessions(sessions):
+            if session_id in self._recording_sessions:
+                recording.append(session_id)
+            else:
+                self.build_channel_stats(session_id)
+        return recording
+
+    def _get_channel_summary(self, channel, sessions=None):
+        recording = self._ensure_channel_stats(sessions)
+        summary = self._channel_stats.get_channel_summary(channel, sessions)
+        if len(recording) > 0:
+            channel_rows = self._query_channel_stats(recording, [channel])[0]
+            summary.add(*channel_rows[0][1:])
+        return summary
+
+    def _get_location_summary(self, sessions=None):
+        recording = self._ensure_channel_stats(sessions)
+        summary = self._channel_stats.get_location_summary(sessions)
+        if len(recording) > 0:
+            location_row = self._query_channel_stats(recording, [], True)[1]
+            summary.add(*location_row)
+        return summary
 
-        c.execute(base_sql, sessions)
-        res = c.fetchone()
+    def get_location_center(self, sessions=None):
+        """
+        Gets the average location of the valid GPS fixes in the specified sessions
+        :param sessions the sessions to include, or None for all sessions
+        :type sessions list
+        :returns tuple of (latitude, longitude)
+        """
+        if not (self.channel_exists('Latitude') and self.channel_exists('Longitude')):
+            return (0, 0)
+
+        return self._get_location_summary(sessions).center
 
-        lat_average = None
-        lon_average = None
-        if res:
-            lat_average = res[0]
-            lon_average = res[1]
-        return (lat_average, lon_average)
+    def get_location_bounds(self, sessions=None):
+        """
+        Gets the bounding box of the valid GPS fixes in the specified sessions
+        :param sessions the sessions to include, or None for all sessions
+        :type sessions list
+        :returns tuple of ((min latitude, min longitude), (max latitude, max longitude)), or None if there are no fixes
+        """
+        if not (self.channel_exists('Latitude') and self.channel_exists('Longitude')):
+            return None
+
+        return self._get_location_summary(sessions).bounds
 
     def _session_select_clause(self, sessions=None):
         sql = ''
@@ -916,18 +1739,7 @@ class DataStore(object):
         return sql
 
     def get_channel_average(self, channel, sessions=None):
-        c = self._conn.cursor()
-        params = []
-
-        if sessions is not None:
-            params = params + sessions
-
-        base_sql = "SELECT AVG({}) from datapoint ".format(
-            _scrub_sql_value(channel)) + self._session_select_clause(sessions)
-        c.execute(base_sql, params)
-        res = c.fetchone()
-        average = None if res == None else res[0]
-        return average
+        return self._get_channel_summary(channel, sessions).average
 
     def _extra_channels(self, extra_channels=None):
         sql = ''
@@ -937,33 +1749,42 @@ class DataStore(object):
         return sql
 
     def _get_channel_aggregate(self, aggregate, channel, sessions=None, extra_channels=None, exclude_zero=True):
-        c = self._conn.cursor()
-        params = []
-
-        if sessions is not None:
-            params = params + sessions
-
         if not self.channel_exists(channel):
             raise InvalidChannelException()
 
-        base_sql = "SELECT {}({}) {} from datapoint {} {};".format(aggregate, _scrub_sql_value(channel),
-                                                                   self._extra_channels(
-                                                                       extra_channels),
-                                                                   self._session_select_clause(
-                                                                       sessions),
-                                                                   '{} {} > 0'.format('AND' if sessions else 'WHERE',
-                                                                                      _scrub_sql_value(channel))
-                                                                   if exclude_zero else '')
+        summary = self._get_channel_summary(channel, sessions)
+        if aggregate == 'MIN':
+            value = summary.positive_min if exclude_zero else summary.min_value
+        else:
+            value = summary.positive_max if exclude_zero else summary.max_value
+
+        if not extra_channels:
+            return value
 
+        # the statistics only hold the value; look up the first sample that has it
+        # to fetch the extra channels
+        if value is None:
+            return (None,) * (len(extra_channels) + 1)
+
+        params = list(sessions) if sessions else []
+        params.append(value)
+        base_sql = "SELECT {} {} from datapoint {} {} {} = ? ORDER BY datapoint.sample_id LIMIT 1;".format(
+            _scrub_sql_value(channel),
+            self._extra_channels(extra_channels),
+            self._session_select_clause(sessions),
+            'AND' if sessions else 'WHERE',
+            _scrub_sql_value(channel))
+
+        c = self._conn.cursor()
         c.execute(base_sql, params)
-        res = c.fetchone()
-        return None if res == None else res if extra_channels else res[0]
+        return c.fetchone()
 
     def get_channel_max(self, channel, sessions=None, extra_channels=None):
         return self._get_channel_aggregate('MAX', channel, sessions=sessions, extra_channels=extra_channels)
 
     def get_channel_min(self, channel, sessions=None, extra_channels=None, exclude_zero=True):
-        return self._get_channel_aggregate('MIN', channel, sessions=sessions, extra_channels=extra_channels)
+        return self._get_channel_aggregate('MIN', channel, sessions=sessions, extra_channels=extra_channels,
+                                           exclude_zero=exclude_zero)
 
     def set_channel_smoothing(self, channel, smoothing):
         """
@@ -1023,9 +1844,89 @@ class DataStore(object):
         self._handle_data(dl, channels, session_id, warnings, progress_cb)
 
         self._populate_channel_list()
+        self.build_channel_stats(session_id)
         return session_id
 
-    def query(self, sessions=[], channels=[], data_filter=None, distinct_records=False):
+    def query(self, sessions=[], channels=[], data_filter=None, distinct_records=False, sample_range=None):
+        """
+        Queries channel data for the specified sessions.
+        :param sessions list of session ids to query
+        :type sessions list
+        :param channels list of channel names, or an empty list for all channels
+        :type channels list
+        :param data_filter optional filter for the returned samples
+        :type data_filter Filter
+        :param distinct_records True to return only distinct records
+        :type distinct_records bool
+        :param sample_range optional (first, last) inclusive range of sample ids to read,
+        e.g. from get_lap_sample_range(). Only the rows in this range are read.
+        :type sample_range tuple
+        :return DataSet
+        """
+        # make sure that the sessions list exists
+        if type(sessions) != list or len(sessions) == 0:
+            raise DatastoreException(
+                "Must provide a list of sessions to query!")
+
+        if data_filter is not None and not 'Filter' in type(data_filter).__name__:
+            raise TypeError("data_filter must be of class Filter")
+
+        # the columnar store serves whole channel reads; filters and sample ranges use the indexed rows
+        if data_filter is None and sample_range is None and self._columnar and \
+                all(self._column_store.has_session(s) for s in sessions):
+            if len(channels) == 0 or '*' in channels:
+                channels = [x.name for x in self._channels]
+            return self._query_columns(sessions, channels, distinct_records)
+
+        return self._query_rows(sessions, channels, data_filter, distinct_records, sample_range)
+
+    def get_lap_sample_range(self, session_id, lap):
+        """
+        Gets the range of sample ids for a lap, for use with query(sample_range=...)
+        :param session_id the session id
+        :type session_id int
+        :param lap the lap
+        :type lap int
+        :return tuple of (first sample id, last sample id), or None if the session has no such lap
+        """
+        self._ensure_lap_index([session_id])
+        return self._lap_index.get_sample_range(session_id, lap)
+
+    def _query_columns(self, sessions, channels, distinct_records=False):
+        result_channels = ['session_id'] + channels
+        result = dict((c, []) for c in result_channels)
+        for session_id in sessions:
+            columns = self._column_store.read_channels(session_id, channels)
+            count = len(columns[channels[0]]) if len(channels) > 0 else 0
+            result['session_id'].extend([session_id] * count)
+            for c in channels:
+                result[c].extend(columns[c])
+
+        if distinct_records:
+            seen = set()
+            rows = []
+            for row in zip(*[result[c] for c in result_channels]):
+                if row not in seen:
+                    seen.add(row)
+                    rows.append(row)
+            columns = zip(*rows) if len(rows) > 0 else [[] for c in result_channels]
+            result = dict((c, list(values)) for c, values in zip(result_channels, columns))
+
+        return ColumnarDataSet(result_channels, result, self._get_smoothing_map(channels), self._smoothing_mode)
+
+    def _get_smoothing_map(self, channels):
+        smoothing_map = {}
+        # Put together the smoothing map
+        for ch in channels:
+            sr = self.get_channel_smoothing(ch)
+            smoothing_map[ch] = sr
+
+        # add the session_id to the smoothing map with a smoothing rate
+        # of 0
+        smoothing_map['session_id'] = 0
+        return smoothing_map
+
+    def _query_rows(self, sessions, channels=[], data_filter=None, distinct_records=False, sample_range=None):
         # Build our select statement
         sel_st = 'SELECT '
 
@@ -1036,11 +1937,6 @@ class DataStore(object):
         joins = []
         params = []
 
-        # make sure that the sessions list exists
-        if type(sessions) != list or len(sessions) == 0:
-            raise DatastoreException(
-                "Must provide a list of sessions to query!")
-
         # If there are no channels, or if a '*' is passed, select all
         # of the channels
         if len(channels) == 0 or '*' in channels:
@@ -1068,11 +1964,9 @@ class DataStore(object):
 
         if data_filter is not None:
             # Add our filter
-            sel_st += 'WHERE '
-            if not 'Filter' in type(data_filter).__name__:
-                raise TypeError("data_filter must be of class Filter")
-
+            sel_st += 'WHERE ('
             sel_st += str(data_filter)
+            sel_st += ') '
             params = params + data_filter.params
 
         # create the session filter
@@ -1081,31 +1975,27 @@ class DataStore(object):
         else:
             ses_st = "AND "
 
+        # the sample id range lets SQLite seek directly to the rows
+        if sample_range is not None:
+            ses_st += 'sample.id BETWEEN ? AND ? AND '
+            params.extend(sample_range)
+
         ses_filters = []
         for s in sessions:
             ses_filters.append('sample.session_id = ?')
             params.append(s)
 
-        ses_st += 'OR '.join(ses_filters)
+        # grouped, so the OR binds within the session list rather than with the conditions before it
+        ses_st += '(' + ' OR '.join(ses_filters) + ')'
 
         # Now add the session filter to the select statement
         sel_st += ses_st
 
         Logger.debug('[datastore] Query execute: {}'.format(sel_st))
-        c = self._conn.cursor()
+        c = self._read_conn.cursor()
         c.execute(sel_st, params)
 
-        smoothing_map = {}
-        # Put together the smoothing map
-        for ch in channels:
-            sr = self.get_channel_smoothing(ch)
-            smoothing_map[ch] = sr
-
-        # add the session_id to the smoothing map with a smoothing rate
-        # of 0
-        smoothing_map['session_id'] = 0
-
-        return DataSet(c, smoothing_map)
+        return DataSet(c, self._get_smoothing_map(channels), self._smoothing_mode)
 
     def get_session_by_id(self, session_id, sessions=None):
         sessions = self.get_sessions() if not sessions else sessions
@@ -1129,15 +2019,8 @@ class DataStore(object):
         :returns True if the session has lap information
         :type Boolean
         '''
-        if not (self.channel_exists('CurrentLap') and self.channel_exists('LapCount')):
-            return False
-
-        c = self._conn.cursor()
-        for row in c.execute('''SELECT s.session_id, d.LapCount, d.CurrentLap FROM sample s, 
-                             datapoint d WHERE s.session_id = ? AND d.sample_id = s.id ORDER BY d.LapCount DESC LIMIT 1;''',
-                             (session_id,)):
-            return row[1] is not None and row[2] is not None
-        return False
+        self._ensure_lap_index([session_id])
+        return self._lap_index.has_laps(session_id)
 
     def get_laps(self, session_id):
         '''
@@ -1147,52 +2030,81 @@ class DataStore(object):
         :returns list of Lap objects
         :type list 
         '''
+        self._ensure_lap_index([session_id])
+        return self._get_laps_dict(session_id, self._lap_index.get_laps(session_id))
 
+    def get_all_laps(self):
+        '''
+        Fetches lap information for every session with a single read of the lap index
+        :returns dict of session id => OrderedDict of lap => Lap
+        :type dict
+        '''
+        self._ensure_lap_index(self._lap_index.get_unindexed_sessions())
+        rows_by_session = {}
+        for row in self._lap_index.get_laps():
+            rows_by_session.setdefault(row[0], []).append(row)
+
+        all_laps = {}
+        for session in self.get_sessions():
+            session_id = session.session_id
+            all_laps[session_id] = self._get_laps_dict(session_id, rows_by_session.get(session_id, []))
+        return all_laps
+
+    def _get_laps_dict(self, session_id, rows):
         # if there is no lap information then just return a default single lap.
-        if not self.session_has_laps(session_id):
-            laps_dict = OrderedDict()
+        laps_dict = OrderedDict()
+        if len(rows) == 0:
             laps_dict[1] = Lap(session_id=session_id, lap=1, lap_time=None)
             return laps_dict
 
-        laps = []
-        c = self._conn.cursor()
-        for row in c.execute('''SELECT DISTINCT sample.session_id AS session_id, 
-                                datapoint.CurrentLap AS CurrentLap,
-                                LapTime
-                                FROM sample
-                                JOIN datapoint ON datapoint.sample_id=sample.id
-                                AND sample.session_id = ?
-                                GROUP BY LapCount, session_id
-                                ORDER BY datapoint.LapCount ASC;''',
-                             (session_id,)):
-            lap = row[1]
-            lap = 1 if lap is None else lap
-            laps.append(Lap(session_id=row[0], lap=lap - 1, lap_time=row[2]))
-
-        # Figure out if there are samples beyond the last lap
-        extra_lap_query = '''SELECT COUNT(*) FROM sample JOIN datapoint ON datapoint.sample_id=sample.id
-                             AND sample.session_id = ? WHERE datapoint.CurrentLap > ? LIMIT 1'''
-
-        # If there are samples beyond the last actual timed lap (crossed start/finish), add that lap to the end
-        # so users can view that data if needed
-        if len(laps) > 0:
-            c = self._conn.cursor()
-
-            for row in c.execute(extra_lap_query, [session_id, laps[-1].lap]):
-                laps.append(
-                    Lap(session_id=session_id, lap=(laps[-1].lap + 1), lap_time=None))
-                break
-
-        # Filter so we only include valid laps
-        laps = [lap for lap in laps if lap.lap >= 0]
-
         # Transform into an ordered dict so lap IDs are preserved as keys.
-        laps_dict = OrderedDict()
-        for lap in laps:
-            laps_dict[lap.lap] = lap
-
+        for row in rows:
+            laps_dict[row[1]] = Lap(session_id=row[0], lap=row[1], lap_time=row[2],
+                                    first_sample_id=row[3], last_sample_id=row[4],
+                                    start_interval=row[5], end_interval=row[6], distance=row[7])
         return laps_dict
 
+    def _ensure_lap_index(self, session_ids):
+        # sessions stored before the lap index existed, or whose import or recording was cut
+        # short, are indexed the first time they are read, so later reads come from the index
+        for session_id in session_ids:
+            if session_id not in self._recording_sessions and not self._lap_index.is_indexed(session_id):
+                self.build_lap_index(session_id)
+
+    def _add_lap_samples(self, session_id, indexer):
+        if not self.channel_exists('CurrentLap'):
+            return
+        columns = ','.join(['datapoint.{}'.format(_scrub_sql_value(c)) if self.channel_exists(c) else 'NULL'
+                            for c in LAP_INDEX_CHANNELS])
+        c = self._read_conn.cursor()
+        c.execute('''SELECT sample.id, {} FROM sample JOIN datapoint ON datapoint.sample_id=sample.id
+                     WHERE sample.session_id = ? ORDER BY sample.id ASC'''.format(columns), (session_id,))
+        while True:
+            rows = c.fetchmany(DataStore.EXPORT_BATCH_SIZE)
+            if len(rows) == 0:
+                break
+            for row in rows:
+                indexer.add(*row)
+
+    def build_lap_index(self, session_id):
+        '''
+        (Re)builds the lap index for a session from its datapoints. Called for sessions that
+        were not indexed as they were imported or recorded.
+        :param session_id the session id
+        :type session_id int
+        '''
+        lap_index = self._lap_index
+        try:
+            lap_index.delete_session(session_id)
+            indexer = lap_index.create_indexer(session_id)
+            self._add_lap_samples(session_id, indexer)
+            indexer.flush()
+            lap_index.set_indexed(session_id)
+            self._conn.commit()
+        except:  # rollback under any exception, then re-raise exception
+            self._conn.rollback()
+            raise
+
     def update_session(self, session):
         self._conn.execute("""UPDATE session SET name=?, notes=?, date=? WHERE id=?;""", (
             session.name, session.notes, unix_time(datetime.datetime.now()), session.session_id,))
@@ -1206,15 +2118,19 @@ class DataStore(object):
         return None if res is None else res[0]
 
     @timing
-    def export_session(self, session_id, export_file, progress_callback=None):
+    def export_session(self, session_id, export_file, progress_callback=None, progress_stats_callback=None):
         """
-        Exports the specified session to a CSV file
+        Exports the specified session to a CSV file. Records are streamed from the
+        database in batches of EXPORT_BATCH_SIZE so memory use does not grow with the
+        length of the session.
         :param session_id the session to export
         :type session_id int
-        :param export_file_name the file name to export
-        :type export_file_name string
+        :param export_file the file to write to
+        :type export_file file
         :param progress_callback callback function for progress. Return true from this function to cancel export
         :type progress_callback function
+        :param progress_stats_callback optional callback receiving (rows exported, bytes written) after each batch
+        :type progress_stats_callback function
         :return the number of rows exported
         """
 
@@ -1226,33 +2142,15 @@ class DataStore(object):
         # channel_list
         channels = self.get_channel_list(session_id)
 
-        header = ''
-        for channel in channels:
-            header += '"{}"|"{}"|{}|{}|{},'.format(channel.name,
-                                                   channel.units,
-                                                   channel.min,
-                                                   channel.max,
-                                                   channel.sample_rate)
-        export_file.write(header[:-1] + '\n')
+        header = ','.join(['"{}"|"{}"|{}|{}|{}'.format(channel.name,
+                                                      channel.units,
+                                                      channel.min,
+                                                      channel.max,
+                                                      channel.sample_rate) for channel in channels])
+        export_file.write(header + '\n')
+        bytes_written = len(header) + 1
 
-        channel_names = []
-        channel_intervals = []
-        system_channel_indexes = []
-
-        for c in channels:
-            name = c.name
-            channel_names.append(name)
-            interval = DataStore.MAX_SAMPLE_RATE / c.sample_rate
-            channel_intervals.append(interval)
-            system_channel_indexes.append(
-                True if name in DataStore.SYSTEM_CHANNELS else False)
-
-        export_count = self._get_session_record_count(session_id)
-
-        dataset = self.query([session_id], channel_names)
-        # dataset = self.query(sessions=[session_id], channels=channel_names)
-        records = dataset.fetch_records()
-        sync_point = None
+        channel_names = [c.name for c in channels]
 
         try:
             datalog_interval_index = channel_names.index('Interval')
@@ -1265,56 +2163,66 @@ class DataStore(object):
             raise DatastoreException(
                 'DataStore: Cannot export: No channels to output')
 
+        export_count = max(1, self._get_session_record_count(session_id))
+
+        # Always read from the row store; the export needs every channel and
+        # reading it through the cursor keeps the working set to one batch
+        dataset = self._query_rows([session_id], channel_names)
+        format_row = _create_export_row_formatter(channels)
+
+        # Note 1 + offset; record contains session_id as first column,
+        # the rest are individual channels
+        interval_index = 1 + datalog_interval_index
+        sync_point = None
         row_index = 0
-        channel_count = len(channels)
-
-        for record in records:
-            # Note 1 + offset; record contains session_id as first column,
-            # the rest are individual channels
-            sampled = False
-            while not sampled:
-                if sync_point is None:
-                    # the first interval is our synchronization point
-                    # for determining when to output samples
-                    # The first sample outputs all values by default
-                    interval_record = record[1 + datalog_interval_index]
-                    if interval_record is None:
-                        Logger.warning('DataStore: Export: invalid row detected, skipping: {}'.format(record))
-                        break
-                    sync_point = long(interval_record)
-
-                row = ''
-                current_interval = long(record[1 + datalog_interval_index])
-
-                for index in range(channel_count):
-                    # first column is session id, so skip it
-                    if system_channel_indexes[index] == True:
-                        # our system channels are in long integer format
-                        value = long(record[1 + index])
+        last_progress = None
+
+        while True:
+            records = dataset.fetch_raw_records(DataStore.EXPORT_BATCH_SIZE)
+            if len(records) == 0:
+                break
+
+            lines = []
+            for record in records:
+                sampled = False
+                while not sampled:
+                    if sync_point is None:
+                        # the first interval is our synchronization point
+                        # for determining when to output samples
+                        # The first sample outputs all values by default
+                        interval_record = record[interval_index]
+                        if interval_record is None:
+                            Logger.warning('DataStore: Export: invalid row detected, skipping: {}'.format(record))
+                            break
+                        sync_point = long(interval_record)
+
+                    current_interval = long(record[interval_index])
+                    sampled, line = format_row(record, current_interval - sync_point)
+                    if sampled:
+                        lines.append(line)
                     else:
-                        channel_interval = channel_intervals[index]
-                        if (current_interval - sync_point) % channel_interval == 0:
-                            value = record[1 + index]
-                            if value is None:
-                                value = ''
-                            sampled = True
-                        else:
-                            value = ''
-                    row += str(value) + ','
-                if sampled:
-                    export_file.write(row[:-1] + '\n')
-                if not sampled:
-                    # The data log may have inconsistent data; if so
-                    # the interval will change. If we detect this then we need
-                    # to re-synchronize
-                    Logger.warning(
-                        'DataStore: Export: Inconsistent interval detected at interval {}; re-syncing'.format(current_interval))
-                    sync_point = None
-            row_index += 1
-            progress = row_index * 100 / export_count
-            if progress % 5 == 0:
-                cancel = _do_progress_cb(progress)
-                if cancel == True:
+                        # The data log may have inconsistent data; if so
+                        # the interval will change. If we detect this then we need
+                        # to re-synchronize
+                        Logger.warning(
+                            'DataStore: Export: Inconsistent interval detected at interval {}; re-syncing'.format(current_interval))
+                        sync_point = None
+
+            row_index += len(records)
+            if len(lines) > 0:
+                lines.append('')
+                chunk = '\n'.join(lines)
+                export_file.write(chunk)
+                bytes_written += len(chunk)
+
+            if progress_stats_callback is not None:
+                progress_stats_callback(row_index, bytes_written)
+
+            progress = min(100, row_index * 100 / export_count)
+            if progress != last_progress:
+                last_progress = progress
+                if _do_progress_cb(progress) == True:
                     break
+
         _do_progress_cb(100)
         return row_index
@@ -0,0 +1,160 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+
+__all__ = ('LapIndex', 'LapIndexer', 'LAP_INDEX_CHANNELS')
+
+# Channels the lap index is built from, in the order LapIndexer.add expects them
+LAP_INDEX_CHANNELS = ['CurrentLap', 'LapCount', 'LapTime', 'Interval', 'Distance']
+
+
+class LapIndexer(object):
+    """
+    Tracks lap boundaries for a session as samples are added in sample id order,
+    and writes the laps that changed to the LapIndex on flush.
+
+    A lap is the set of samples with the same CurrentLap; its lap time is the
+    LapTime reported once LapCount reaches that lap.
+    """
+
+    def __init__(self, lap_index, session_id):
+        self._lap_index = lap_index
+        self._session_id = session_id
+        # lap => [first sample id, last sample id, start interval, end interval, start distance, end distance]
+        self._laps = {}
+        self._lap_times = {}
+        self._dirty = set()
+
+    def add(self, sample_id, current_lap, lap_count, lap_time, interval, distance):
+        if current_lap is not None and current_lap >= 1:
+            lap = int(current_lap)
+            info = self._laps.get(lap)
+            if info is None:
+                self._laps[lap] = [sample_id, sample_id, interval, interval, distance, distance]
+            else:
+                info[1] = sample_id
+                if interval is not None:
+                    info[3] = interval
+                    if info[2] is None:
+                        info[2] = interval
+                if distance is not None:
+                    info[5] = distance
+                    if info[4] is None:
+                        info[4] = distance
+            self._dirty.add(lap)
+
+        if lap_count is not None and lap_count >= 1 and lap_time is not None:
+            lap = int(lap_count)
+            if self._lap_times.get(lap) != lap_time:
+                self._lap_times[lap] = lap_time
+                self._dirty.add(lap)
+
+    def flush(self):
+        rows = []
+        for lap in sorted(self._dirty):
+            info = self._laps.get(lap)
+            if info is None:
+                # lap time reported for a lap we have no samples for; keep it
+                # pending until the lap shows up
+                continue
+            first_sample_id, last_sample_id, start_interval, end_interval, start_distance, end_distance = info
+            distance = None if start_distance is None or end_distance is None else end_distance - start_distance
+            rows.append((lap, self._lap_times.get(lap), first_sample_id, last_sample_id,
+                         start_interval, end_interval, distance))
+            self._dirty.discard(lap)
+        self._lap_index.write_laps(self._session_id, rows)
+
+
+class LapIndex(object):
+    """
+    Persistent per-session lap index, so lap listings are read from a small
+    indexed table instead of scanning the session's datapoints.
+    """
+
+    def __init__(self, connection, read_connection=None):
+        self._conn = connection
+        self._read_conn = connection if read_connection is None else read_connection
+
+    def create_indexer(self, session_id):
+        """
+        Create a LapIndexer for adding samples to the specified session
+        :param session_id the session to index
+        :type session_id int
+        :return LapIndexer
+        """
+        return LapIndexer(self, session_id)
+
+    def write_laps(self, session_id, rows):
+        """
+        Writes or replaces lap rows for a session
+        :param rows list of (lap, lap_time, first_sample_id, last_sample_id, start_interval, end_interval, distance)
+        :type rows list
+        """
+        self._conn.executemany("""INSERT OR REPLACE INTO session_lap
+            (session_id, lap, lap_time, first_sample_id, last_sample_id, start_interval, end_interval, distance)
+            VALUES (?,?,?,?,?,?,?,?)""", [(session_id,) + row for row in rows])
+
+    def is_indexed(self, session_id):
+        c = self._read_conn.cursor()
+        c.execute('SELECT laps_indexed FROM session WHERE id = ?', (session_id,))
+        res = c.fetchone()
+        return res is not None and res[0] == 1
+
+    def set_indexed(self, session_id, indexed=True):
+        self._conn.execute('UPDATE session SET laps_indexed = ? WHERE id = ?', (1 if indexed else 0, session_id))
+
+    def get_unindexed_sessions(self):
+        c = self._read_conn.cursor()
+        return [row[0] for row in c.execute('SELECT id FROM session WHERE laps_indexed = 0')]
+
+    def has_laps(self, session_id):
+        c = self._read_conn.cursor()
+        c.execute('SELECT 1 FROM session_lap WHERE session_id = ? LIMIT 1', (session_id,))
+        return c.fetchone() is not None
+
+    def get_laps(self, session_id=None):
+        """
+        Reads the indexed laps, ordered by session and lap
+        :param session_id the session to read, or None for all sessions
+        :type session_id int
+        :return list of (session_id, lap, lap_time, first_sample_id, last_sample_id, start_interval, end_interval, distance)
+        """
+        sql = """SELECT session_id, lap, lap_time, first_sample_id, last_sample_id, start_interval, end_interval, distance
+            FROM session_lap"""
+        params = []
+        if session_id is not None:
+            sql += ' WHERE session_id = ?'
+            params.append(session_id)
+        sql += ' ORDER BY session_id, lap'
+        return self._read_conn.execute(sql, params).fetchall()
+
+    def get_sample_range(self, session_id, lap):
+        """
+        Gets the range of sample ids covered by a lap
+        :return tuple of (first sample id, last sample id), or None if the lap is not indexed
+        """
+        c = self._read_conn.cursor()
+        c.execute('SELECT first_sample_id, last_sample_id FROM session_lap WHERE session_id = ? AND lap = ?',
+                  (session_id, lap))
+        res = c.fetchone()
+        return None if res is None else (res[0], res[1])
+
+    def delete_session(self, session_id):
+        self._conn.execute('DELETE FROM session_lap WHERE session_id = ?', (session_id,))
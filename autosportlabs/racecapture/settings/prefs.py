@@ -173,7 +173,12 @@ class UserPrefs(EventDispatcher):
         self.config.setdefault('preferences', 'firmware_dir', default_user_files_dir)
         self.config.setdefault('preferences', 'import_datalog_dir', default_user_files_dir)
         self.config.setdefault('preferences', 'send_telemetry', '0')
+        self.config.setdefault('preferences', 'telemetry_buffer_mb', '8')
+        self.config.setdefault('preferences', 'telemetry_drop_policy', 'oldest')
         self.config.setdefault('preferences', 'record_session', '1')
+        self.config.setdefault('preferences', 'columnar_datastore', '0')
+        self.config.setdefault('preferences', 'datastore_profile', 'Default')
+        self.config.setdefault('preferences', 'command_window', '1')
         self.config.setdefault('preferences', 'global_help', True)
 
         # Connection type for mobile
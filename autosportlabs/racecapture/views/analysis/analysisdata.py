@@ -70,21 +70,33 @@ class CachingAnalysisDatastore(DataStore):
         Logger.info('CachingAnalysisDatastore: querying {} {}'.format(source_ref, channels))
         lap = source_ref.lap
         session = source_ref.session
-        f = Filter().eq('CurrentLap', lap) if self.session_has_laps(session) else None
-        dataset = self.query(sessions=[session], channels=channels, data_filter=f)
-        records = dataset.fetch_records()
-
-        for index in range(len(channels)):
-            channel = channels[index]
-            values = []
-            for record in records:
-                # pluck out just the channel value
-                values.append(record[1 + index])
+        f, sample_range = self._get_lap_selection(session, lap, None)
+        dataset = self.query(sessions=[session], channels=channels, data_filter=f, sample_range=sample_range)
+        arrays = dataset.fetch_arrays()
 
+        for channel in channels:
+            values = arrays[channel]
             channel_meta = self.get_channel(channel)
             channel_data = ChannelData(values=values, channel=channel, min=channel_meta.min, max=channel_meta.max, source=source_ref)
             combined_channel_data[channel] = channel_data
 
+    def _get_lap_selection(self, session, lap, data_filter):
+        '''
+        Determine how to select a lap's data: by the lap's sample id range when the
+        lap is indexed, otherwise by filtering on CurrentLap.
+        :return tuple of (filter, sample range)
+        '''
+        if not self.session_has_laps(session):
+            return data_filter, None
+
+        sample_range = self.get_lap_sample_range(session, lap)
+        if sample_range is not None:
+            return data_filter, sample_range
+
+        if data_filter is None:
+            return Filter().eq('CurrentLap', lap), None
+        return data_filter.eq('CurrentLap', lap), None
+
     def _get_channel_data(self, source_ref, channels, callback):
         '''
         Retrieve cached or query channel data as appropriate.
@@ -119,11 +131,7 @@ class CachingAnalysisDatastore(DataStore):
     @timing
     def _refresh_session_data(self):
         self._session_info_cache.clear()
-        sessions = self.get_sessions()
-        for session in sessions:
-            session_id = session.session_id
-            laps_dict = self.get_laps(session_id)
-            self._session_info_cache[session_id] = laps_dict
+        self._session_info_cache.update(self.get_all_laps())
 
     def get_cached_lap_info(self, source_ref):
         """
@@ -188,11 +196,11 @@ class CachingAnalysisDatastore(DataStore):
         session = source_ref.session
         lap = source_ref.lap
         f = Filter().neq('Latitude', 0).and_().neq('Longitude', 0)
-        if self.session_has_laps(session):
-            f.eq("CurrentLap", lap)
+        f, sample_range = self._get_lap_selection(session, lap, f)
         dataset = self.query(sessions=[session],
                                         channels=["Latitude", "Longitude"],
-                                        data_filter=f)
+                                        data_filter=f,
+                                        sample_range=sample_range)
         records = dataset.fetch_records()
         cache = []
         for r in records:
@@ -30,6 +30,7 @@ from  kivy.metrics import MetricsBase, sp
 from kivy.logger import Logger
 import bisect
 import copy
+import math
 
 from autosportlabs.racecapture.views.util.alertview import alertPopup
 from autosportlabs.racecapture.views.analysis.analysiswidget import ChannelAnalysisWidget
@@ -359,7 +360,7 @@ class LineChart(ChannelAnalysisWidget):
                 channel_data_values = query_data[channel]
                 channel_data = channel_data_values.values
                 # If we queried a channel that has no sample results, skip adding the plot
-                if len(channel_data) == 0 or channel_data[0] is None:
+                if len(channel_data) == 0 or math.isnan(channel_data[0]):
                     continue
 
                 key = channel_data_values.channel + str(channel_data_values.source)
@@ -0,0 +1,256 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+import mmap
+import os
+import struct
+from threading import Lock
+from kivy.logger import Logger
+
+__all__ = ('FrameQueue', 'DROP_OLDEST', 'DROP_NEWEST')
+
+# when full, make room by discarding the oldest frames
+DROP_OLDEST = 'oldest'
+# when full, discard new frames until there is room
+DROP_NEWEST = 'newest'
+
+_MAGIC = 'RCFQ'
+_VERSION = 2
+# magic, version, ring capacity, preamble capacity, head offset, tail offset, frame count, key, preamble length
+_HEADER = struct.Struct('<4sIIIQQI64sI')
+_HEADER_SIZE = 128
+KEY_SIZE = 64
+
+_LENGTH = struct.Struct('<I')
+
+
+class FrameQueue(object):
+    """
+    Bounded queue of encoded telemetry frames in a memory-mapped file.
+
+    Holds frames recorded while the uplink is down, so they can be sent once it reconnects.
+    Frames are stored as a length prefix followed by the frame, in a ring wrapping at the end
+    of the file. The head and tail offsets are kept in the file's header, so queued frames
+    survive a restart of the app.
+
+    The queue belongs to a key, the device the frames were recorded for, and every frame in it
+    is described by a single preamble, the channel list; both are kept outside the ring so
+    the drop policy never discards them. Changing either discards the queued frames.
+    """
+    DEFAULT_MAX_SIZE = 8 * 1024 * 1024
+    DEFAULT_PREAMBLE_SIZE = 64 * 1024
+
+    def __init__(self, path, max_size=DEFAULT_MAX_SIZE, drop_policy=DROP_OLDEST, preamble_size=DEFAULT_PREAMBLE_SIZE):
+        """
+        :param path the file to keep the queue in
+        :type path string
+        :param max_size the size of the file, in bytes
+        :type max_size int
+        :param drop_policy DROP_OLDEST or DROP_NEWEST, applied when the queue is full
+        :type drop_policy string
+        :param preamble_size the space reserved for the preamble, in bytes
+        :type preamble_size int
+        """
+        if drop_policy not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError('Unknown drop policy {}'.format(drop_policy))
+        capacity = max_size - _HEADER_SIZE - preamble_size
+        if capacity <= _LENGTH.size:
+            raise ValueError('max_size of {} is too small'.format(max_size))
+        self.path = path
+        self.drop_policy = drop_policy
+        self.capacity = capacity
+        self.preamble_capacity = preamble_size
+        self._data_offset = _HEADER_SIZE + preamble_size
+        # frames dropped by the drop policy since the queue was opened
+        self.dropped = 0
+        self._lock = Lock()
+
+        self._file = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+        self._file.truncate(max_size)
+        self._mm = mmap.mmap(self._file.fileno(), max_size)
+        self._load_header()
+
+    def _load_header(self):
+        magic, version, capacity, preamble_capacity, head, tail, count, key, preamble_length = \
+            _HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC or version != _VERSION or capacity != self.capacity or \
+                preamble_capacity != self.preamble_capacity or head > tail or tail - head > capacity or \
+                preamble_length > preamble_capacity:
+            if magic == _MAGIC:
+                Logger.warning('FrameQueue: discarding incompatible queue in {}'.format(self.path))
+            head = tail = count = preamble_length = 0
+            key = ''
+        self._head = head
+        self._tail = tail
+        self._count = count
+        self._key = key.rstrip('\0')
+        self._preamble = self._mm[_HEADER_SIZE:_HEADER_SIZE + preamble_length]
+        self._save_header()
+
+    def _save_header(self):
+        _HEADER.pack_into(self._mm, 0, _MAGIC, _VERSION, self.capacity, self.preamble_capacity,
+                          self._head, self._tail, self._count, self._key, len(self._preamble))
+
+    def __len__(self):
+        """
+        :return the number of queued frames
+        """
+        return self._count
+
+    @property
+    def size(self):
+        """
+        :return the number of bytes used by queued frames
+        """
+        return self._tail - self._head
+
+    @property
+    def key(self):
+        return self._key
+
+    @property
+    def preamble(self):
+        """
+        :return the frame to send ahead of the queued frames, or None if there is none
+        """
+        return self._preamble or None
+
+    def set_key(self, key):
+        """
+        Set who the frames are recorded for, discarding frames recorded for anyone else
+        :param key the key, such as the device id
+        :type key string
+        """
+        key = str(key)
+        if len(key) > KEY_SIZE:
+            raise ValueError('key is longer than {} bytes'.format(KEY_SIZE))
+        with self._lock:
+            if key == self._key:
+                return
+            if self._count > 0:
+                Logger.info('FrameQueue: discarding {} frames recorded for {}'.format(self._count, self._key))
+            self._reset()
+            self._key = key
+            self._save_header()
+
+    def set_preamble(self, preamble):
+        """
+        Set the frame that describes the queued frames, discarding frames queued under a different one
+        :param preamble the frame to send ahead of the queued frames
+        :type preamble string
+        :return True if the preamble was set, False if it is too large
+        """
+        if len(preamble) > self.preamble_capacity:
+            Logger.error('FrameQueue: preamble of {} bytes is too large'.format(len(preamble)))
+            return False
+        with self._lock:
+            if preamble == self._preamble:
+                return True
+            if self._count > 0:
+                Logger.info('FrameQueue: discarding {} frames recorded with a different preamble'.format(self._count))
+            self._head = self._tail = self._count = 0
+            self._mm[_HEADER_SIZE:_HEADER_SIZE + len(preamble)] = preamble
+            self._preamble = preamble
+            self._save_header()
+        return True
+
+    def put(self, frame):
+        """
+        Add a frame, applying the drop policy if the queue is full
+        :param frame the encoded frame
+        :type frame string
+        :return True if the frame was queued
+        """
+        record_size = _LENGTH.size + len(frame)
+        if record_size > self.capacity:
+            self.dropped += 1
+            return False
+        with self._lock:
+            while self.capacity - (self._tail - self._head) < record_size:
+                if self.drop_policy == DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                self._pop()
+                self.dropped += 1
+            self._write(self._tail, _LENGTH.pack(len(frame)))
+            self._write(self._tail + _LENGTH.size, frame)
+            self._tail += record_size
+            self._count += 1
+            self._save_header()
+        return True
+
+    def get(self):
+        """
+        Remove the oldest frame
+        :return the frame, or None if the queue is empty
+        """
+        with self._lock:
+            if self._count == 0:
+                return None
+            frame = self._pop()
+            self._save_header()
+            return frame
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+            self._save_header()
+
+    def close(self):
+        with self._lock:
+            if self._mm is None:
+                return
+            self._mm.flush()
+            self._mm.close()
+            self._mm = None
+            self._file.close()
+
+    def _reset(self):
+        self._head = self._tail = self._count = 0
+        self._preamble = ''
+
+    def _pop(self):
+        length, = _LENGTH.unpack(self._read(self._head, _LENGTH.size))
+        frame = self._read(self._head + _LENGTH.size, length)
+        self._head += _LENGTH.size + length
+        self._count -= 1
+        if self._count == 0:
+            # start over at the front, keeping the offsets small
+            self._head = self._tail = 0
+        return frame
+
+    def _write(self, offset, data):
+        mm = self._mm
+        data_offset = self._data_offset
+        position = offset % self.capacity
+        first = min(len(data), self.capacity - position)
+        mm[data_offset + position:data_offset + position + first] = data[:first]
+        if first < len(data):
+            mm[data_offset:data_offset + len(data) - first] = data[first:]
+
+    def _read(self, offset, length):
+        mm = self._mm
+        data_offset = self._data_offset
+        position = offset % self.capacity
+        first = min(length, self.capacity - position)
+        data = mm[data_offset + position:data_offset + position + first]
+        if first < length:
+            data += mm[data_offset:data_offset + length - first]
+        return data
@@ -22,11 +22,14 @@ from kivy.logger import Logger
 from kivy.properties import ObjectProperty, BooleanProperty, StringProperty
 from kivy.event import EventDispatcher
 from kivy.clock import Clock
-from time import sleep
+from autosportlabs.util.jsoncodec import JsonCodec
+from autosportlabs.comms.ioloop import get_io_loop
+from autosportlabs.telemetry.uplink import SampleEncoder, UplinkMonitor, encode_meta
+from time import sleep, time
 from copy import copy
 import threading
 import asynchat, asyncore
-import json
+import logging
 import socket
 import sys
 import errno
@@ -44,18 +47,29 @@ class TelemetryManager(EventDispatcher):
     RETRY_WAIT_START = 0.1
     RETRY_MULTIPLIER = 10
     RETRY_WAIT_MAX_TIME = 10
+    # interval at which samples are recorded while the uplink is down
+    RECORD_INTERVAL = 1.0
     channels = ObjectProperty(None, allownone=True)
     device_id = StringProperty(None)
     cell_enabled = BooleanProperty(False)
     telemetry_enabled = BooleanProperty(False)
     data_connected = BooleanProperty(False)
 
-    def __init__(self, data_bus, device_id=None, host=None, port=None, **kwargs):
+    def __init__(self, data_bus, device_id=None, host=None, port=None, io_loop=None, frame_queue=None, **kwargs):
         self.host = 'telemetry.podium.live'
         self.port = 8080
         self.connection = None
+        # when set, connections run on this IoLoop instead of their own thread
+        self._io_loop = io_loop
+        # when set, samples are recorded here while the uplink is down, and back-filled on reconnect
+        self._frame_queue = frame_queue
+        self._recorder = None
+        self._recorder_encoder = None
+        self._sample_data = None
+        self._streaming = False
         self._connection_process = None
         self._retry_timer = None
+        self._codec = JsonCodec()
         self._retry_wait = self.RETRY_WAIT_START
         self._retry_count = 0
         self._auth_failed = False
@@ -78,6 +92,9 @@ class TelemetryManager(EventDispatcher):
 
         self._data_bus.addMetaListener(self._on_meta)
         self._data_bus.start_update()
+        if frame_queue is not None:
+            self._recorder_encoder = SampleEncoder(self._codec, full_frame_interval=0)
+            self._data_bus.add_sample_listener(self._on_sample)
 
         if host is not None:
             self.host = host
@@ -98,6 +115,10 @@ class TelemetryManager(EventDispatcher):
         channel_metas_copy = copy(channel_metas)
         self.channels = channel_metas_copy
 
+    def _on_sample(self, sample):
+        # isolate the data from the calling thread by making a copy
+        self._sample_data = copy(sample)
+
     # Event handler for when self.channels changes, don't restart connection b/c
     # the TelemetryConnection object will handle new channels
     def on_channels(self, instance, value):
@@ -106,7 +127,7 @@ class TelemetryManager(EventDispatcher):
             self.start()
 
     def send_api_msg(self, msg):
-        json_msg = json.dumps(msg)
+        json_msg = self._codec.encode(msg)
         self.connection.send_msg(json_msg)
 
     # Event handler for when self.device_id changes, need to restart connection
@@ -117,10 +138,10 @@ class TelemetryManager(EventDispatcher):
         if value == "":
             self.stop()
 
-        if self._connection_process and self._connection_process.is_alive():
+        if self._connection_alive():
             Logger.info("TelemetryManager: connection previously established, restarting")
             self.connection.end()  # Connection will re-start
-            self._connection_process.join(0.1)
+            self._join_connection(0.1)
 
         if self.telemetry_enabled:
             self.start()
@@ -175,10 +196,10 @@ class TelemetryManager(EventDispatcher):
         self._auth_failed = False
 
         if self._should_connect:
-            if self._connection_process and not self._connection_process.is_alive():
+            if self._connection_started() and not self._connection_alive():
                 Logger.info("TelemetryManager: connection process is dead")
                 self._connect()
-            elif not self._connection_process:
+            elif not self._connection_started():
                 if self.device_id and self.channels:
                     Logger.debug("TelemetryManager: starting telemetry thread")
                     self._connect()
@@ -188,19 +209,101 @@ class TelemetryManager(EventDispatcher):
         else:
             Logger.warning('TelemetryManager: self._should_connect is false, not connecting')
 
-    # Creates new TelemetryConnection in separate thread
+    def _connection_started(self):
+        if self._io_loop is not None:
+            return self.connection is not None
+        return self._connection_process is not None
+
+    def _connection_alive(self):
+        if self._io_loop is not None:
+            return self.connection is not None and self.connection.is_active() and self._io_loop.is_running()
+        return self._connection_process is not None and self._connection_process.is_alive()
+
+    def _join_connection(self, timeout):
+        # a connection on the IoLoop closes asynchronously, so there is nothing to wait for
+        if self._connection_process is not None:
+            self._connection_process.join(timeout)
+
+    # Creates new TelemetryConnection in separate thread, or on the IoLoop if there is one
     def _connect(self):
         Logger.info("TelemetryManager: starting connection")
         self.dispatch('on_connecting', "Connecting to Podium")
+        self._check_io_loop()
+        self._start_recorder()
+        if self._frame_queue is not None:
+            # frames recorded for another device are not sent under this one
+            self._frame_queue.set_key(self.device_id)
+        if self._io_loop is not None:
+            self.connection = TelemetryConnection(self.host, self.port, self.device_id,
+                                                  self.channels, self._data_bus, self.status, self.api_msg,
+                                                  io_loop=self._io_loop, backfill_queue=self._frame_queue)
+            self.connection.run()
+            Logger.debug("TelemetryManager: connection started")
+            return
         self.connection = TelemetryConnection(self.host, self.port, self.device_id,
-                                              self.channels, self._data_bus, self.status, self.api_msg)
+                                              self.channels, self._data_bus, self.status, self.api_msg,
+                                              backfill_queue=self._frame_queue)
         self._connection_process = threading.Thread(target=self.connection.run)
         self._connection_process.daemon = True
         self._connection_process.start()
         Logger.debug("TelemetryManager: thread started")
 
+    def _check_io_loop(self):
+        # if the loop's thread has exited, carry on with a new shared loop
+        io_loop = self._io_loop
+        if io_loop is not None and not io_loop.is_running():
+            Logger.warning('TelemetryManager: IoLoop has stopped, switching to a new one')
+            self._io_loop = get_io_loop()
+            self._recorder = None
+
+    def _start_recorder(self):
+        if self._frame_queue is None or self._recorder is not None:
+            return
+        if self._io_loop is not None:
+            self._recorder = self._io_loop.call_repeating(self.RECORD_INTERVAL, self._record_sample)
+        else:
+            self._recorder = threading.Event()
+            recorder = threading.Thread(target=self._record_worker, args=(self._recorder,))
+            recorder.daemon = True
+            recorder.start()
+
+    def _stop_recorder(self):
+        recorder = self._recorder
+        if recorder is None:
+            return
+        if self._io_loop is not None:
+            recorder.cancel()
+        else:
+            recorder.set()
+        self._recorder = None
+
+    def _record_worker(self, stopped):
+        while not stopped.wait(self.RECORD_INTERVAL):
+            self._record_sample()
+
+    def _record_sample(self):
+        """
+        Record the latest sample while the uplink is down. The queue keeps the device id and
+        channel list the samples were recorded with, so they are only sent for that device,
+        following that channel list.
+        """
+        sample = self._sample_data
+        channels = self.channels
+        if self._streaming or sample is None or channels is None or not self._should_connect:
+            return
+        try:
+            queue = self._frame_queue
+            queue.set_key(self.device_id)
+            if queue.set_preamble(encode_meta(self._codec, channels)):
+                encoder = self._recorder_encoder
+                encoder.set_channels(channels)
+                queue.put(encoder.encode(sample))
+        except Exception as e:
+            Logger.error('TelemetryManager: error recording sample: {}'.format(e))
+
     def stop(self):
         Logger.debug("TelemetryManager: stop()")
+        self._streaming = False
 
         if self._retry_timer:
             self._retry_timer.cancel()
@@ -208,12 +311,13 @@ class TelemetryManager(EventDispatcher):
         if self.connection:
             self.connection.end()
             try:
-                self._connection_process.join(1)
+                self._join_connection(1)
             except:
                 pass
 
     def _user_stopped(self):
         self.dispatch('on_disconnected', '')
+        self._stop_recorder()
         self.stop()
 
     # Status function that receives events from TelemetryConnection thread
@@ -240,10 +344,14 @@ class TelemetryManager(EventDispatcher):
                     min(self.RETRY_WAIT_MAX_TIME, (math.pow(self.RETRY_MULTIPLIER, self._retry_count) *
                                                    self.RETRY_WAIT_START))
                 Logger.warning("TelemetryManager: got disconnect, reconnecting in %d seconds" % wait)
-                self._retry_timer = threading.Timer(wait, self._connect)
-                self._retry_timer.start()
+                if self._io_loop is not None:
+                    self._retry_timer = self._io_loop.call_later(wait, self._connect)
+                else:
+                    self._retry_timer = threading.Timer(wait, self._connect)
+                    self._retry_timer.start()
                 self._retry_count += 1
         elif status_code == TelemetryConnection.STATUS_STREAMING:
+            self._streaming = True
             self.dispatch('on_streaming', True)
         elif status_code in [TelemetryConnection.ERROR_CONNECTING,
                              TelemetryConnection.ERROR_UNKNOWN,
@@ -253,6 +361,13 @@ class TelemetryManager(EventDispatcher):
     def api_msg(self, data):
         self.dispatch('on_api_msg', data)
 
+    def get_uplink_stats(self):
+        """
+        :return dict of statistics for the current connection's uplink, or None if there is no connection
+        """
+        connection = self.connection
+        return None if connection is None else connection.get_uplink_stats()
+
     def on_connecting(self, *args):
         pass
 
@@ -291,9 +406,22 @@ class TelemetryConnection(asynchat.async_chat):
     ERROR_TIMEOUT = 14
 
     SAMPLE_INTERVAL = 0.1
-
-    def __init__(self, host, port, device_id, channel_metas, data_bus, update_status_cb, api_msg_cb):
-        asynchat.async_chat.__init__(self)
+    # the longest the uplink waits between samples when the link is slow
+    MAX_SAMPLE_INTERVAL = 2.0
+    # frames per second sent from the back-fill queue, while the link keeps up
+    BACKFILL_RATE = 20
+
+    def __init__(self, host, port, device_id, channel_metas, data_bus, update_status_cb, api_msg_cb, io_loop=None,
+                 backfill_queue=None):
+        # when io_loop is set the connection runs on it, otherwise run() runs its own asyncore loop
+        self._io_loop = io_loop
+        # frames recorded while disconnected, sent once streaming
+        self._backfill_queue = backfill_queue
+        self._backfill_allowance = 0.0
+        self._backfill_time = None
+        self._backfill_count = 0
+        asynchat.async_chat.__init__(self, map=None if io_loop is None else io_loop.socket_map)
+        self._active = False
 
         self.status = self.STATUS_UNINITIALIZED
         self.input_buffer = []
@@ -316,6 +444,9 @@ class TelemetryConnection(asynchat.async_chat):
         self._data_bus = data_bus
         self._update_status = update_status_cb
         self._api_msg_cb = api_msg_cb
+        self._codec = JsonCodec()
+        self._encoder = SampleEncoder(self._codec)
+        self._uplink = UplinkMonitor(self.SAMPLE_INTERVAL, self.MAX_SAMPLE_INTERVAL)
 
         self._data_bus.add_sample_listener(self._on_sample)
         self._data_bus.addMetaListener(self._on_meta)
@@ -342,6 +473,10 @@ class TelemetryConnection(asynchat.async_chat):
     # Sets up timer to send data to RCL every 100ms
     def _start_sample_timer(self):
         self._running.set()
+        if self._io_loop is not None:
+            self._should_send_meta = True
+            self._sample_timer = self._io_loop.call_repeating(self.SAMPLE_INTERVAL, self._send_update)
+            return
         self._sample_timer = threading.Thread(target=self._sample_worker)
         self._sample_timer.daemon = True
         self._sample_timer.start()
@@ -350,19 +485,56 @@ class TelemetryConnection(asynchat.async_chat):
         Logger.info('TelemetryConnection: sample worker starting')
         self._should_send_meta = True
         while self._running.is_set():
-            try:
-                if self._should_send_meta == True:
-                    self._send_meta()
-                    self._should_send_meta = False
-                self._send_sample()
-                sleep(self.SAMPLE_INTERVAL)
-            except Exception as e:
-                Logger.error("TelemetryConnection: error sending sample: " + str(e))
+            self._send_update()
+            sleep(self.SAMPLE_INTERVAL)
         Logger.info('TelemetryConnection: sample worker exiting')
 
+    def _send_update(self):
+        try:
+            if self._should_send_meta == True:
+                self._send_meta()
+                self._should_send_meta = False
+            if self._backfill_queue is not None:
+                # live samples wait for the recorded frames, which carry no timestamps;
+                # the back-fill ends with our meta and a full sample
+                self._send_backfill()
+            elif self._uplink.frame_due():
+                self._send_sample()
+        except Exception as e:
+            Logger.error("TelemetryConnection: error sending sample: " + str(e))
+
+    def get_uplink_stats(self):
+        """
+        :return dict of uplink statistics: bytes_per_sec, queued_frames, frames_sent, bytes_sent,
+        the current sample interval and the latest write latency
+        """
+        return self._uplink.get_stats()
+
+    def is_active(self):
+        """
+        :return True from when the connection is started until its socket is closed
+        """
+        return self._active
+
     def run(self):
+        if self._io_loop is not None:
+            # the loop connects, and runs the connection from then on
+            self._active = True
+            self._io_loop.call_soon_threadsafe(self._open_connection)
+            return
+
+        self._open_connection()
+
+        # This starts the loop around the socket connection polling
+        # 'timeout' is how long the select() or poll() functions will wait for data,
+        # set to 3 seconds as the default is 30s, which means our code wouldn't
+        # see a disconnect until 30s after it happens
+        asyncore.loop(timeout=3)
+
+    def _open_connection(self):
         Logger.info("TelemetryConnection: connecting to: %s:%d" % (self.host, self.port))
 
+        self._active = True
         self._connecting = True
 
         # No try/except here because the connect call ends up calling socket.connect_ex,
@@ -375,12 +547,6 @@ class TelemetryConnection(asynchat.async_chat):
             Logger.info("TelemetryConnection: exception connecting")
             self._update_status("error", "Podium: Error connecting", self.STATUS_DISCONNECTED)
 
-        # This starts the loop around the socket connection polling
-        # 'timeout' is how long the select() or poll() functions will wait for data,
-        # set to 3 seconds as the default is 30s, which means our code wouldn't
-        # see a disconnect until 30s after it happens
-        asyncore.loop(timeout=3)
-
 
     def handle_connect(self):
         Logger.info("TelemetryConnection: got connect")
@@ -396,6 +562,10 @@ class TelemetryConnection(asynchat.async_chat):
         self._update_status("error", "Podium: unknown error", self.STATUS_DISCONNECTED)
         self.end()
 
+    def close(self):
+        asynchat.async_chat.close(self)
+        self._active = False
+
     def handle_close(self):
         self.close()
         self._connected = False
@@ -453,13 +623,26 @@ class TelemetryConnection(asynchat.async_chat):
     def send_msg(self, msg):
         msg = msg + "\n"
         msg = msg.encode('ascii')
+        self._uplink.frame_queued(len(msg))
 
         try:
-            Logger.debug('TelemetryConnection: msg tx: {}'.format(msg))
+            if Logger.isEnabledFor(logging.DEBUG):
+                Logger.debug('TelemetryConnection: msg tx: {}'.format(msg))
+            io_loop = self._io_loop
+            if io_loop is not None and not io_loop.in_loop_thread():
+                # asynchat is not thread-safe; hand the message to the loop
+                io_loop.call_soon_threadsafe(self.push, msg)
+                return
             self.push(msg)
         except Exception as e:
             Logger.error("TelemetryConnection: error sending message: " + str(e))
 
+    def send(self, data):
+        sent = asynchat.async_chat.send(self, data)
+        if sent:
+            self._uplink.sent(sent)
+        return sent
+
     # asynchat calls this function when new data comes in, we are responsible for buffering
     def collect_incoming_data(self, data):
         self.input_buffer.append(data)
@@ -469,8 +652,9 @@ class TelemetryConnection(asynchat.async_chat):
         msg = ''.join(self.input_buffer)
         self.input_buffer = []
 
-        Logger.debug('TelemetryConnection: rx: {}'.format(msg))
-        msg_object = json.loads(msg)
+        if Logger.isEnabledFor(logging.DEBUG):
+            Logger.debug('TelemetryConnection: rx: {}'.format(msg))
+        msg_object = self._codec.decode(msg)
         self._handle_msg(msg_object)
 
     def _handle_msg(self, msg_object):
@@ -503,9 +687,6 @@ class TelemetryConnection(asynchat.async_chat):
         # Meta format: {"s":{"meta":[{"nm":"Coolant","ut":"F","sr":1},{"nm":"MAP","ut":"KPa","sr":5}]}}
         Logger.info("TelemetryConnection: sending meta")
 
-        msg = {"s":{"meta":[]}}
-        meta = []
-
         # assign local variable to make thread safe
         # class member variable may be changed
         # by other thread.
@@ -513,68 +694,75 @@ class TelemetryConnection(asynchat.async_chat):
         cm = self._channel_metas
         # DO NOT REMOVE
 
-        for channel_config in cm.itervalues():
-            channel = {
-                "nm": channel_config.name,
-                "ut": channel_config.units,
-                "sr": channel_config.sampleRate,
-                "min": channel_config.min,
-                "max": channel_config.max
-            }
-            meta.append(channel)
-
-        msg["s"]["meta"] = meta
-        msg_json = json.dumps(msg)
-
-        self.send_msg(msg_json)
+        self.send_msg(encode_meta(self._codec, cm))
+        # the server needs every channel again after new meta
+        self._encoder.reset()
 
     def _send_sample(self, *args):
-        if self._sample_data is not None:
-            update = {"s": {"d": None}}
-            bitmasks = []
-            channel_bit_position = 0
-            bitmask_index = 0
-            data = []
-
-            # assign local variables to make thread safe
-            # class member variables may be changed
-            # by other thread.
-            # DO NOT REMOVE
-            sd = self._sample_data
-            cm = self._channel_metas
-            # DO NOT REMOVE
-
-            bitmasks_needed = int(max(0, math.floor((len(cm) - 1) / 32)) + 1)
-            for x in range(0, bitmasks_needed):
-                bitmasks.append(0)
-
-            for channel_name, value in cm.iteritems():
-                if channel_bit_position > 31:
-                    bitmask_index += 1
-                    channel_bit_position = 0
-
-                value = sd.get(channel_name)
-                if value is not None:
-                    bitmasks[bitmask_index] = bitmasks[bitmask_index] | (1 << channel_bit_position)
-                    data.append(value)
-
-                channel_bit_position += 1
-
-            for bitmask in bitmasks:
-                data.append(bitmask)
-
-            update["s"]["d"] = data
-            update_json = json.dumps(update)
+        # assign local variables to make thread safe
+        # class member variables may be changed
+        # by other thread.
+        # DO NOT REMOVE
+        sd = self._sample_data
+        cm = self._channel_metas
+        # DO NOT REMOVE
 
-            self.send_msg(update_json)
+        if sd is not None:
+            encoder = self._encoder
+            encoder.set_channels(cm)
+            update_json = encoder.encode(sd)
+            if update_json is not None:
+                self.send_msg(update_json)
+
+    def _send_backfill(self):
+        now = time()
+        if self._backfill_time is None:
+            recorded = len(self._backfill_queue)
+            if recorded == 0:
+                self._backfill_queue = None
+                return
+            Logger.info('TelemetryConnection: back-filling {} recorded frames'.format(recorded))
+            self._backfill_time = now
+            # the channel list the frames were recorded with
+            preamble = self._backfill_queue.preamble
+            if preamble is not None:
+                self.send_msg(preamble)
+        rate = self.BACKFILL_RATE
+        self._backfill_allowance = min(rate, self._backfill_allowance + (now - self._backfill_time) * rate)
+        self._backfill_time = now
+
+        uplink = self._uplink
+        queue = self._backfill_queue
+        # only send while earlier frames have been written, so back-fill never backs up the link
+        while self._backfill_allowance >= 1 and uplink.queued_frames == 0:
+            frame = queue.get()
+            if frame is None:
+                Logger.info('TelemetryConnection: back-fill complete, sent {} frames'.format(self._backfill_count))
+                self._backfill_queue = None
+                # the recorded frames had their own meta; restore ours, followed by a full sample
+                self._should_send_meta = True
+                return
+            self.send_msg(frame)
+            self._backfill_count += 1
+            self._backfill_allowance -= 1
 
     def end(self):
         self._data_bus.remove_meta_listener(self._on_meta)
         self._data_bus.remove_sample_listener(self._on_sample)
+        Logger.info('TelemetryConnection: uplink stats: {}'.format(self.get_uplink_stats()))
+        io_loop = self._io_loop
         if self._connected:
             self._running.clear()
             Logger.info("TelemetryConnection: closing connection")
+            if io_loop is not None:
+                if self._sample_timer:
+                    self._sample_timer.cancel()
+                io_loop.call_soon_threadsafe(self.close_when_done)
+                return
             if self._sample_timer:
                 self._sample_timer.join()
             self.close_when_done()
+        elif io_loop is not None and self._active:
+            # abandon a connection still in progress
+            io_loop.call_soon_threadsafe(self.close)
 
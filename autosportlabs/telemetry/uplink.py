@@ -0,0 +1,237 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+from collections import deque
+from threading import Lock
+from time import time
+
+__all__ = ('SampleEncoder', 'UplinkMonitor', 'encode_meta')
+
+
+def encode_meta(codec, channel_metas):
+    """
+    Encode the channel list sent ahead of samples. The channels are listed in the order
+    of their bits in sample frames.
+    Meta format: {"s":{"meta":[{"nm":"Coolant","ut":"F","sr":1},{"nm":"MAP","ut":"KPa","sr":5}]}}
+    :param codec the codec for encoding the frame
+    :type codec JsonCodec
+    :param channel_metas dict of channel name => ChannelMeta
+    :type channel_metas dict
+    :return the encoded frame
+    """
+    meta = []
+    for channel_config in channel_metas.itervalues():
+        meta.append({
+            "nm": channel_config.name,
+            "ut": channel_config.units,
+            "sr": channel_config.sampleRate,
+            "min": channel_config.min,
+            "max": channel_config.max
+        })
+    return codec.encode({"s": {"meta": meta}})
+
+
+class SampleEncoder(object):
+    """
+    Encodes samples for the telemetry uplink.
+
+    A frame carries only the channels whose values changed since they were last sent,
+    flagged in the frame's bitmasks. A full frame is sent periodically, and after reset(),
+    so the server can recover the complete state.
+    """
+    FULL_FRAME_INTERVAL = 5.0
+
+    def __init__(self, codec, full_frame_interval=FULL_FRAME_INTERVAL):
+        """
+        :param codec the codec for encoding frames
+        :type codec JsonCodec
+        :param full_frame_interval the interval between full frames, in seconds
+        :type full_frame_interval float
+        """
+        self._codec = codec
+        self.full_frame_interval = full_frame_interval
+        self._channel_metas = None
+        self._channel_names = []
+        self._last_values = {}
+        self._last_full_frame = None
+
+    def set_channels(self, channel_metas):
+        """
+        Set the channels to encode. The channel bits follow the order of the channel metas,
+        as sent to the server.
+        :param channel_metas dict of channel name => ChannelMeta
+        :type channel_metas dict
+        """
+        if channel_metas is self._channel_metas:
+            return
+        self._channel_metas = channel_metas
+        self._channel_names = list(channel_metas.iterkeys())
+        self.reset()
+
+    def reset(self):
+        """
+        Send a full frame next
+        """
+        self._last_values = {}
+        self._last_full_frame = None
+
+    def encode(self, sample, now=None):
+        """
+        Encode the channels of a sample that changed since they were last sent
+        :param sample dict of channel name => value
+        :type sample dict
+        :return the encoded frame, or None if nothing changed
+        """
+        now = time() if now is None else now
+        full = self._last_full_frame is None or now - self._last_full_frame >= self.full_frame_interval
+        if full:
+            self._last_full_frame = now
+
+        names = self._channel_names
+        last_values = self._last_values
+        bitmasks = [0] * (max(0, len(names) - 1) // 32 + 1)
+        data = []
+        for index, name in enumerate(names):
+            value = sample.get(name)
+            if value is None:
+                continue
+            if full or last_values.get(name) != value:
+                bitmasks[index >> 5] |= 1 << (index & 31)
+                data.append(value)
+                last_values[name] = value
+
+        if not full and len(data) == 0:
+            return None
+
+        data.extend(bitmasks)
+        return self._codec.encode({"s": {"d": data}})
+
+
+class UplinkMonitor(object):
+    """
+    Tracks the frames written to the uplink socket and adapts the send interval to the link.
+
+    While earlier frames are still waiting to be written the interval doubles, so changes from
+    the skipped ticks go out together in the next frame; once the link keeps up it recovers
+    toward the minimum interval.
+    """
+    RATE_WINDOW = 1.0
+    INTERVAL_RECOVERY = 0.75
+    # ticks arrive with some jitter; don't skip one that is slightly early
+    INTERVAL_TOLERANCE = 0.9
+
+    def __init__(self, min_interval, max_interval):
+        """
+        :param min_interval the shortest interval between frames, in seconds
+        :type min_interval float
+        :param max_interval the longest interval between frames, in seconds
+        :type max_interval float
+        """
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        # seconds the most recently written frame waited to be written
+        self.write_latency = 0.0
+        self._lock = Lock()
+        self._queued_bytes = 0
+        # (end offset, time queued) for frames not yet completely written
+        self._pending_frames = deque()
+        self._last_frame_time = None
+        self._rate = 0.0
+        self._rate_start = time()
+        self._rate_bytes = 0
+
+    @property
+    def queued_frames(self):
+        return len(self._pending_frames)
+
+    def frame_queued(self, size, now=None):
+        """
+        Record a frame handed to the socket
+        :param size the size of the frame in bytes
+        :type size int
+        """
+        now = time() if now is None else now
+        with self._lock:
+            self._queued_bytes += size
+            self._pending_frames.append((self._queued_bytes, now))
+            self._last_frame_time = now
+
+    def sent(self, count, now=None):
+        """
+        Record bytes written to the socket
+        :param count the number of bytes written
+        :type count int
+        """
+        now = time() if now is None else now
+        with self._lock:
+            self.bytes_sent += count
+            self._rate_bytes += count
+            pending = self._pending_frames
+            while len(pending) > 0 and pending[0][0] <= self.bytes_sent:
+                end, queued_time = pending.popleft()
+                self.write_latency = now - queued_time
+                self.frames_sent += 1
+            self._update_rate(now)
+
+    def frame_due(self, now=None):
+        """
+        Check whether the next sample frame should be sent, adapting the interval to the link
+        :return True if a frame should be sent now
+        """
+        now = time() if now is None else now
+        with self._lock:
+            last_frame_time = self._last_frame_time
+            if last_frame_time is not None and now - last_frame_time < self.interval * self.INTERVAL_TOLERANCE:
+                return False
+            if len(self._pending_frames) > 0:
+                # the link is behind; wait, and batch the changes into a later frame
+                self.interval = min(self.max_interval, self.interval * 2)
+                self._last_frame_time = now
+                return False
+            if self.write_latency < self.interval / 2:
+                self.interval = max(self.min_interval, self.interval * self.INTERVAL_RECOVERY)
+            return True
+
+    def get_bytes_per_sec(self, now=None):
+        now = time() if now is None else now
+        with self._lock:
+            self._update_rate(now)
+            return self._rate
+
+    def get_stats(self):
+        """
+        :return dict of uplink statistics
+        """
+        return {'bytes_per_sec': self.get_bytes_per_sec(),
+                'queued_frames': self.queued_frames,
+                'frames_sent': self.frames_sent,
+                'bytes_sent': self.bytes_sent,
+                'interval': self.interval,
+                'write_latency': self.write_latency}
+
+    def _update_rate(self, now):
+        elapsed = now - self._rate_start
+        if elapsed >= self.RATE_WINDOW:
+            self._rate = self._rate_bytes / elapsed
+            self._rate_start = now
+            self._rate_bytes = 0
@@ -212,8 +212,8 @@ class TrackMapView(Widget):
         Add the point values for the specified key
         :param key The key referencing the heat map values
         :type key string
-        :param heat_map_values A list of values. The number of values should correspond to exactly the number of points for the path matching the same key in path.
-        :type heat_map_values list
+        :param heat_map_values A sequence of values, with NaN for missing values. The number of values should correspond to exactly the number of points for the path matching the same key in path.
+        :type heat_map_values list or array
         '''
         self._heat_map_values[key] = heat_map_values
         self._draw_current_map()
@@ -349,7 +349,8 @@ class TrackMapView(Widget):
     def _draw_current_map(self):
 
         def _calc_heat_pct(heat_value, heat_min, heat_range):
-            if heat_value is not None and heat_range > 0:
+            # missing values are NaN
+            if not math.isnan(heat_value) and heat_range > 0:
                 return int(((heat_value - heat_min) / heat_range) * 100.0)
             else:
                 return 0
@@ -371,7 +372,7 @@ class TrackMapView(Widget):
             # draw all of the traces
             for key, path_points in self._scaled_paths.iteritems():
                 heat_path = self._heat_map_values.get(key)
-                if heat_path:
+                if heat_path is not None and len(heat_path) > 0:
                     # draw heat map
                     point_count = len(path_points)
                     heat_min = self.heat_min
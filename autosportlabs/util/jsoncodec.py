@@ -0,0 +1,137 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+
+__all__ = ('JsonCodec', 'DecodeStats', 'JSON_LIBRARY')
+
+import json
+from timeit import default_timer
+
+# Use the fastest JSON library available for decoding, falling back to the standard library.
+# ujson is only used for decoding, as older releases round floats when encoding.
+try:
+    import ujson
+    JSON_LIBRARY = 'ujson'
+    _decode = ujson.loads
+except ImportError:
+    try:
+        import simplejson
+        JSON_LIBRARY = 'simplejson'
+        _decode = simplejson.JSONDecoder(strict=False).decode
+    except ImportError:
+        JSON_LIBRARY = 'json'
+        # build the decoder once; json.loads with arguments creates a new
+        # decoder, and loses the C scanner, on every call
+        _decode = json.JSONDecoder(strict=False).decode
+
+if JSON_LIBRARY == 'simplejson':
+    _encode = simplejson.JSONEncoder(separators=(',', ':')).encode
+else:
+    _encode = json.JSONEncoder(separators=(',', ':')).encode
+
+# the standard library is the most lenient, used when the fast decoder rejects a message
+_lenient_decode = json.JSONDecoder(strict=False).decode
+
+SAMPLE_FRAME_PREFIX = '{"s":'
+SAMPLE_FRAME_META = '"meta"'
+
+
+class DecodeStats(object):
+    """
+    Decode counters for a message type
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.decode_time = 0.0
+        self.max_decode_time = 0.0
+
+    def record(self, elapsed):
+        self.count += 1
+        self.decode_time += elapsed
+        if elapsed > self.max_decode_time:
+            self.max_decode_time = elapsed
+
+    @property
+    def average_decode_time(self):
+        return self.decode_time / self.count if self.count > 0 else 0.0
+
+    def __str__(self):
+        return 'messages: {}, decode avg {:.1f}us max {:.1f}us'.format(
+            self.count, self.average_decode_time * 1000000.0, self.max_decode_time * 1000000.0)
+
+
+class JsonCodec(object):
+    """
+    Encodes and decodes API messages with the fastest JSON library available,
+    keeping per message decode timing counters.
+    """
+
+    def __init__(self):
+        # message name => DecodeStats
+        self.decode_stats = {}
+
+    def decode(self, msg):
+        """
+        Decodes a message. Illegal characters are dropped.
+        :param msg the raw message
+        :type msg string
+        :return dict
+        """
+        start = default_timer()
+        if isinstance(msg, str) and msg.startswith(SAMPLE_FRAME_PREFIX) and SAMPLE_FRAME_META not in msg:
+            # sample data frames are plain ASCII numbers; decode the bytes directly
+            # and only clean the message if that fails
+            try:
+                msg_json = _decode(msg)
+            except ValueError:
+                msg_json = self._decode_clean(msg)
+        else:
+            msg_json = self._decode_clean(msg)
+        elapsed = default_timer() - start
+
+        name = next(iter(msg_json), None) if isinstance(msg_json, dict) and len(msg_json) == 1 else None
+        stats = self.decode_stats.get(name)
+        if stats is None:
+            stats = self.decode_stats[name] = DecodeStats()
+        stats.record(elapsed)
+        return msg_json
+
+    def _decode_clean(self, msg):
+        if isinstance(msg, str):
+            msg = unicode(msg, errors='ignore')
+        try:
+            return _decode(msg)
+        except ValueError:
+            if _decode is _lenient_decode:
+                raise
+            return _lenient_decode(msg)
+
+    def encode(self, msg):
+        """
+        Encodes a message in compact form
+        :param msg the message
+        :type msg dict
+        :return string
+        """
+        return _encode(msg)
+
+    def reset_stats(self):
+        self.decode_stats.clear()
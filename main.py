@@ -81,6 +81,7 @@ if __name__ == '__main__':
     from autosportlabs.racecapture.views.toolbar.toolbarview import ToolbarView
     from autosportlabs.racecapture.menu.mainmenu import MainMenu
     from autosportlabs.comms.commsfactory import comms_factory
+    from autosportlabs.comms.ioloop import get_io_loop
     from autosportlabs.racecapture.tracks.trackmanager import TrackManager
     from autosportlabs.racecapture.presets.presetmanager import PresetManager
     from autosportlabs.racecapture.menu.homepageview import HomePageView
@@ -88,6 +89,7 @@ if __name__ == '__main__':
     from autosportlabs.racecapture.config.rcpconfig import Track
     from autosportlabs.racecapture.config.rcpconfig import Capabilities
     from autosportlabs.telemetry.telemetryconnection import TelemetryManager
+    from autosportlabs.telemetry.framequeue import FrameQueue, DROP_OLDEST, DROP_NEWEST
     from autosportlabs.help.helpmanager import HelpInfo
     from autosportlabs.racecapture.views.analysis.analysisdata import CachingAnalysisDatastore
     from autosportlabs.racecapture.data.sessionrecorder import SessionRecorder
@@ -105,6 +107,7 @@ if __name__ == '__main__':
 
 from kivy.app import App, Builder
 from autosportlabs.racecapture.config.rcpconfig import RcpConfig, VersionConfig
+from autosportlabs.racecapture.config.configcache import DeviceConfigCache
 from autosportlabs.racecapture.databus.databus import DataBusFactory, DataBusPump
 from autosportlabs.racecapture.status.statuspump import StatusPump
 from autosportlabs.racecapture.api.rcpapi import RcpApi
@@ -197,7 +200,9 @@ class RaceCaptureApp(App):
         self.preset_manager = PresetManager(user_dir=self.settings.get_default_data_dir(), base_dir=self.base_dir)
 
         # RaceCapture communications API
-        self._rc_api = RcpApi(on_disconnect=self._on_rcp_disconnect, settings=self.settings)
+        config_cache = DeviceConfigCache(os.path.join(self.settings.get_default_data_dir(),
+                                                      DeviceConfigCache.CACHE_SUBDIR))
+        self._rc_api = RcpApi(on_disconnect=self._on_rcp_disconnect, settings=self.settings, config_cache=config_cache)
 
         self._databus = DataBusFactory().create_standard_databus(self.settings.systemChannels)
         self.settings.runtimeChannels.data_bus = self._databus
@@ -283,6 +288,10 @@ class RaceCaptureApp(App):
     def _init_datastore(self):
         def _init_datastore(dstore_path):
             Logger.info('RaceCaptureApp:initializing datastore...')
+            self._datastore.columnar = self.settings.userPrefs.get_pref_bool('preferences', 'columnar_datastore', False)
+            profile = self.settings.userPrefs.get_pref('preferences', 'datastore_profile')
+            if profile in CachingAnalysisDatastore.TUNING_PROFILES:
+                self._datastore.tuning_profile = profile
             self._datastore.open_db(dstore_path)
 
         dstore_path = self.settings.userPrefs.datastore_location
@@ -298,8 +307,12 @@ class RaceCaptureApp(App):
     def on_write_config(self, instance, *args):
         rcpConfig = self.rc_config
         try:
-            self._rc_api.writeRcpCfg(rcpConfig, self.on_write_config_complete, self.on_write_config_error)
-            self.showActivity("Writing configuration")
+            plan = self._rc_api.writeRcpCfg(rcpConfig, self.on_write_config_complete, self.on_write_config_error)
+            if plan.commands_saved > 0:
+                self.showActivity("Writing configuration, skipped {} unchanged ({} bytes)".format(plan.commands_saved,
+                                                                                             plan.bytes_saved))
+            else:
+                self.showActivity("Writing configuration")
         except:
             logging.exception('')
             self._serial_warning()
@@ -545,6 +558,7 @@ class RaceCaptureApp(App):
         rc_api.detect_win_callback = self.rc_detect_win
         rc_api.detect_fail_callback = self.rc_detect_fail
         rc_api.detect_activity_callback = self.rc_detect_activity
+        rc_api.command_window = self.settings.userPrefs.get_pref_int('preferences', 'command_window', 1)
         rc_api.init_api(comms)
         rc_api.run_auto_detect()
 
@@ -597,7 +611,20 @@ class RaceCaptureApp(App):
 
         telemetry_enabled = True if self.settings.userPrefs.get_pref('preferences', 'send_telemetry') == "1" else False
 
-        tc = self._telemetry_connection = TelemetryManager(self._databus, host=host, telemetry_enabled=telemetry_enabled)
+        frame_queue = None
+        buffer_mb = self.settings.userPrefs.get_pref_int('preferences', 'telemetry_buffer_mb', 8)
+        if buffer_mb > 0:
+            drop_policy = self.settings.userPrefs.get_pref('preferences', 'telemetry_drop_policy')
+            try:
+                frame_queue = FrameQueue(os.path.join(self.settings.get_default_data_dir(), 'telemetry_queue.bin'),
+                                         max_size=buffer_mb * 1024 * 1024,
+                                         drop_policy=drop_policy if drop_policy in (DROP_OLDEST, DROP_NEWEST) else DROP_OLDEST)
+            except Exception as e:
+                Logger.warning('RaceCaptureApp: could not open telemetry queue, telemetry will not be back-filled: {}'.format(e))
+
+        tc = self._telemetry_connection = TelemetryManager(self._databus, host=host, io_loop=get_io_loop(),
+                                                           frame_queue=frame_queue,
+                                                           telemetry_enabled=telemetry_enabled)
         self.config_listeners.append(tc)
         tc.bind(on_connecting=self.telemetry_connecting)
         tc.bind(on_connected=self.telemetry_connected)
@@ -651,6 +678,16 @@ class RaceCaptureApp(App):
             Logger.info("RaceCaptureApp: RC connection type changed to {}, restarting comms".format(value))
             Clock.schedule_once(lambda dt: self._restart_comms())
 
+        if token == ('preferences', 'columnar_datastore'):
+            self._datastore.columnar = value == "1"
+
+        if token == ('preferences', 'datastore_profile'):
+            # applied the next time the datastore is opened
+            self._datastore.tuning_profile = value
+
+        if token == ('preferences', 'command_window'):
+            self._rc_api.command_window = int(value)
+
     def _enable_telemetry(self):
         self._telemetry_connection.telemetry_enabled = True
 
@@ -0,0 +1,12 @@
+CREATE TABLE IF NOT EXISTS channel_chunk
+        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id INTEGER NOT NULL,
+        name TEXT NOT NULL COLLATE NOCASE,
+        chunk_index INTEGER NOT NULL,
+        start_interval INTEGER NULL,
+        end_interval INTEGER NULL,
+        sample_count INTEGER NOT NULL,
+        typecode TEXT NOT NULL,
+        data BLOB NOT NULL);
+
+CREATE INDEX IF NOT EXISTS channel_chunk_session_name_index_id on channel_chunk(session_id, name, chunk_index);
@@ -0,0 +1,14 @@
+CREATE TABLE IF NOT EXISTS session_lap
+        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id INTEGER NOT NULL,
+        lap INTEGER NOT NULL,
+        lap_time REAL NULL,
+        first_sample_id INTEGER NOT NULL,
+        last_sample_id INTEGER NOT NULL,
+        start_interval REAL NULL,
+        end_interval REAL NULL,
+        distance REAL NULL);
+
+CREATE UNIQUE INDEX IF NOT EXISTS session_lap_session_lap_index_id on session_lap(session_id, lap);
+
+ALTER TABLE session ADD COLUMN laps_indexed INTEGER NOT NULL DEFAULT 0;
@@ -0,0 +1,24 @@
+CREATE TABLE IF NOT EXISTS session_channel_stats
+        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        sample_count INTEGER NOT NULL,
+        value_sum REAL NULL,
+        min_value REAL NULL,
+        max_value REAL NULL,
+        positive_min REAL NULL,
+        positive_max REAL NULL);
+
+CREATE UNIQUE INDEX IF NOT EXISTS session_channel_stats_session_name_index_id on session_channel_stats(session_id, name);
+
+CREATE TABLE IF NOT EXISTS session_location_stats
+        (session_id INTEGER PRIMARY KEY,
+        sample_count INTEGER NOT NULL,
+        latitude_sum REAL NULL,
+        longitude_sum REAL NULL,
+        min_latitude REAL NULL,
+        max_latitude REAL NULL,
+        min_longitude REAL NULL,
+        max_longitude REAL NULL);
+
+ALTER TABLE session ADD COLUMN stats_computed INTEGER NOT NULL DEFAULT 0;
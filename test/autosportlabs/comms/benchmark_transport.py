@@ -0,0 +1,97 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Benchmark of the transport between the serial connection process and the app,
+multiprocessing queues vs the shared memory ring. A fake SerialConnection produces
+sample lines as fast as the connection process reads them.
+
+Run from the project root:
+    python -m test.autosportlabs.comms.benchmark_transport
+"""
+
+import os
+import time
+from autosportlabs.comms.comms import Comms, TRANSPORT_QUEUE, TRANSPORT_SHARED_MEMORY
+
+MESSAGES = 100000
+SAMPLE_LINE = '{"s":{"t":12345,"d":[3500,1.25,45.123456,-122.654321,87,98,14.1,0.02,-0.98,1.01,2,0,0,1]}}'
+
+
+class FakeSerialConnection(object):
+    """
+    Stands in for SerialConnection, returning a fixed number of sample lines
+    """
+
+    def __init__(self, count):
+        self.count = count
+
+    def open(self, device):
+        pass
+
+    def close(self):
+        pass
+
+    def flushInput(self):
+        pass
+
+    def flushOutput(self):
+        pass
+
+    def read_lines(self):
+        if self.count == 0:
+            # as a serial read times out with no data
+            time.sleep(0.1)
+            return []
+        self.count -= 1
+        return [SAMPLE_LINE]
+
+    def write(self, data):
+        pass
+
+
+def measure(transport):
+    comms = Comms('fake', FakeSerialConnection(MESSAGES), transport=transport)
+    cpu_start = os.times()
+    comms.open()
+    start = time.time()
+    received = 0
+    while received < MESSAGES:
+        if comms.read_message() is None:
+            raise Exception('Timeout after {} messages'.format(received))
+        received += 1
+    elapsed = time.time() - start
+    comms.close()
+    cpu_end = os.times()
+    # user + system time for this process and the joined connection process
+    cpu = sum(cpu_end[i] - cpu_start[i] for i in range(4))
+    return MESSAGES / elapsed, cpu / MESSAGES * 1000000
+
+
+def run():
+    print '{:>14} {:>12} {:>12}'.format('transport', 'messages/s', 'cpu us/msg')
+    for transport in [TRANSPORT_QUEUE, TRANSPORT_SHARED_MEMORY]:
+        rate, cpu = measure(transport)
+        print '{:>14} {:>12.0f} {:>12.1f}'.format(transport, rate, cpu)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,107 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from autosportlabs.comms.framing import LineFramer
+from autosportlabs.comms.serial.serialconnection import SerialConnection
+
+
+class LineFramerTest(unittest.TestCase):
+
+    def test_read_lines(self):
+        framer = LineFramer()
+        framer.feed('one\r\ntwo\r\nthr')
+        self.assertEqual(framer.read_lines(), ['one', 'two'])
+        self.assertEqual(len(framer), 3)
+        framer.feed('ee\r\n')
+        self.assertEqual(framer.read_lines(), ['three'])
+        self.assertEqual(framer.read_lines(), [])
+        self.assertEqual(len(framer), 0)
+
+    def test_terminator_split_across_reads(self):
+        framer = LineFramer()
+        framer.feed('abc\r')
+        self.assertIsNone(framer.next_line())
+        framer.feed('\n')
+        self.assertEqual(framer.next_line(), 'abc')
+
+    def test_next_line(self):
+        framer = LineFramer()
+        framer.feed('a\r\n\r\nb\r\n')
+        self.assertEqual(framer.next_line(), 'a')
+        self.assertEqual(framer.next_line(), '')
+        self.assertEqual(framer.next_line(), 'b')
+        self.assertIsNone(framer.next_line())
+
+    def test_byte_at_a_time(self):
+        framer = LineFramer()
+        lines = []
+        for c in 'first\r\nsecond\r\n' * 1000:
+            framer.feed(c)
+            lines.extend(framer.read_lines())
+        self.assertEqual(lines, ['first', 'second'] * 1000)
+        self.assertEqual(len(framer), 0)
+
+    def test_clear(self):
+        framer = LineFramer()
+        framer.feed('partial')
+        framer.clear()
+        framer.feed('line\r\n')
+        self.assertEqual(framer.read_lines(), ['line'])
+
+
+class FakeSerial(object):
+    def __init__(self, data):
+        self.data = data
+        self.reads = 0
+
+    @property
+    def in_waiting(self):
+        return len(self.data)
+
+    def read(self, count):
+        self.reads += 1
+        data = self.data[:count]
+        self.data = self.data[count:]
+        return data
+
+
+class SerialConnectionFramingTest(unittest.TestCase):
+
+    def test_read_lines(self):
+        connection = SerialConnection()
+        connection.ser = FakeSerial('one\r\ntwo\r\nthree')
+        self.assertEqual(connection.read_lines(), ['one', 'two'])
+        self.assertEqual(connection.ser.reads, 1)
+        self.assertEqual(connection.read_lines(), [])
+
+    def test_read_line(self):
+        connection = SerialConnection()
+        connection.ser = FakeSerial('one\r\ntwo\r\n')
+        self.assertEqual(connection.read_line(), 'one')
+        self.assertEqual(connection.read_line(), 'two')
+        self.assertIsNone(connection.read_line())
+
+
+def main():
+    unittest.main()
+
+if __name__ == "__main__":
+    main()
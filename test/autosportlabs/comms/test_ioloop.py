@@ -0,0 +1,283 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import socket
+import threading
+import Queue
+from time import sleep, time
+from autosportlabs.comms.ioloop import IoLoop, get_io_loop
+from autosportlabs.comms.socket.socketcomm import SocketComm
+from autosportlabs.racecapture.databus.databus import DataBus
+from autosportlabs.racecapture.data.channels import ChannelMeta
+from autosportlabs.telemetry.telemetryconnection import TelemetryConnection
+
+
+def wait_for(condition, timeout=2.0):
+    end = time() + timeout
+    while not condition():
+        if time() > end:
+            return False
+        sleep(0.01)
+    return True
+
+
+class StandInDevice(object):
+    """
+    Local TCP stand-in for a RC device. Replies to each line received with
+    the same line prefixed with 'ack:'
+    """
+
+    def __init__(self, read=True):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(1)
+        self.port = self.server.getsockname()[1]
+        self.client = None
+        self.connected = threading.Event()
+        self.received = []
+        self._read = read
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _serve(self):
+        self.client, address = self.server.accept()
+        self.connected.set()
+        if not self._read:
+            return
+        data = ''
+        while True:
+            try:
+                chunk = self.client.recv(4096)
+            except socket.error:
+                return
+            if not chunk:
+                return
+            data += chunk
+            while '\r\n' in data:
+                line, data = data.split('\r\n', 1)
+                self.received.append(line)
+                self.client.sendall('ack:{}\r\n'.format(line))
+
+    def send(self, data):
+        self.client.sendall(data)
+
+    def close(self):
+        if self.client is not None:
+            try:
+                self.client.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            self.client.close()
+        self.server.close()
+
+
+class IoLoopTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = IoLoop()
+        self.loop.start()
+
+    def tearDown(self):
+        self.loop.stop(1.0)
+
+    def test_call_soon_threadsafe(self):
+        ran = threading.Event()
+        threads = []
+
+        def callback(value):
+            threads.append(threading.current_thread())
+            ran.set()
+
+        self.loop.call_soon_threadsafe(callback, 1)
+        self.assertTrue(ran.wait(1.0))
+        self.assertIs(threads[0], self.loop._thread)
+
+    def test_call_later_order_and_cancel(self):
+        calls = []
+        done = threading.Event()
+        self.loop.call_later(0.06, calls.append, 'second')
+        self.loop.call_later(0.02, calls.append, 'first')
+        self.loop.call_later(0.04, calls.append, 'cancelled').cancel()
+        self.loop.call_later(0.08, done.set)
+        self.assertTrue(done.wait(1.0))
+        self.assertEqual(calls, ['first', 'second'])
+
+    def test_call_repeating(self):
+        calls = []
+        timer = self.loop.call_repeating(0.01, calls.append, 1)
+        self.assertTrue(wait_for(lambda: len(calls) >= 5))
+        timer.cancel()
+        sleep(0.05)
+        count = len(calls)
+        sleep(0.05)
+        self.assertEqual(len(calls), count)
+
+    def test_idle_loop_does_not_spin(self):
+        sleep(0.05)
+        wakeups = self.loop.wakeups
+        sleep(0.3)
+        self.assertTrue(self.loop.wakeups - wakeups <= 1)
+
+
+class SocketCommTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = IoLoop()
+        self.loop.start()
+        self.devices = []
+
+    def tearDown(self):
+        for device in self.devices:
+            device.close()
+        self.loop.stop(1.0)
+
+    def _open(self, device):
+        self.devices.append(device)
+        comm = SocketComm(None, '127.0.0.1', io_loop=self.loop, port=device.port)
+        comm.open()
+        self.assertTrue(device.connected.wait(2.0))
+        return comm
+
+    def test_write_and_read(self):
+        comm = self._open(StandInDevice())
+        for i in range(100):
+            comm.write_message('msg{}\r\n'.format(i))
+        replies = [comm.read_message() for i in range(100)]
+        self.assertEqual(replies, ['ack:msg{}'.format(i) for i in range(100)])
+        comm.close()
+        self.assertFalse(comm.isOpen())
+
+    def test_lines_split_across_reads(self):
+        device = StandInDevice()
+        comm = self._open(device)
+        device.send('{"s":')
+        sleep(0.05)
+        device.send('1}\r\n{"s":2}\r\n')
+        self.assertEqual(comm.read_message(), '{"s":1}')
+        self.assertEqual(comm.read_message(), '{"s":2}')
+        comm.close()
+
+    def test_device_disconnect_closes(self):
+        device = StandInDevice()
+        comm = self._open(device)
+        self.assertTrue(comm.isOpen())
+        device.close()
+        self.assertTrue(wait_for(lambda: not comm.isOpen()))
+
+    def test_connection_refused(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        port = server.getsockname()[1]
+        server.close()
+        comm = SocketComm(None, '127.0.0.1', io_loop=self.loop, port=port)
+        comm.open()
+        self.assertTrue(wait_for(lambda: not comm.isOpen()))
+
+    def test_invalid_address(self):
+        comm = SocketComm(None, 'not.an.address', io_loop=self.loop)
+        comm.open()
+        self.assertTrue(wait_for(lambda: not comm.isOpen()))
+
+    def test_stopped_loop_closes(self):
+        comm = self._open(StandInDevice())
+        self.loop.stop(1.0)
+        self.assertFalse(comm.isOpen())
+
+    def test_shared_loop_fetched_on_open(self):
+        device = StandInDevice()
+        self.devices.append(device)
+        comm = SocketComm(None, '127.0.0.1', port=device.port)
+        comm.open()
+        self.assertTrue(device.connected.wait(2.0))
+        get_io_loop().stop(1.0)
+        self.assertFalse(comm.isOpen())
+
+        device = StandInDevice()
+        self.devices.append(device)
+        comm.port = device.port
+        comm.open()
+        self.assertTrue(device.connected.wait(2.0))
+        comm.write_message('hello\r\n')
+        self.assertEqual(comm.read_message(), 'ack:hello')
+        comm.close()
+
+    def test_tx_backpressure(self):
+        comm = self._open(StandInDevice(read=False))
+        comm.TX_BUFFER_SIZE = 65536
+        comm.QUEUE_FULL_TIMEOUT = 0.1
+        message = 'x' * 65536
+        with self.assertRaises(Queue.Full):
+            # eventually fills the socket buffers, as the device never reads
+            for i in range(10000):
+                comm.write_message(message)
+        comm.close()
+
+    def test_connections_share_loop_thread(self):
+        threads = threading.active_count()
+        comms = [self._open(StandInDevice()) for i in range(3)]
+        # only the stand-in devices' threads are added
+        self.assertEqual(threading.active_count(), threads + 3)
+        for comm in comms:
+            comm.write_message('hello\r\n')
+            self.assertEqual(comm.read_message(), 'ack:hello')
+            comm.close()
+
+
+class TelemetryOnLoopTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = IoLoop()
+        self.loop.start()
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(1)
+
+    def tearDown(self):
+        self.server.close()
+        self.loop.stop(1.0)
+
+    def test_streams_on_loop(self):
+        statuses = []
+        metas = {'LoopTestRPM': ChannelMeta(name='LoopTestRPM', units='RPM', sampleRate=10)}
+        connection = TelemetryConnection('127.0.0.1', self.server.getsockname()[1], 'ABC123', metas, DataBus(),
+                                         lambda status, msg, code: statuses.append(code), None,
+                                         io_loop=self.loop)
+        connection.run()
+        self.assertTrue(connection.is_active())
+
+        client, address = self.server.accept()
+        client.settimeout(2.0)
+        stream = client.makefile()
+        self.assertIn('"auth"', stream.readline())
+        client.sendall('{"status":"ok"}\n')
+        self.assertIn('"meta"', stream.readline())
+
+        connection._on_sample({'LoopTestRPM': 5000})
+        line = stream.readline()
+        while '"meta"' in line:
+            line = stream.readline()
+        self.assertIn('"d":[5000,1]', line)
+        self.assertIn(TelemetryConnection.STATUS_STREAMING, statuses)
+
+        connection.end()
+        self.assertTrue(wait_for(lambda: not connection.is_active()))
+        client.close()
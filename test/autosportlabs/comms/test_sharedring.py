@@ -0,0 +1,88 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import multiprocessing
+from Queue import Empty, Full
+from autosportlabs.comms.sharedring import SharedRing
+
+
+def put_messages(ring, count):
+    for i in range(count):
+        ring.put('message {}'.format(i))
+
+
+class SharedRingTest(unittest.TestCase):
+
+    def test_put_get(self):
+        ring = SharedRing(64)
+        ring.put('hello')
+        ring.put('')
+        ring.put('binary\x00\xff')
+        self.assertEqual(ring.get(), 'hello')
+        self.assertEqual(ring.get(), '')
+        self.assertEqual(ring.get(), 'binary\x00\xff')
+        self.assertTrue(ring.empty())
+
+    def test_wraps(self):
+        ring = SharedRing(50)
+        for i in range(100):
+            message = str(i) * (i % 7)
+            ring.put(message, False)
+            ring.put('end', False)
+            self.assertEqual(ring.get(False), message)
+            self.assertEqual(ring.get(False), 'end')
+
+    def test_empty(self):
+        ring = SharedRing(64)
+        self.assertRaises(Empty, ring.get_nowait)
+        self.assertRaises(Empty, ring.get, True, 0.01)
+
+    def test_full(self):
+        ring = SharedRing(20)
+        ring.put('0123456789')
+        self.assertRaises(Full, ring.put_nowait, '0123456789')
+        self.assertRaises(Full, ring.put, '0123456789', True, 0.01)
+        self.assertEqual(ring.get(), '0123456789')
+        ring.put_nowait('0123456789')
+
+    def test_message_too_large(self):
+        ring = SharedRing(16)
+        self.assertRaises(ValueError, ring.put, 'x' * 13)
+
+    def test_between_processes(self):
+        # small enough that the producer repeatedly waits for the consumer
+        ring = SharedRing(256)
+        count = 2000
+        producer = multiprocessing.Process(target=put_messages, args=(ring, count))
+        producer.start()
+        try:
+            for i in range(count):
+                self.assertEqual(ring.get(True, 5.0), 'message {}'.format(i))
+        finally:
+            producer.join(5.0)
+        self.assertTrue(ring.empty())
+
+
+def main():
+    unittest.main()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Benchmark of configuration command sequences with a pipelined command window.
+A LoopbackDevice acknowledges each command after a simulated link latency;
+RcpApi runs a configuration read and an OBD2 channel write with each window size.
+
+Run from the project root:
+    python -m test.autosportlabs.racecapture.api.benchmark_cmdsequence
+"""
+
+import time
+from mock import Mock
+from autosportlabs.racecapture.api.rcpapi import RcpApi, RcpCmd
+from test.autosportlabs.racecapture.api.loopbackdevice import LoopbackDevice
+
+LATENCIES = [0.002, 0.015, 0.04]
+WINDOWS = [1, 2, 4, 8]
+OBD2_CHANNELS = 20
+
+
+def read_sequence(rc_api):
+    cmds = [RcpCmd('ver', rc_api.sendGetVersion),
+            RcpCmd('capabilities', rc_api.getCapabilities),
+            RcpCmd('analogCfg', rc_api.getAnalogCfg, None),
+            RcpCmd('imuCfg', rc_api.getImuCfg, None),
+            RcpCmd('gpsCfg', rc_api.getGpsCfg),
+            RcpCmd('lapCfg', rc_api.getLapCfg),
+            RcpCmd('trackCfg', rc_api.getTrackCfg),
+            RcpCmd('canCfg', rc_api.getCanCfg),
+            RcpCmd('obd2Cfg', rc_api.getObd2Cfg),
+            RcpCmd('connCfg', rc_api.getConnectivityCfg),
+            RcpCmd('scriptCfg', rc_api.getScript),
+            RcpCmd('trackDb', rc_api.getTrackDb)]
+    return cmds
+
+
+def write_sequence(rc_api):
+    cmds = []
+    pids = [{'pid': 12 + index} for index in range(OBD2_CHANNELS)]
+    rc_api.sequence_write_obd2_channels({'obd2Cfg': {'pids': pids, 'en': 1}}, cmds)
+    cmds.append(RcpCmd('flashCfg', rc_api.sendFlashConfig, barrier=True))
+    return cmds
+
+
+def measure(latency, window, sequence_factory):
+    device = LoopbackDevice(channel_count=4, frame_count=1, latency=latency, read_timeout=0.1)
+    rc_api = RcpApi(settings=Mock(), comms=device)
+    rc_api.command_window = window
+    rc_api._running.set()
+    rc_api._start_message_rx_worker()
+    try:
+        start = time.time()
+        rc_api._run_command_sequence(sequence_factory(rc_api))
+        return time.time() - start
+    finally:
+        rc_api._running.clear()
+        rc_api._msg_rx_thread.join()
+
+
+def run():
+    print '{:>10} {:>7} {:>10} {:>11}'.format('latency ms', 'window', 'read ms', 'write ms')
+    for latency in LATENCIES:
+        for window in WINDOWS:
+            read_time = measure(latency, window, read_sequence)
+            write_time = measure(latency, window, write_sequence)
+            print '{:>10.0f} {:>7} {:>10.0f} {:>11.0f}'.format(latency * 1000, window, read_time * 1000,
+                                                                write_time * 1000)
+
+
+if __name__ == '__main__':
+    run()
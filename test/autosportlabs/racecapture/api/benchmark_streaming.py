@@ -0,0 +1,78 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark of the sample receive path, JSON vs binary frames. A LoopbackDevice
+streams frames as fast as RcpApi.msg_rx_worker reads them; each frame is
+dispatched to a DataBusPump and decoded into the DataBus.
+
+Run from the project root:
+    python -m test.autosportlabs.racecapture.api.benchmark_streaming
+"""
+
+import json
+import time
+from mock import Mock
+from autosportlabs.racecapture.api.rcpapi import RcpApi, BINARY_SAMPLE_MSG
+from autosportlabs.racecapture.databus.databus import DataBus, DataBusPump
+from test.autosportlabs.racecapture.api.loopbackdevice import LoopbackDevice
+
+CHANNEL_COUNTS = [20, 60]
+FRAMES = 20000
+
+
+def measure(channel_count, binary):
+    device = LoopbackDevice(channel_count=channel_count)
+    rc_api = RcpApi(settings=Mock(), comms=device)
+    data_bus = DataBus()
+    pump = DataBusPump()
+    pump._data_bus = data_bus
+    pump._rc_api = rc_api
+    rc_api.addListener('s', pump.on_sample)
+    rc_api.addListener(BINARY_SAMPLE_MSG, pump.on_binary_sample)
+    try:
+        device.write_message(json.dumps({'setTelemetry': {'rate': 50, 'bin': 1 if binary else 0}}))
+        device.frame_limit = FRAMES
+        device.on_frame_limit = rc_api._running.clear
+        rc_api._running.set()
+        start = time.time()
+        rc_api.msg_rx_worker()
+        elapsed = time.time() - start
+        assert len(data_bus.channel_data) == channel_count
+        frames = device._binary_frames if binary else device._json_frames
+        frame_bytes = sum(len(frame) + len(RcpApi.COMMAND_DELIMETER) for frame in frames) / float(len(frames))
+        return device.frames_sent / elapsed, frame_bytes
+    finally:
+        rc_api.removeListener('s', pump.on_sample)
+        rc_api.removeListener(BINARY_SAMPLE_MSG, pump.on_binary_sample)
+
+
+def run():
+    print '{:>9} {:>14} {:>16} {:>9} {:>11} {:>13}'.format('channels', 'json frames/s', 'binary frames/s', 'speedup',
+                                                           'json bytes', 'binary bytes')
+    for channel_count in CHANNEL_COUNTS:
+        json_rate, json_bytes = measure(channel_count, False)
+        binary_rate, binary_bytes = measure(channel_count, True)
+        print '{:>9} {:>14.0f} {:>16.0f} {:>8.1f}x {:>11.0f} {:>13.0f}'.format(
+            channel_count, json_rate, binary_rate, binary_rate / json_rate, json_bytes, binary_bytes)
+
+
+if __name__ == '__main__':
+    run()
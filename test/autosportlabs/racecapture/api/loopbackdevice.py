@@ -0,0 +1,187 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Loopback RaceCapture device simulator, standing in for the comms object used by RcpApi.
+It answers setTelemetry and getMeta, streams samples as JSON or binary frames, and
+acknowledges other commands after a simulated link latency.
+"""
+
+import json
+import math
+import time
+from threading import Condition
+from collections import deque
+from autosportlabs.racecapture.data.channels import ChannelMeta, CHANNEL_TYPE_SENSOR, CHANNEL_TYPE_GPS, \
+    CHANNEL_TYPE_TIME
+from autosportlabs.racecapture.data.sampledata import BinarySampleCodec
+
+
+def create_meta_json(channel_count):
+    """
+    Channel meta for a simulated device: GPS and time channels followed by sensor channels
+    """
+    meta = [{'nm': 'Utc', 'ut': 'ms', 'min': 0, 'max': 0, 'prec': 0, 'sr': 50, 'type': CHANNEL_TYPE_TIME},
+            {'nm': 'Latitude', 'ut': 'Degrees', 'min': -180, 'max': 180, 'prec': 6, 'sr': 50, 'type': CHANNEL_TYPE_GPS},
+            {'nm': 'Longitude', 'ut': 'Degrees', 'min': -180, 'max': 180, 'prec': 6, 'sr': 50, 'type': CHANNEL_TYPE_GPS}]
+    for index in range(len(meta), channel_count):
+        meta.append({'nm': 'Sensor{}'.format(index), 'ut': '', 'min': 0, 'max': 1000, 'prec': 2, 'sr': 50,
+                     'type': CHANNEL_TYPE_SENSOR})
+    return meta
+
+
+def create_sample_values(meta_json, index):
+    values = {}
+    for channel_index, meta in enumerate(meta_json):
+        name = meta['nm']
+        if name == 'Utc':
+            values[name] = 1486502321000.0 + index * 20
+        elif name == 'Latitude':
+            values[name] = round(47.256164 + index * 0.000001, 6)
+        elif name == 'Longitude':
+            values[name] = round(-123.191297 - index * 0.000001, 6)
+        else:
+            values[name] = round(500.0 + 400.0 * math.sin(index * 0.01 + channel_index), 2)
+    return values
+
+
+def create_json_frame(meta_json, tick, values):
+    data = []
+    bitmasks = [0] * ((len(meta_json) - 1) / 32 + 1)
+    for index, meta in enumerate(meta_json):
+        value = values.get(meta['nm'])
+        if value is not None:
+            bitmasks[index / 32] |= 1 << (index % 32)
+            data.append(value)
+    return json.dumps({'s': {'t': tick, 'd': data + bitmasks}}, separators=(',', ':'))
+
+
+def create_command_reply(msg):
+    """
+    Reply for a command: getXyz commands reply with an empty xyz object,
+    everything else replies with a success code under the command name
+    """
+    name = msg.keys()[0]
+    if name.startswith('get'):
+        return {name[3].lower() + name[4:]: {}}
+    return {name: {'rc': 1}}
+
+
+class LoopbackDevice(object):
+    """
+    Streams a cycle of pre-built sample frames as fast as they are read.
+    Command replies are delivered latency seconds after the command is written.
+    """
+
+    def __init__(self, channel_count=40, frame_count=500, latency=0, read_timeout=1.0):
+        self.meta_json = create_meta_json(channel_count)
+        metas = []
+        for meta in self.meta_json:
+            channel_meta = ChannelMeta()
+            channel_meta.fromJson(meta)
+            metas.append(channel_meta)
+        codec = BinarySampleCodec(metas)
+
+        self.sample_values = [create_sample_values(self.meta_json, index) for index in range(frame_count)]
+        self._json_frames = [create_json_frame(self.meta_json, index, values)
+                             for index, values in enumerate(self.sample_values)]
+        self._binary_frames = [codec.encode(index, values) for index, values in enumerate(self.sample_values)]
+        self._pending = deque()
+        self._frame_index = 0
+        self.rate = 0
+        self.binary = False
+        self.frames_sent = 0
+        self.frame_limit = None
+        self.on_frame_limit = None
+        self.latency = latency
+        self.read_timeout = read_timeout
+        self.commands = []
+        # replies for specific commands, by command name, in place of the default reply
+        self.command_replies = {}
+        # optional callback(msg) returning False to drop the reply to a command
+        self.on_command = None
+        # optional callback(msg) returning (reply, latency) in place of the default reply
+        self.reply_factory = None
+        self._replies = deque()
+        self._replies_changed = Condition()
+
+    def isOpen(self):
+        return True
+
+    def is_wireless(self):
+        return False
+
+    def keep_alive(self):
+        pass
+
+    def write_message(self, message):
+        if message.strip() == '':
+            return
+        msg = json.loads(message)
+        if 'setTelemetry' in msg:
+            telemetry = msg['setTelemetry']
+            self.rate = telemetry.get('rate', 0)
+            self.binary = telemetry.get('bin', 0) == 1
+            self._pending.append(json.dumps({'s': {'t': 0, 'meta': self.meta_json}}))
+        elif 'getMeta' in msg:
+            self._pending.append(json.dumps({'meta': self.meta_json}))
+        else:
+            self.commands.append(msg)
+            if self.on_command is not None and self.on_command(msg) is False:
+                return
+            with self._replies_changed:
+                if self.reply_factory is not None:
+                    reply, latency = self.reply_factory(msg)
+                else:
+                    reply = self.command_replies.get(msg.keys()[0]) or create_command_reply(msg)
+                    latency = self.latency
+                # replies are delivered in order, so a slow reply holds back the ones after it
+                self._replies.append((time.time() + latency, json.dumps(reply)))
+                self._replies_changed.notify()
+
+    def _read_reply(self):
+        deadline = time.time() + self.read_timeout
+        with self._replies_changed:
+            while True:
+                now = time.time()
+                if len(self._replies) > 0 and self._replies[0][0] <= now:
+                    return self._replies.popleft()[1]
+                if now >= deadline:
+                    return None
+                wait = deadline - now
+                if len(self._replies) > 0:
+                    wait = min(wait, self._replies[0][0] - now)
+                self._replies_changed.wait(wait)
+
+    def read_message(self):
+        if len(self._pending) > 0:
+            return self._pending.popleft()
+        if self.rate == 0:
+            return self._read_reply()
+        if self.frame_limit is not None and self.frames_sent >= self.frame_limit:
+            if self.on_frame_limit is not None:
+                self.on_frame_limit()
+            return None
+
+        frames = self._binary_frames if self.binary else self._json_frames
+        frame = frames[self._frame_index]
+        self._frame_index = (self._frame_index + 1) % len(frames)
+        self.frames_sent += 1
+        return frame
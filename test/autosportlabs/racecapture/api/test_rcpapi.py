@@ -19,8 +19,16 @@
 # this code. If not, see <http://www.gnu.org/licenses/>.
 
 import unittest
+import os
+import shutil
+import tempfile
+import time
 from mock import Mock
-from autosportlabs.racecapture.api.rcpapi import RcpApi
+from kivy.clock import Clock
+from autosportlabs.racecapture.api.rcpapi import RcpApi, RcpCmd
+from autosportlabs.racecapture.config.rcpconfig import RcpConfig, VersionConfig
+from autosportlabs.racecapture.config.configcache import DeviceConfigCache
+from test.autosportlabs.racecapture.api.loopbackdevice import LoopbackDevice
 
 class TestRcpApi(unittest.TestCase):
     def setUp(self):
@@ -42,6 +50,170 @@ class TestRcpApi(unittest.TestCase):
         self.assertFalse(rcpapi.is_firmware_update_supported())
 
 
+class CommandSequenceTest(unittest.TestCase):
+    def setUp(self):
+        self.device = LoopbackDevice(channel_count=4, frame_count=1, latency=0.02, read_timeout=0.05)
+        self.rc_api = RcpApi(settings=Mock(), comms=self.device)
+        self.rc_api.msg_rx_timeout = 0.2
+        self.rc_api._running.set()
+        self.rc_api._start_message_rx_worker()
+
+    def tearDown(self):
+        self.rc_api._running.clear()
+        self.rc_api._msg_rx_thread.join()
+
+    def _get_commands(self):
+        api = self.rc_api
+        return [RcpCmd('ver', api.sendGetVersion),
+                RcpCmd('capabilities', api.getCapabilities),
+                RcpCmd('analogCfg', api.getAnalogCfg, None),
+                RcpCmd('imuCfg', api.getImuCfg, None),
+                RcpCmd('gpsCfg', api.getGpsCfg),
+                RcpCmd('lapCfg', api.getLapCfg),
+                RcpCmd('trackCfg', api.getTrackCfg),
+                RcpCmd('canCfg', api.getCanCfg),
+                RcpCmd('obd2Cfg', api.getObd2Cfg),
+                RcpCmd('connCfg', api.getConnectivityCfg)]
+
+    def _run(self, command_list, window):
+        self.rc_api.command_window = window
+        start = time.time()
+        replies = self.rc_api._run_command_sequence(command_list)
+        return replies, time.time() - start
+
+    def test_pipelined_replies_match_commands(self):
+        serial_replies, serial_time = self._run(self._get_commands(), 1)
+        pipelined_replies, pipelined_time = self._run(self._get_commands(), 8)
+        self.assertListEqual(serial_replies, pipelined_replies)
+        self.assertEqual(pipelined_replies[2], {'analogCfg': {}})
+        self.assertLess(pipelined_time, serial_time / 2)
+
+    def test_duplicate_names_match_in_order(self):
+        api = self.rc_api
+        commands = [RcpCmd('setScriptCfg', api.setScriptPage, 'page', index, 1) for index in range(5)]
+        replies, elapsed = self._run(commands, 4)
+        self.assertEqual(len(replies), 5)
+        self.assertListEqual([c['setScriptCfg']['page'] for c in self.device.commands], range(5))
+
+    def test_lost_reply_is_retried(self):
+        dropped = []
+
+        def drop_first_lap_cfg(msg):
+            if 'getLapCfg' in msg and len(dropped) == 0:
+                dropped.append(msg)
+                return False
+
+        self.device.on_command = drop_first_lap_cfg
+        replies, elapsed = self._run(self._get_commands(), 4)
+        self.assertEqual(len(dropped), 1)
+        self.assertEqual(replies[5], {'lapCfg': {}})
+        self.assertTrue(all(reply is not None for reply in replies))
+
+    def test_late_reply_matched_to_its_send(self):
+        api = self.rc_api
+        delayed = []
+
+        def reply_with_index(msg):
+            index = msg['getAnalogCfg']
+            latency = 0.02
+            if index == '0' and len(delayed) == 0:
+                # slower than the read retries, so the window is sent again
+                delayed.append(index)
+                latency = 0.5
+            return {'analogCfg': {index: {}}}, latency
+
+        self.device.reply_factory = reply_with_index
+        commands = [RcpCmd('analogCfg', api.getAnalogCfg, index) for index in range(6)]
+        replies, elapsed = self._run(commands, 3)
+        self.assertEqual(len(delayed), 1)
+        self.assertListEqual(replies, [{'analogCfg': {str(index): {}}} for index in range(6)])
+
+    def test_timeout_raises(self):
+        self.device.on_command = lambda msg: 'getGpsCfg' not in msg
+        self.rc_api.level_2_retries = 1
+        with self.assertRaises(Exception):
+            self._run(self._get_commands(), 4)
+        gps_sends = [c for c in self.device.commands if 'getGpsCfg' in c]
+        self.assertEqual(len(gps_sends), 2)
+
+    def test_barrier_waits_for_earlier_replies(self):
+        api = self.rc_api
+        commands = self._get_commands()
+        commands.append(RcpCmd('flashCfg', api.sendFlashConfig, barrier=True))
+        sent_while_outstanding = []
+        device = self.device
+
+        def check_outstanding(msg):
+            if 'flashCfg' in msg:
+                sent_while_outstanding.append(len(device._replies) > 0)
+
+        self.device.on_command = check_outstanding
+        replies, elapsed = self._run(commands, 8)
+        self.assertEqual(replies[-1], {'flashCfg': {'rc': 1}})
+        self.assertListEqual(sent_while_outstanding, [False])
+
+
+class ConfigCacheReadTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.device = LoopbackDevice(channel_count=4, frame_count=1, read_timeout=0.05)
+        self.device.command_replies = {
+            'getCapabilities': {'capabilities': {'flags': ['gps', 'cfghash'],
+                                                 'channels': {'analog': 0, 'imu': 0, 'gpio': 0, 'timer': 0,
+                                                              'pwm': 0, 'can': 0, 'obd2': 20},
+                                                 'db': {'script': 0, 'tracks': 240}}},
+            'getCfgHash': {'cfgHash': {'lapCfg': '1', 'trackCfg': '2', 'canCfg': '3', 'obd2Cfg': '4',
+                                       'connCfg': '5', 'trackDb': '6', 'gpsCfg': '7'}},
+            'getLapCfg': {'lapCfg': {'lapCount': {'sr': 1}}},
+            'getTrackCfg': {'trackCfg': {'rad': 42}}}
+        self.rc_api = RcpApi(settings=Mock(), comms=self.device,
+                             config_cache=DeviceConfigCache(self.cache_dir))
+        self.rc_api.connected_version = VersionConfig(major=2, minor=10, bugfix=0)
+        self.rc_api.connected_version.serial = '1234'
+        self.rc_api.msg_rx_timeout = 0.2
+        self.rc_api._running.set()
+        self.rc_api._start_message_rx_worker()
+        self.rc_api._start_cmd_sequence_worker()
+
+    def tearDown(self):
+        self.rc_api._running.clear()
+        self.rc_api._msg_rx_thread.join()
+        self.rc_api._cmd_sequence_thread.join()
+        shutil.rmtree(self.cache_dir)
+
+    def _read_config(self):
+        del self.device.commands[:]
+        result = []
+        cfg = RcpConfig()
+        self.rc_api.getRcpCfg(cfg, result.append, result.append)
+        deadline = time.time() + 5
+        while len(result) == 0 and time.time() < deadline:
+            Clock.tick()
+            time.sleep(0.01)
+        self.assertEqual(result, [cfg])
+        return cfg, [c.keys()[0] for c in self.device.commands]
+
+    def test_reads_changed_sections(self):
+        cfg, commands = self._read_config()
+        self.assertTrue('getTrackDb' in commands)
+        self.assertTrue('getLapCfg' in commands)
+
+        self.device.command_replies['getCfgHash'] = {'cfgHash': {'lapCfg': '8', 'trackCfg': '2', 'canCfg': '3',
+                                                                 'obd2Cfg': '4', 'connCfg': '5', 'trackDb': '6',
+                                                                 'gpsCfg': '7'}}
+        cfg, commands = self._read_config()
+        self.assertListEqual(commands, ['getCapabilities', 'getCfgHash', 'getVer', 'getCapabilities', 'getLapCfg'])
+        self.assertEqual(cfg.lapConfig.lapCount.sampleRate, 1)
+        self.assertEqual(cfg.trackConfig.radius, 42)
+
+    def test_full_read_without_hash_support(self):
+        self.device.command_replies['getCapabilities']['capabilities']['flags'] = ['gps']
+        self._read_config()
+        cfg, commands = self._read_config()
+        self.assertFalse('getCfgHash' in commands)
+        self.assertTrue('getTrackDb' in commands)
+
+
 def main():
     unittest.main()
 
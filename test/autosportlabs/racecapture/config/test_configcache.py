@@ -0,0 +1,66 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+
+import unittest
+import os
+import shutil
+import tempfile
+from autosportlabs.racecapture.config.configcache import DeviceConfigCache
+
+LAP_CFG = {'lapCount': {'sr': 1}}
+TRACK_DB = {'size': 1, 'tracks': [{'id': 1234}]}
+
+
+class DeviceConfigCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = DeviceConfigCache(os.path.join(self.cache_dir, DeviceConfigCache.CACHE_SUBDIR))
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_empty_cache(self):
+        self.assertEqual(self.cache.load('1234', {'lapCfg': 'a'}), {})
+
+    def test_load_unchanged_sections(self):
+        self.cache.store('1234', {'lapCfg': 'a', 'trackDb': 'b'}, {'lapCfg': LAP_CFG, 'trackDb': TRACK_DB})
+        self.assertEqual(self.cache.load('1234', {'lapCfg': 'a', 'trackDb': 'b'}),
+                         {'lapCfg': LAP_CFG, 'trackDb': TRACK_DB})
+        self.assertEqual(self.cache.load('1234', {'lapCfg': 'a', 'trackDb': 'c'}), {'lapCfg': LAP_CFG})
+        self.assertEqual(self.cache.load('5678', {'lapCfg': 'a'}), {})
+
+    def test_store_merges_unchanged_sections(self):
+        self.cache.store('1234', {'lapCfg': 'a', 'trackDb': 'b'}, {'lapCfg': LAP_CFG, 'trackDb': TRACK_DB})
+        new_lap_cfg = {'lapCount': {'sr': 5}}
+        self.cache.store('1234', {'lapCfg': 'c', 'trackDb': 'b'}, {'lapCfg': new_lap_cfg})
+        self.assertEqual(self.cache.load('1234', {'lapCfg': 'c', 'trackDb': 'b'}),
+                         {'lapCfg': new_lap_cfg, 'trackDb': TRACK_DB})
+
+    def test_sections_without_hash_are_not_cached(self):
+        self.cache.store('1234', {'lapCfg': 'a'}, {'lapCfg': LAP_CFG, 'ver': {'major': 2}})
+        self.assertEqual(self.cache.load('1234', {'lapCfg': 'a', 'ver': None}), {'lapCfg': LAP_CFG})
+
+    def test_unreadable_cache(self):
+        self.cache.store('1234', {'lapCfg': 'a'}, {'lapCfg': LAP_CFG})
+        with open(self.cache._get_path('1234'), 'w') as cache_file:
+            cache_file.write('{"sect')
+        self.assertEqual(self.cache.load('1234', {'lapCfg': 'a'}), {})
@@ -0,0 +1,111 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+
+import unittest
+import os
+from autosportlabs.racecapture.config.rcpconfig import RcpConfig, PidConfig
+from autosportlabs.racecapture.config.configdiff import ConfigSnapshot, build_write_plan
+
+fqp = os.path.dirname(os.path.realpath(__file__))
+config_path = os.path.join(fqp, '..', '..', '..', 'test_scripts', 'lap_simulation.rcp')
+
+
+class WritePlanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config = RcpConfig()
+        with open(config_path) as config_file:
+            self.config.fromJsonString(config_file.read())
+        del self.config.obd2Config.pids[:]
+        for pid in range(3):
+            pid_config = PidConfig()
+            pid_config.pid = 12 + pid
+            self.config.obd2Config.pids.append(pid_config)
+        self.snapshot = ConfigSnapshot.from_config(self.config)
+
+    def _names(self, plan):
+        return [c.name for c in plan.commands]
+
+    def test_full_write_without_snapshot(self):
+        self.config.stale = True
+        plan = build_write_plan(self.config)
+        self.assertEqual(plan.commands_saved, 0)
+        self.assertEqual(plan.bytes_saved, 0)
+        self.assertEqual(self._names(plan)[-1], 'flashCfg')
+        self.assertEqual(self._names(plan).count('setAnalogCfg'), 8)
+        self.assertEqual(self._names(plan).count('setScriptCfg'), 6)
+        self.assertEqual(self._names(plan).count('setObd2Cfg'), 3)
+
+    def test_unchanged_config_writes_nothing(self):
+        self.config.stale = True
+        plan = build_write_plan(self.config, self.snapshot)
+        full_plan = build_write_plan(self.config)
+        self.assertListEqual(plan.commands, [])
+        self.assertEqual(plan.commands_saved, full_plan.command_count)
+        self.assertEqual(plan.bytes_saved, full_plan.bytes)
+
+    def test_changed_channel(self):
+        channel = self.config.analogConfig.channels[2]
+        channel.sampleRate = 50 if channel.sampleRate != 50 else 25
+        channel.stale = True
+        plan = build_write_plan(self.config, self.snapshot)
+        self.assertListEqual(self._names(plan), ['setAnalogCfg', 'flashCfg'])
+        self.assertListEqual(plan.commands[0].msg['setAnalogCfg'].keys(), ['2'])
+
+    def test_stale_but_unchanged_is_skipped(self):
+        self.config.gpsConfig.stale = True
+        plan = build_write_plan(self.config, self.snapshot)
+        self.assertListEqual(plan.commands, [])
+        self.assertEqual(plan.commands_saved, 2)
+
+    def test_script_page_change_skips_flash(self):
+        script = self.config.scriptConfig.script
+        self.config.scriptConfig.script = script[:300] + 'x' + script[301:]
+        self.config.scriptConfig.stale = True
+        plan = build_write_plan(self.config, self.snapshot)
+        self.assertListEqual(self._names(plan), ['setScriptCfg', 'setScriptCfg'])
+        self.assertListEqual([c.msg['setScriptCfg']['page'] for c in plan.commands], [1, 5])
+        self.assertListEqual([c.msg['setScriptCfg']['mode'] for c in plan.commands], [1, 2])
+        self.assertTrue(plan.commands[-1].barrier)
+
+    def test_removed_obd2_pid(self):
+        del self.config.obd2Config.pids[-1]
+        self.config.obd2Config.stale = True
+        plan = build_write_plan(self.config, self.snapshot)
+        self.assertListEqual(self._names(plan), ['setObd2Cfg', 'flashCfg'])
+        payload = plan.commands[0].msg['setObd2Cfg']
+        self.assertEqual(payload['index'], 1)
+        self.assertTrue(payload['last'])
+
+    def test_changed_obd2_pid(self):
+        self.config.obd2Config.pids[0].pid = 99
+        self.config.obd2Config.stale = True
+        plan = build_write_plan(self.config, self.snapshot)
+        self.assertListEqual([c.msg['setObd2Cfg']['index'] for c in plan.commands[:-1]], [0, 2])
+        self.assertFalse('last' in plan.commands[0].msg['setObd2Cfg'])
+
+    def test_written_values_update_snapshot(self):
+        self.config.lapConfig.stale = True
+        self.config.lapConfig.lapCount.sampleRate = 1 if self.config.lapConfig.lapCount.sampleRate != 1 else 5
+        plan = build_write_plan(self.config, self.snapshot)
+        self.assertListEqual(self._names(plan), ['setLapCfg', 'flashCfg'])
+        snapshot = self.snapshot.updated(plan.written_values)
+        self.assertListEqual(build_write_plan(self.config, snapshot).commands, [])
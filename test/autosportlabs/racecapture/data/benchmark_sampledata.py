@@ -0,0 +1,112 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Micro-benchmark comparing the per-bit SampleValue decoding path against the
+compiled SampleDecoder, including the copy into the DataBus channel data.
+
+Run from the project root:
+    python -m test.autosportlabs.racecapture.data.benchmark_sampledata
+"""
+
+import timeit
+from autosportlabs.racecapture.data.channels import ChannelMeta
+from autosportlabs.racecapture.data.sampledata import SampleDecoder, SampleValue
+
+CHANNEL_COUNTS = [20, 100]
+SAMPLES = 5000
+REPEAT = 5
+
+
+def reference_decode(metas, data, samples):
+    """
+    The previous Sample.processData loop, one SampleValue per channel present
+    """
+    channel_count = len(metas)
+    bitmask_field_count = max(0, (channel_count - 1) / 32) + 1
+    bitmask_fields = [int(data[i]) for i in range(len(data) - bitmask_field_count, len(data))]
+    del samples[:]
+    channel_index = 0
+    bitmap_index = 0
+    field_index = 0
+    mask_index = 0
+    while channel_index < channel_count:
+        if mask_index >= 32:
+            mask_index = 0
+            bitmap_index += 1
+        if (bitmask_fields[bitmap_index] & (1 << mask_index)) != 0:
+            samples.append(SampleValue(float(data[field_index]), metas[channel_index]))
+            field_index += 1
+        channel_index += 1
+        mask_index += 1
+
+
+def create_packets(metas):
+    """
+    Every channel in the first packet, then alternating channels present
+    """
+    channel_count = len(metas)
+    bitmask_field_count = (channel_count - 1) / 32 + 1
+    packets = []
+    for packet_index in range(2):
+        bitmasks = [0] * bitmask_field_count
+        values = []
+        for index in range(channel_count):
+            if packet_index == 0 or index % 2 == 0:
+                bitmasks[index / 32] |= 1 << (index % 32)
+                values.append(index * 1.5)
+        packets.append(values + bitmasks)
+    return packets
+
+
+def run():
+    print '{:>9} {:>14} {:>12} {:>9}'.format('channels', 'reference ms', 'compiled ms', 'speedup')
+    for channel_count in CHANNEL_COUNTS:
+        metas = [ChannelMeta(name='Channel{}'.format(i)) for i in range(channel_count)]
+        packets = create_packets(metas)
+        decoder = SampleDecoder(metas)
+        channel_data = {}
+        samples = []
+        values = {}
+
+        for packet in packets:
+            reference_decode(metas, packet, samples)
+            decoder.decode(packet, values)
+            assert values == dict((s.channelMeta.name, s.value) for s in samples)
+
+        def reference():
+            for i in xrange(SAMPLES):
+                reference_decode(metas, packets[i % 2], samples)
+                for sample in samples:
+                    channel_data[sample.channelMeta.name] = sample.value
+
+        def compiled():
+            for i in xrange(SAMPLES):
+                decoder.decode(packets[i % 2], values)
+                channel_data.update(values)
+
+        reference_time = min(timeit.repeat(reference, number=1, repeat=REPEAT))
+        compiled_time = min(timeit.repeat(compiled, number=1, repeat=REPEAT))
+        print '{:>9} {:>14.2f} {:>12.2f} {:>8.1f}x'.format(channel_count, reference_time * 1000.0,
+                                                         compiled_time * 1000.0, reference_time / compiled_time)
+
+
+if __name__ == '__main__':
+    run()
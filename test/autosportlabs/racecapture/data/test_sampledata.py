@@ -20,7 +20,10 @@
 
 import unittest
 import json
-from autosportlabs.racecapture.data.sampledata import Sample
+from autosportlabs.racecapture.data.channels import ChannelMeta
+from autosportlabs.racecapture.data.sampledata import Sample, SampleMetaException, BinarySampleCodec, \
+    BinarySampleException, BINARY_SAMPLE_MARKER
+from test.autosportlabs.racecapture.api.loopbackdevice import LoopbackDevice
 
 TEST_SAMPLE1 = '{"s":{"t":33,"meta":[{"nm":"Battery","ut":"Volts","sr":1},{"nm":"AccelX","ut":"G","sr":25},{"nm":"AccelY","ut":"G","sr":25},{"nm":"AccelZ","ut":"G","sr":25},{"nm":"Yaw","ut":"Deg/Sec","sr":25},{"nm":"Latitude","ut":"Degrees","sr":50},{"nm":"Longitude","ut":"Degrees","sr":50},{"nm":"Speed","ut":"MPH","sr":50},{"nm":"Time","ut":"","sr":50},{"nm":"Distance","ut":"Miles","sr":50},{"nm":"LapCount","ut":"Count","sr":1},{"nm":"LapTime","ut":"Min","sr":1},{"nm":"Sector","ut":"Count","sr":1},{"nm":"SectorTime","ut":"Min","sr":1}],"d":[0.00,2.50,2.50,-2.50,397.0,0.000000,0.000000,0.00,0.000000,0.000,0,0.0000,0,0.0000,16383]}}'
 
@@ -55,7 +58,101 @@ class SampleDataTest(unittest.TestCase):
     
     def test_meta_data(self):
         pass
+
+    def test_sparse_sample_data(self):
+        # 40 channels need two bitmask fields; only some channels are present
+        meta = [{'nm': 'Ch{}'.format(i), 'ut': '', 'sr': 10} for i in range(40)]
+        present = [0, 5, 31, 32, 39]
+        bitmask1 = sum(1 << i for i in present if i < 32)
+        bitmask2 = sum(1 << (i - 32) for i in present if i >= 32)
+        data = [float(i) for i in present] + [bitmask1, bitmask2]
+
+        sample = Sample()
+        sample.fromJson({'s': {'t': 1, 'meta': meta, 'd': data}})
+        self.assertEqual(dict(('Ch{}'.format(i), float(i)) for i in present), sample.values)
+        self.assertListEqual(['Ch{}'.format(i) for i in present], [s.channelMeta.name for s in sample.samples])
+
+        # the next packet reuses the decoder and replaces the previous values
+        sample.fromJson({'s': {'t': 2, 'd': [1.5, 1, 0]}})
+        self.assertEqual({'Ch0': 1.5}, sample.values)
+        self.assertEqual(1, len(sample.samples))
+
+        with self.assertRaises(SampleMetaException):
+            sample.fromJson({'s': {'t': 3, 'd': [1.0] * 43}})
+
+    def test_meta_change(self):
+        sample = Sample()
+        sample.fromJson({'s': {'t': 1, 'meta': [{'nm': 'RPM', 'ut': '', 'sr': 10}], 'd': [1000, 1]}})
+        self.assertEqual({'RPM': 1000}, sample.values)
+
+        sample.metas.fromJson([{'nm': 'Speed', 'ut': '', 'sr': 10}])
+        sample.fromJson({'s': {'t': 2, 'd': [50, 1]}})
+        self.assertEqual({'Speed': 50}, sample.values)
         
+class BinarySampleTest(unittest.TestCase):
+
+    def _create_metas(self, meta_json):
+        metas = []
+        for meta in meta_json:
+            channel_meta = ChannelMeta()
+            channel_meta.fromJson(meta)
+            metas.append(channel_meta)
+        return metas
+
+    def test_round_trip(self):
+        device = LoopbackDevice(channel_count=40, frame_count=10)
+        codec = BinarySampleCodec(self._create_metas(device.meta_json))
+        values = {}
+        for tick, expected in enumerate(device.sample_values):
+            frame = codec.encode(tick, expected)
+            self.assertTrue(frame.startswith(BINARY_SAMPLE_MARKER))
+            self.assertEqual(tick, codec.decode(frame, values))
+            # GPS and time channels are packed as float64 and survive exactly
+            for name in ['Utc', 'Latitude', 'Longitude']:
+                self.assertEqual(expected[name], values[name])
+            for name, value in expected.iteritems():
+                self.assertAlmostEqual(value, values[name], places=3)
+
+    def test_missing_channels(self):
+        codec = BinarySampleCodec([ChannelMeta(name='RPM', max=10000), ChannelMeta(name='Speed', max=200)])
+        values = {}
+        codec.decode(codec.encode(1, {'Speed': 50}), values)
+        self.assertEqual({'Speed': 50}, values)
+
+    def test_corrupt_frame(self):
+        codec = BinarySampleCodec([ChannelMeta(name='RPM', max=10000)])
+        frame = codec.encode(1, {'RPM': 1000})
+        corrupt = frame[:-8] + ('A' if frame[-8] != 'A' else 'B') + frame[-7:]
+        with self.assertRaises(BinarySampleException):
+            codec.decode(corrupt, {})
+        with self.assertRaises(BinarySampleException):
+            codec.decode(BINARY_SAMPLE_MARKER + 'not base64', {})
+
+    def test_meta_mismatch(self):
+        frame = BinarySampleCodec([ChannelMeta(name='RPM'), ChannelMeta(name='Speed')]).encode(1, {'RPM': 1})
+        with self.assertRaises(SampleMetaException):
+            BinarySampleCodec([ChannelMeta(name='RPM')]).decode(frame, {})
+
+    def test_loopback_json_and_binary(self):
+        device = LoopbackDevice(channel_count=40, frame_count=20)
+        device.write_message(json.dumps({'setTelemetry': {'rate': 50}}))
+        json_sample = Sample()
+        json_sample.fromJson(json.loads(device.read_message()))
+        json_values = []
+        for i in range(20):
+            json_sample.fromJson(json.loads(device.read_message()))
+            json_values.append(dict(json_sample.values))
+
+        device.write_message(json.dumps({'setTelemetry': {'rate': 50, 'bin': 1}}))
+        binary_sample = Sample()
+        binary_sample.fromJson(json.loads(device.read_message()))
+        for expected in json_values:
+            binary_sample.fromBinary(device.read_message())
+            self.assertEqual(sorted(expected.keys()), sorted(binary_sample.values.keys()))
+            for name, value in expected.iteritems():
+                self.assertAlmostEqual(value, binary_sample.values[name], places=3)
+
+
 def main():
     unittest.main()
 
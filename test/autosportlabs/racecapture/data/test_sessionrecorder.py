@@ -19,6 +19,7 @@
 # this code. If not, see <http://www.gnu.org/licenses/>.
 
 import unittest
+import threading
 from mock import Mock, patch
 from autosportlabs.racecapture.data.sessionrecorder import SessionRecorder
 import Queue
@@ -193,6 +194,63 @@ class TestSessionRecorder(unittest.TestCase):
                 "Session recorder is restoring max sample rate" )
         
 
+    def test_writes_samples_in_batches(self):
+        session_recorder = SessionRecorder(self.mock_datastore, self.mock_databus, self.mock_rcp_api,
+                                           self.mock_settings, self.mock_track_manager, self.mock_status_pump)
+
+        q = session_recorder._sample_queue
+        sample_count = SessionRecorder.SAMPLE_QUEUE_UNCOMMITTED_INSERT_LIMIT + 3
+        for i in range(sample_count):
+            q.put({'v': i})
+
+        # already stopped, so the worker drains the queue, finalizes the session and exits
+        stopped = threading.Event()
+        stopped.set()
+        with patch('autosportlabs.racecapture.data.sessionrecorder.Clock.schedule_once'):
+            session_recorder._session_recorder_worker(1, q, session_recorder.write_stats, stopped)
+        self.mock_datastore.finalize_session.assert_called_once_with(1)
+
+        written = []
+        for call in self.mock_datastore.insert_samples.call_args_list:
+            batch, session_id = call[0]
+            self.assertEqual(session_id, 1)
+            self.assertTrue(len(batch) <= SessionRecorder.SAMPLE_QUEUE_UNCOMMITTED_INSERT_LIMIT)
+            written.extend(batch)
+
+        self.assertListEqual(written, [{'v': i} for i in range(sample_count)])
+        stats = session_recorder.write_stats
+        self.assertEqual(stats.samples_written, sample_count)
+        self.assertEqual(stats.batches_written, len(self.mock_datastore.insert_samples.call_args_list))
+
+    def test_finalizes_on_worker_thread(self):
+        self.mock_databus.getMeta = Mock(return_value={"foo": "bar"})
+        finalized = []
+        self.mock_datastore.finalize_session = Mock(
+            side_effect=lambda session_id: finalized.append(threading.current_thread()))
+        session_recorder = SessionRecorder(self.mock_datastore, self.mock_databus, self.mock_rcp_api,
+                                           self.mock_settings, self.mock_track_manager, self.mock_status_pump, stop_delay=0)
+        on_recording = Mock()
+        session_recorder.bind(on_recording=on_recording)
+
+        session_recorder.on_view_change('dash')
+        connect_listener = self.mock_rcp_api.add_connect_listener.call_args[0][0]
+        connect_listener()
+        self.assertTrue(session_recorder.recording)
+        worker = session_recorder._recorder_thread
+
+        with patch('autosportlabs.racecapture.data.sessionrecorder.Clock.schedule_once') as mock_schedule_once:
+            session_recorder.on_view_change('analysis')
+            self.assertFalse(session_recorder.recording)
+            worker.join(5)
+            self.assertFalse(worker.is_alive())
+
+        self.assertListEqual(finalized, [worker])
+        # on_recording(False) is dispatched on the UI thread once the session is finalized
+        self.assertEqual(on_recording.call_args[0][1], True)
+        mock_schedule_once.call_args[0][0](0)
+        self.assertEqual(on_recording.call_args[0][1], False)
+
+
 def main():
     unittest.main()
 
@@ -0,0 +1,88 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Benchmark of DataBus.notify_listeners with a dashboard-sized listener set. Each tick
+a sample arrives in which a fraction of the channels changed value.
+
+Run from the project root:
+    python -m test.autosportlabs.racecapture.databus.benchmark_databus
+"""
+
+import time
+from autosportlabs.racecapture.databus.databus import DataBus
+from autosportlabs.racecapture.data.sampledata import Sample
+
+CHANNEL_COUNT = 100
+LISTENERS_PER_CHANNEL = 4
+TICKS = 5000
+CHANGED_FRACTIONS = [0.05, 0.25, 1.0]
+
+
+class Gauge(object):
+    def __init__(self):
+        self.value = None
+
+    def set_value(self, value):
+        self.value = value
+
+
+def measure(changed_fraction):
+    data_bus = DataBus()
+    data_bus.channel_data.clear()
+    data_bus.channel_listeners.clear()
+    names = ['Channel{}'.format(i) for i in range(CHANNEL_COUNT)]
+    gauges = []
+    for name in names:
+        for i in range(LISTENERS_PER_CHANNEL):
+            gauge = Gauge()
+            gauges.append(gauge)
+            data_bus.addChannelListener(name, gauge.set_value)
+
+    changed_count = max(1, int(CHANNEL_COUNT * changed_fraction))
+    values = dict((name, 0.0) for name in names)
+    sample = Sample()
+    start = time.time()
+    start_notifications = data_bus.notification_count
+    for tick in range(TICKS):
+        for index in range(changed_count):
+            name = names[(tick * changed_count + index) % CHANNEL_COUNT]
+            values[name] = float(tick)
+        sample.values = dict(values)
+        data_bus.update_samples(sample)
+        data_bus.notify_listeners(None)
+    elapsed = time.time() - start
+    notifications = data_bus.notification_count - start_notifications
+    # every listener of every channel, every tick, as notified before change tracking
+    all_notifications = TICKS * CHANNEL_COUNT * LISTENERS_PER_CHANNEL
+    return elapsed / TICKS * 1000000, notifications / float(TICKS), all_notifications / float(TICKS)
+
+
+def run():
+    print '{:>8} {:>12} {:>20} {:>18}'.format('changed', 'us per tick', 'notifications/tick', 'before/tick')
+    for fraction in CHANGED_FRACTIONS:
+        tick_us, notifications, all_notifications = measure(fraction)
+        print '{:>7.0f}% {:>12.0f} {:>20.0f} {:>18.0f}'.format(fraction * 100, tick_us, notifications,
+                                                              all_notifications)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,126 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from autosportlabs.racecapture.databus.filter.pipeline import FilterPipeline
+from autosportlabs.racecapture.databus.filter.bestlapfilter import BestLapFilter
+from autosportlabs.racecapture.databus.filter.laptimedeltafilter import LaptimeDeltaFilter
+from autosportlabs.racecapture.databus.filter.computedchannel import ComputedChannel
+from autosportlabs.racecapture.data.channels import SystemChannels
+
+
+class CountingFilter(object):
+    def __init__(self, inputs=None, outputs=None):
+        if inputs is not None:
+            self.inputs = inputs
+        if outputs is not None:
+            self.outputs = outputs
+        self.count = 0
+
+    def filter(self, channel_data):
+        self.count += 1
+
+
+class FilterPipelineTest(unittest.TestCase):
+    system_channels = SystemChannels()
+
+    def test_dependency_order(self):
+        pipeline = FilterPipeline()
+        delta_filter = LaptimeDeltaFilter(self.system_channels)
+        best_lap_filter = BestLapFilter(self.system_channels)
+        # added in the wrong order; LapDelta reads BestLap
+        pipeline.add(delta_filter)
+        pipeline.add(best_lap_filter)
+        self.assertEqual(pipeline.filters, [best_lap_filter, delta_filter])
+
+        channel_data = {'LapTime': 2.0, 'PredTime': 2.1}
+        changed = pipeline.run(channel_data, ['LapTime', 'PredTime'])
+        self.assertEqual(changed, ['BestLap', 'LapDelta'])
+        self.assertEqual(channel_data['BestLap'], 2.0)
+        self.assertAlmostEqual(channel_data['LapDelta'], 6.0)
+
+    def test_only_run_when_inputs_change(self):
+        pipeline = FilterPipeline()
+        f = CountingFilter(inputs=('Yaw',))
+        pipeline.add(f)
+        pipeline.run({}, ['Pitch'])
+        self.assertEqual(f.count, 0)
+        pipeline.run({}, ['Pitch', 'Yaw'])
+        self.assertEqual(f.count, 1)
+
+    def test_undeclared_inputs_always_run(self):
+        pipeline = FilterPipeline()
+        f = CountingFilter()
+        pipeline.add(f)
+        pipeline.run({}, [])
+        self.assertEqual(f.count, 1)
+
+    def test_failing_filter_is_skipped(self):
+        pipeline = FilterPipeline()
+        pipeline.add(ComputedChannel('WheelSlip', ['WheelSpeed', 'GpsSpeed'], lambda wheel, gps: wheel / gps))
+        pipeline.add(ComputedChannel('Speed2', ['GpsSpeed'], lambda speed: speed * 2))
+        channel_data = {'WheelSpeed': 10.0, 'GpsSpeed': 0.0}
+        self.assertEqual(pipeline.run(channel_data, ['WheelSpeed', 'GpsSpeed']), ['Speed2'])
+        self.assertNotIn('WheelSlip', channel_data)
+        channel_data['GpsSpeed'] = 5.0
+        self.assertEqual(pipeline.run(channel_data, ['GpsSpeed']), ['WheelSlip', 'Speed2'])
+        self.assertEqual(channel_data['WheelSlip'], 2.0)
+
+    def test_unchanged_output_not_reported(self):
+        pipeline = FilterPipeline()
+        pipeline.add(ComputedChannel('Speed2', ['Speed'], lambda speed: speed * 2))
+        channel_data = {'Speed': 10}
+        self.assertEqual(pipeline.run(channel_data, ['Speed']), ['Speed2'])
+        self.assertEqual(pipeline.run(channel_data, ['Speed']), [])
+        channel_data['Speed'] = 11
+        self.assertEqual(pipeline.run(channel_data, ['Speed']), ['Speed2'])
+        self.assertEqual(channel_data['Speed2'], 22)
+
+    def test_chained_computed_channels(self):
+        pipeline = FilterPipeline()
+        pipeline.add(ComputedChannel('C', ['B'], lambda b: b + 1))
+        pipeline.add(ComputedChannel('B', ['A'], lambda a: a + 1))
+        channel_data = {'A': 1}
+        self.assertEqual(pipeline.run(channel_data, ['A']), ['B', 'C'])
+        self.assertEqual(channel_data['C'], 3)
+
+    def test_missing_input_skips_computed_channel(self):
+        pipeline = FilterPipeline()
+        pipeline.add(ComputedChannel('Slip', ['WheelSpeed', 'Speed'], lambda w, s: w / s))
+        channel_data = {'WheelSpeed': 10.0}
+        self.assertEqual(pipeline.run(channel_data, ['WheelSpeed']), [])
+        self.assertFalse('Slip' in channel_data)
+
+    def test_circular_dependency(self):
+        pipeline = FilterPipeline()
+        a = CountingFilter(inputs=('B',), outputs=('A',))
+        b = CountingFilter(inputs=('A',), outputs=('B',))
+        pipeline.add(a)
+        pipeline.add(b)
+        self.assertEqual(pipeline.filters, [a, b])
+
+    def test_remove(self):
+        pipeline = FilterPipeline()
+        f = CountingFilter()
+        pipeline.add(f)
+        pipeline.remove(f)
+        pipeline.run({}, [])
+        self.assertEqual(f.count, 0)
+        self.assertEqual(pipeline.filters, [])
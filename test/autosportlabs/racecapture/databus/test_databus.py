@@ -19,9 +19,13 @@
 # this code. If not, see <http://www.gnu.org/licenses/>.
 
 import unittest
-from autosportlabs.racecapture.databus.databus import DataBus
+import time
+from threading import Thread, Event
+from mock import patch
+from autosportlabs.racecapture.databus.databus import DataBus, DataBusPump
+from autosportlabs.racecapture.api.rcpapi import BINARY_SAMPLE_MSG
 from autosportlabs.racecapture.data.sampledata import Sample, ChannelMeta, SampleValue,\
-	ChannelMetaCollection
+	ChannelMetaCollection, BinarySampleCodec
 
 class DataBusTest(unittest.TestCase):
 	def test_update_value(self):
@@ -140,7 +144,209 @@ class DataBusTest(unittest.TestCase):
 		dataBus.update_channel_meta(metas)
 		dataBus.notify_listeners(None)
 		self.assertEqual(self.channelMeta['RPM'], metas.channel_metas[0])
-		
+
+	def test_binary_sample(self):
+		dataBus = DataBus()
+		pump = DataBusPump()
+		pump._data_bus = dataBus
+		pump.sample.metas.fromJson([{'nm': 'RPM', 'max': 10000}, {'nm': 'EngineTemp', 'max': 300}])
+		dataBus.update_channel_meta(pump.sample.metas)
+
+		frame = BinarySampleCodec(pump.sample.metas.channel_metas).encode(1, {'RPM': 4321, 'EngineTemp': 190})
+		pump.on_binary_sample({BINARY_SAMPLE_MSG: frame}, None)
+		dataBus.notify_listeners(None)
+		self.assertEqual(dataBus.getData('RPM'), 4321)
+		self.assertEqual(dataBus.getData('EngineTemp'), 190)
+
+	def _sample(self, values):
+		sample = Sample()
+		metas = [ChannelMeta(name=name) for name in values.keys()]
+		sample.channel_metas = metas
+		sample.samples = [SampleValue(values[meta.name], meta) for meta in metas]
+		return sample
+
+	def test_unchanged_channel_not_renotified(self):
+		calls = []
+		dataBus = DataBus()
+		dataBus.addChannelListener('OilPress', calls.append)
+		dataBus.update_samples(self._sample({'OilPress': 55}))
+		dataBus.notify_listeners(None)
+		dataBus.update_samples(self._sample({'OilPress': 55}))
+		dataBus.notify_listeners(None)
+		dataBus.notify_listeners(None)
+		self.assertEqual(calls, [55])
+
+		dataBus.update_samples(self._sample({'OilPress': 56}))
+		dataBus.notify_listeners(None)
+		self.assertEqual(calls, [55, 56])
+
+	def test_new_listener_gets_current_value(self):
+		calls = []
+		dataBus = DataBus()
+		dataBus.update_samples(self._sample({'FuelLevel': 40}))
+		dataBus.notify_listeners(None)
+		dataBus.addChannelListener('FuelLevel', calls.append)
+		dataBus.notify_listeners(None)
+		dataBus.notify_listeners(None)
+		self.assertEqual(calls, [40])
+
+	def test_sample_listener_on_change(self):
+		calls = []
+		dataBus = DataBus()
+		dataBus.add_sample_listener(calls.append)
+		try:
+			dataBus.update_samples(self._sample({'Boost': 10}))
+			dataBus.notify_listeners(None)
+			dataBus.notify_listeners(None)
+			self.assertEqual(len(calls), 1)
+			dataBus.update_samples(self._sample({'Boost': 11}))
+			dataBus.notify_listeners(None)
+			self.assertEqual(len(calls), 2)
+		finally:
+			dataBus.remove_sample_listener(calls.append)
+
+	@patch('autosportlabs.racecapture.databus.databus.time')
+	def test_rate_limited_listener(self, mock_time):
+		calls = []
+		dataBus = DataBus()
+		dataBus.addChannelListener('Yaw', calls.append, max_rate=10)
+		for tick in range(10):
+			mock_time.return_value = tick * 0.02
+			dataBus.update_samples(self._sample({'Yaw': tick}))
+			dataBus.notify_listeners(None)
+		# called on the first tick, then again once 0.1s has passed
+		self.assertEqual(calls, [0, 5])
+
+		# the held value is delivered once the interval passes, without a new change
+		mock_time.return_value = 0.2
+		dataBus.notify_listeners(None)
+		self.assertEqual(calls, [0, 5, 9])
+		dataBus.removeChannelListener('Yaw', calls.append)
+
+	@patch('autosportlabs.racecapture.databus.databus.time')
+	def test_notification_stats(self, mock_time):
+		listener_calls = []
+		dataBus = DataBus()
+		dataBus.addChannelListener('Pitch', listener_calls.append)
+		for tick in range(51):
+			mock_time.return_value = tick * 0.02
+			dataBus.update_samples(self._sample({'Pitch': tick % 2}))
+			dataBus.notify_listeners(None)
+		self.assertEqual(dataBus.notifications_per_sec, 50)
+		self.assertEqual(dataBus.changed_channels_per_sec, 50)
+
+	def test_consumer_sees_consistent_snapshot(self):
+		calls = []
+		dataBus = DataBus()
+		dataBus.add_sample_listener(calls.append)
+		try:
+			dataBus.update_samples(self._sample({'BrakePress': 1, 'ThrottlePos': 1}))
+			dataBus.notify_listeners(None)
+			data = calls[0]
+			# samples arriving while a listener holds the data must not modify it
+			dataBus.update_samples(self._sample({'BrakePress': 2, 'ThrottlePos': 2}))
+			self.assertEqual(data['BrakePress'], 1)
+			self.assertEqual(data['ThrottlePos'], 1)
+		finally:
+			dataBus.remove_sample_listener(calls.append)
+
+	def test_changes_between_ticks_are_merged(self):
+		calls = []
+		dataBus = DataBus()
+		dataBus.addChannelListener('GearPos', calls.append)
+		dataBus.update_samples(self._sample({'GearPos': 1, 'SteerAngle': 0}))
+		dataBus.update_samples(self._sample({'GearPos': 1, 'SteerAngle': 5}))
+		dataBus.notify_listeners(None)
+		self.assertEqual(calls, [1])
+		dataBus.removeChannelListener('GearPos', calls.append)
+
+	def test_channel_history(self):
+		dataBus = DataBus(history_seconds=1.0, history_rate=4)
+		history = dataBus.get_channel_history('WheelSpeed')
+		self.assertIs(dataBus.get_channel_history('WheelSpeed'), history)
+		for value in range(6):
+			dataBus.update_samples(self._sample({'WheelSpeed': value}))
+		# unchanged values are recorded as well; capacity is seconds * rate
+		dataBus.update_samples(self._sample({'WheelSpeed': 5}))
+		self.assertEqual(list(history.get_values()), [3, 4, 5, 5])
+		self.assertEqual(history.get_max(), 5)
+
+		dataBus.remove_channel_history('WheelSpeed')
+		dataBus.update_samples(self._sample({'WheelSpeed': 6}))
+		self.assertEqual(list(history.get_values()), [3, 4, 5, 5])
+
+	def test_computed_channel(self):
+		calls = []
+		dataBus = DataBus()
+		computed = dataBus.add_computed_channel('WheelSlip', ['WheelSpeedFL', 'GpsSpeed'],
+											lambda wheel, gps: wheel / gps)
+		try:
+			dataBus.addChannelListener('WheelSlip', calls.append)
+			dataBus.update_samples(self._sample({'WheelSpeedFL': 110.0, 'GpsSpeed': 100.0}))
+			dataBus.notify_listeners(None)
+			self.assertEqual(calls, [1.1])
+			self.assertEqual(dataBus.getData('WheelSlip'), 1.1)
+		finally:
+			dataBus.remove_data_filter(computed)
+			dataBus.removeChannelListener('WheelSlip', calls.append)
+
+	def test_computed_channel_error_keeps_sample(self):
+		calls = []
+		dataBus = DataBus()
+		computed = dataBus.add_computed_channel('WheelSlipZero', ['WheelSpeedFR', 'GpsSpeedZero'],
+											lambda wheel, gps: wheel / gps)
+		try:
+			dataBus.addChannelListener('RPMZero', calls.append)
+			# standstill: the computed channel divides by zero
+			dataBus.update_samples(self._sample({'RPMZero': 900, 'WheelSpeedFR': 0.0, 'GpsSpeedZero': 0.0}))
+			dataBus.notify_listeners(None)
+			self.assertEqual(calls, [900])
+			self.assertEqual(dataBus.getData('RPMZero'), 900)
+			self.assertNotIn('WheelSlipZero', dataBus.channel_data)
+		finally:
+			dataBus.remove_data_filter(computed)
+			dataBus.removeChannelListener('RPMZero', calls.append)
+
+	def _measure_ingest(self, channel, listener_delay):
+		dataBus = DataBus()
+		calls = []
+
+		def listener(value):
+			calls.append(value)
+			time.sleep(listener_delay)
+		dataBus.addChannelListener(channel, listener)
+
+		stop = Event()
+		def consume():
+			while not stop.is_set():
+				dataBus.notify_listeners(None)
+				time.sleep(0.001)
+		consumer = Thread(target=consume)
+		consumer.start()
+
+		sample = Sample()
+		count = 0
+		end = time.time() + 0.3
+		try:
+			while time.time() < end:
+				count += 1
+				sample.values = {channel: count}
+				dataBus.update_samples(sample)
+		finally:
+			stop.set()
+			consumer.join()
+
+		# the latest value is always delivered once the listener catches up
+		dataBus.notify_listeners(None)
+		self.assertEqual(calls[-1], count)
+		dataBus.removeChannelListener(channel, listener)
+		return count
+
+	def test_slow_listener_does_not_stall_ingest(self):
+		fast = self._measure_ingest('StressFast', 0)
+		slow = self._measure_ingest('StressSlow', 0.05)
+		self.assertTrue(slow > fast * 0.5, 'ingest {} with slow listener vs {}'.format(slow, fast))
+
 def main():
 	unittest.main()
 
@@ -0,0 +1,82 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from autosportlabs.racecapture.databus.history import ChannelHistory
+
+
+class ChannelHistoryTest(unittest.TestCase):
+
+    def _history(self, capacity, count):
+        history = ChannelHistory(capacity)
+        for i in range(count):
+            history.append(i * 0.1, float(i))
+        return history
+
+    def test_empty(self):
+        history = ChannelHistory(10)
+        self.assertEqual(len(history), 0)
+        self.assertIsNone(history.get_latest())
+        self.assertIsNone(history.get_min())
+        self.assertIsNone(history.get_mean(1.0))
+        self.assertEqual(list(history.get_values()), [])
+
+    def test_partially_filled(self):
+        history = self._history(10, 4)
+        self.assertEqual(len(history), 4)
+        self.assertEqual(list(history.get_values()), [0, 1, 2, 3])
+        timestamp, value = history.get_latest()
+        self.assertAlmostEqual(timestamp, 0.3)
+        self.assertEqual(value, 3)
+
+    def test_wraps_oldest_first(self):
+        history = self._history(5, 12)
+        self.assertEqual(len(history), 5)
+        self.assertEqual(list(history.get_values()), [7, 8, 9, 10, 11])
+        self.assertEqual(history.get_latest()[1], 11)
+
+    def test_window(self):
+        history = self._history(100, 50)
+        # 4.9 is the latest timestamp; the last 0.45 seconds holds 4.5 .. 4.9
+        times, values = history.get_window(0.45)
+        self.assertEqual(list(values), [45, 46, 47, 48, 49])
+        self.assertEqual(len(times), 5)
+        self.assertEqual(history.get_min(0.45), 45)
+        self.assertEqual(history.get_max(0.45), 49)
+        self.assertEqual(history.get_mean(0.45), 47)
+
+    def test_window_ending_now(self):
+        history = self._history(100, 50)
+        self.assertEqual(list(history.get_values(0.25, now=5.1)), [49])
+        self.assertIsNone(history.get_max(0.25, now=10.0))
+
+    def test_clear(self):
+        history = self._history(5, 12)
+        history.clear()
+        self.assertEqual(len(history), 0)
+        history.append(1.0, 2.0)
+        self.assertEqual(list(history.get_values()), [2.0])
+
+
+def main():
+    unittest.main()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Benchmark showing peak memory of DataStore.export_session as the session grows.
+Sessions are built by repeating the sonoma.log fixture; each export runs in its
+own process so the peak RSS of one run does not hide the next.
+
+Run from the project root:
+    python -m test.autosportlabs.racecapture.datastore.benchmark_export
+"""
+
+import os
+import os.path
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from autosportlabs.racecapture.datastore.datastore import DataStore
+
+fqp = os.path.dirname(os.path.realpath(__file__))
+sonoma_path = os.path.join(fqp, 'sonoma.log')
+
+MULTIPLIERS = [1, 2, 4, 8]
+MODULE = 'test.autosportlabs.racecapture.datastore.benchmark_export'
+
+
+def _write_repeated_log(path, multiplier):
+    """
+    Writes a log containing the sonoma.log samples repeated multiplier times,
+    with the Interval and Utc columns shifted so time keeps moving forward
+    """
+    with open(sonoma_path, 'r') as source:
+        header = source.readline()
+        lines = [line.strip().split(',') for line in source]
+
+    first = long(lines[0][0])
+    span = long(lines[-1][0]) - first + 50
+    with open(path, 'w') as log:
+        log.write(header)
+        for repeat in range(multiplier):
+            offset = repeat * span
+            for values in lines:
+                row = list(values)
+                for index in (0, 1):
+                    if row[index] != '':
+                        row[index] = str(long(row[index]) + offset)
+                log.write(','.join(row) + '\n')
+
+
+def _max_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _child(db_path, session_id, mode):
+    ds = DataStore()
+    ds.open_db(db_path)
+    session_id = int(session_id)
+    baseline = _max_rss_kb()
+    start = time.time()
+    if mode == 'materialized':
+        # what the export used to do before writing a single row
+        rows = len(ds.query([session_id], [c.name for c in ds.get_channel_list(session_id)]).fetch_records())
+    else:
+        with open(os.devnull, 'w') as export_file:
+            rows = ds.export_session(session_id, export_file)
+    elapsed = time.time() - start
+    print rows, _max_rss_kb() - baseline, elapsed
+    ds.close()
+
+
+def _measure(db_path, session_id, mode):
+    output = subprocess.check_output([sys.executable, '-m', MODULE, db_path, str(session_id), mode],
+                                     env=dict(os.environ, KIVY_NO_ARGS='1'))
+    rows, rss_kb, elapsed = output.strip().splitlines()[-1].split()
+    return int(rows), int(rss_kb), float(elapsed)
+
+
+def run():
+    work_dir = tempfile.mkdtemp()
+    db_path = os.path.join(work_dir, 'export_benchmark.sql3')
+    ds = DataStore()
+    ds.open_db(db_path)
+    sessions = []
+    for multiplier in MULTIPLIERS:
+        log_path = os.path.join(work_dir, 'sonoma_x{}.log'.format(multiplier))
+        _write_repeated_log(log_path, multiplier)
+        sessions.append((multiplier, ds.import_datalog(log_path, 'sonoma x{}'.format(multiplier))))
+        os.remove(log_path)
+    ds.close()
+
+    print '{:>6} {:>10} {:>18} {:>18} {:>10}'.format('size', 'rows', 'export RSS +KB', 'materialize RSS +KB', 'export s')
+    try:
+        for multiplier, session_id in sessions:
+            rows, export_rss, elapsed = _measure(db_path, session_id, 'export')
+            _, materialized_rss, _ = _measure(db_path, session_id, 'materialized')
+            print '{:>5}x {:>10} {:>18} {:>18} {:>10.2f}'.format(multiplier, rows, export_rss, materialized_rss, elapsed)
+    finally:
+        os.remove(db_path)
+        os.rmdir(work_dir)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4:
+        _child(*sys.argv[1:])
+    else:
+        run()
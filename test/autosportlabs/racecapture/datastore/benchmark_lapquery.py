@@ -0,0 +1,130 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Benchmark comparing reading a single lap by filtering on CurrentLap against
+reading it by the lap's sample id range, for a 60 lap session built from
+the laps in the sonoma.log fixture. The database holds several copies of the
+session, as a user's datastore would: the CurrentLap filter has to visit the
+matching lap of every session, while the sample range only reads the rows of
+the lap being queried.
+
+Run from the project root:
+    python -m test.autosportlabs.racecapture.datastore.benchmark_lapquery
+"""
+
+import os
+import os.path
+import tempfile
+import timeit
+from autosportlabs.racecapture.datastore.datastore import DataStore, Filter
+
+fqp = os.path.dirname(os.path.realpath(__file__))
+sonoma_path = os.path.join(fqp, 'sonoma.log')
+
+LAP_COUNT = 60
+SESSION_COUNT = 5
+CHANNELS = ['Interval', 'Latitude', 'Longitude', 'Speed', 'RPM']
+REPEAT = 3
+
+
+def _write_60_lap_log(path):
+    """
+    Writes a log with LAP_COUNT laps by cycling through the timed laps of sonoma.log,
+    renumbering the lap channels and shifting Interval / Utc so time keeps moving forward
+    """
+    with open(sonoma_path, 'r') as source:
+        header = source.readline()
+        lines = [line.strip().split(',') for line in source]
+
+    names = [c.split('|')[0].strip('"') for c in header.strip().split(',')]
+    current_lap_index = names.index('CurrentLap')
+    lap_count_index = names.index('LapCount')
+
+    # group the source samples by lap, carrying CurrentLap forward over sparse rows
+    laps = {}
+    current_lap = None
+    for values in lines:
+        if values[current_lap_index] != '':
+            current_lap = int(float(values[current_lap_index]))
+        if current_lap is not None and current_lap >= 1:
+            laps.setdefault(current_lap, []).append(values)
+    source_laps = [laps[lap] for lap in sorted(laps.keys())[:-1]]
+
+    offset = 0
+    with open(path, 'w') as log:
+        log.write(header)
+        for lap in range(1, LAP_COUNT + 1):
+            lap_lines = source_laps[(lap - 1) % len(source_laps)]
+            first_interval = long(lap_lines[0][0])
+            for values in lap_lines:
+                row = list(values)
+                for index in (0, 1):
+                    if row[index] != '':
+                        row[index] = str(long(row[index]) - first_interval + offset)
+                if row[current_lap_index] != '':
+                    row[current_lap_index] = str(lap)
+                if row[lap_count_index] != '':
+                    row[lap_count_index] = str(lap - 1)
+                log.write(','.join(row) + '\n')
+            offset += long(lap_lines[-1][0]) - first_interval + 50
+
+
+def run():
+    work_dir = tempfile.mkdtemp()
+    db_path = os.path.join(work_dir, 'lapquery_benchmark.sql3')
+    log_path = os.path.join(work_dir, 'sonoma_60_laps.log')
+    ds = DataStore()
+    ds.open_db(db_path)
+    try:
+        _write_60_lap_log(log_path)
+        for index in range(SESSION_COUNT):
+            session_id = ds.import_datalog(log_path, '60 laps {}'.format(index))
+        laps = ds.get_laps(session_id).keys()
+        print '{} sessions of {} laps, {} samples per session'.format(SESSION_COUNT, len(laps),
+                                                                    ds._get_session_record_count(session_id))
+
+        def by_filter(lap):
+            return ds.query(sessions=[session_id], channels=CHANNELS,
+                            data_filter=Filter().eq('CurrentLap', lap)).fetch_records()
+
+        def by_range(lap):
+            return ds.query(sessions=[session_id], channels=CHANNELS,
+                            sample_range=ds.get_lap_sample_range(session_id, lap)).fetch_records()
+
+        for lap in laps:
+            assert by_filter(lap) == by_range(lap), lap
+
+        filter_time = min(timeit.repeat(lambda: [by_filter(lap) for lap in laps], number=1, repeat=REPEAT))
+        range_time = min(timeit.repeat(lambda: [by_range(lap) for lap in laps], number=1, repeat=REPEAT))
+        print 'CurrentLap filter: {:.2f} ms per lap'.format(filter_time * 1000.0 / len(laps))
+        print 'sample id range:   {:.2f} ms per lap'.format(range_time * 1000.0 / len(laps))
+        print 'speedup:           {:.1f}x'.format(filter_time / range_time)
+    finally:
+        ds.close()
+        for path in (db_path, log_path):
+            if os.path.exists(path):
+                os.remove(path)
+        os.rmdir(work_dir)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,58 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Micro-benchmark comparing the reference list based smoothing against the
+vectorized smoothing engine on the sonoma.log fixture.
+
+Run from the project root:
+    python -m test.autosportlabs.racecapture.datastore.benchmark_smoothing
+"""
+
+import timeit
+from autosportlabs.racecapture.datastore.datastore import _smooth_dataset, _smooth_array, _to_array
+from test.autosportlabs.racecapture.datastore.test_smoothing import load_log_columns, sonoma_path
+
+RATES = [2, 5, 10, 25]
+REPEAT = 5
+
+
+def run():
+    columns = load_log_columns(sonoma_path)
+    arrays = dict((name, _to_array(values)) for name, values in columns.iteritems())
+    sample_count = len(columns.values()[0])
+    print 'sonoma.log: {} channels x {} samples'.format(len(columns), sample_count)
+    print '{:>6} {:>14} {:>14} {:>9}'.format('rate', 'reference ms', 'vectorized ms', 'speedup')
+
+    for rate in RATES:
+        for name, values in columns.iteritems():
+            assert _smooth_dataset(values, rate) == list(_smooth_array(arrays[name], rate)), name
+
+        reference = min(timeit.repeat(lambda: [_smooth_dataset(v, rate) for v in columns.itervalues()],
+                                      number=1, repeat=REPEAT))
+        vectorized = min(timeit.repeat(lambda: [_smooth_array(v, rate) for v in arrays.itervalues()],
+                                       number=1, repeat=REPEAT))
+        print '{:>6} {:>14.2f} {:>14.2f} {:>8.1f}x'.format(rate, reference * 1000.0, vectorized * 1000.0,
+                                                          reference / vectorized)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,127 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+
+import unittest
+import os
+import os.path
+from collections import namedtuple
+from autosportlabs.racecapture.datastore.datastore import DataStore
+
+fqp = os.path.dirname(os.path.realpath(__file__))
+db_path = os.path.join(fqp, 'rctest_channelstats.sql3')
+sonoma_path = os.path.join(fqp, 'sonoma.log')
+log_path = os.path.join(fqp, 'rc_adj.log')
+
+ChannelMeta = namedtuple('ChannelMeta', ['units', 'min', 'max', 'sampleRate'])
+
+
+class ChannelStatsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self):
+        if os.path.exists(db_path):
+            os.remove(db_path)
+
+        self.ds = DataStore()
+        self.ds.open_db(db_path)
+        self.sonoma_id = self.ds.import_datalog(sonoma_path, 'sonoma')
+        self.rc_adj_id = self.ds.import_datalog(log_path, 'rc_adj')
+
+    @classmethod
+    def tearDownClass(self):
+        self.ds.close()
+        os.remove(db_path)
+
+    def _aggregate(self, sql, sessions):
+        subs = ','.join(['?'] * len(sessions))
+        c = self.ds.connection.cursor()
+        c.execute('{} FROM datapoint JOIN sample ON datapoint.sample_id=sample.id WHERE sample.session_id IN({})'.format(
+            sql, subs), sessions)
+        return c.fetchone()
+
+    def test_imported_stats_match_datapoints(self):
+        for sessions in [[self.sonoma_id], [self.rc_adj_id], [self.sonoma_id, self.rc_adj_id]]:
+            for channel in ['RPM', 'Coolant', 'Latitude', 'Speed']:
+                expected = self._aggregate('SELECT AVG({0}), MIN(CASE WHEN {0} > 0 THEN {0} END), '
+                                           'MAX(CASE WHEN {0} > 0 THEN {0} END), MIN({0})'.format(channel), sessions)
+                self.assertAlmostEqual(self.ds.get_channel_average(channel, sessions), expected[0], places=6)
+                self.assertEqual(self.ds.get_channel_min(channel, sessions), expected[1])
+                self.assertEqual(self.ds.get_channel_max(channel, sessions), expected[2])
+                self.assertEqual(self.ds.get_channel_min(channel, sessions, exclude_zero=False), expected[3])
+
+    def test_extra_channels(self):
+        c = self.ds.connection.cursor()
+        c.execute('SELECT MIN(LapTime), LapCount FROM datapoint WHERE LapTime > 0')
+        self.assertEqual(self.ds.get_channel_min('LapTime', extra_channels=['LapCount']), c.fetchone())
+        expected = self._aggregate('SELECT MAX(LapTime), LapCount', [self.rc_adj_id])
+        self.assertEqual(self.ds.get_channel_max('LapTime', [self.rc_adj_id], ['LapCount']), expected)
+
+    def test_location(self):
+        expected = self._aggregate('SELECT AVG(Latitude), AVG(Longitude), MIN(Latitude), MIN(Longitude), '
+                                   'MAX(Latitude), MAX(Longitude)', [self.sonoma_id])
+        # the query above includes zero fixes, which sonoma.log does not have
+        lat, lon = self.ds.get_location_center([self.sonoma_id])
+        self.assertAlmostEqual(lat, expected[0], places=6)
+        self.assertAlmostEqual(lon, expected[1], places=6)
+        self.assertEqual(self.ds.get_location_bounds([self.sonoma_id]),
+                         ((expected[2], expected[3]), (expected[4], expected[5])))
+
+    def test_uncomputed_session(self):
+        sessions = [self.sonoma_id, self.rc_adj_id]
+        expected_max = self.ds.get_channel_max('RPM', sessions)
+        expected_average = self.ds.get_channel_average('RPM', sessions)
+        expected_center = self.ds.get_location_center([self.sonoma_id])
+        self.ds._channel_stats.delete_session(self.sonoma_id)
+        self.ds._channel_stats.set_computed(self.sonoma_id, False)
+        self.ds.commit()
+
+        # computed on first read
+        self.assertEqual(self.ds.get_channel_max('RPM', sessions), expected_max)
+        self.assertListEqual(self.ds._channel_stats.get_uncomputed_sessions(), [])
+        self.assertAlmostEqual(self.ds.get_channel_average('RPM', sessions), expected_average, places=6)
+        self.assertEqual(self.ds.get_location_center([self.sonoma_id]), expected_center)
+
+    def test_many_channels(self):
+        batch_size = DataStore.STATS_BATCH_CHANNELS
+        DataStore.STATS_BATCH_CHANNELS = 2
+        try:
+            self.ds.build_channel_stats(self.sonoma_id)
+        finally:
+            DataStore.STATS_BATCH_CHANNELS = batch_size
+        self.test_imported_stats_match_datapoints()
+        self.test_location()
+
+    def test_recorded_session(self):
+        meta = ChannelMeta('', 0, 0, 10)
+        session_id = self.ds.init_session('recorded', {'RPM': meta})
+        try:
+            self.ds.insert_samples([{'RPM': 1000}, {'RPM': 2000}], session_id)
+            self.assertEqual(self.ds.get_channel_max('RPM', [session_id]), 2000)
+
+            # statistics are not final until the session is finalized
+            self.ds.insert_samples([{'RPM': 3000}], session_id)
+            self.assertEqual(self.ds.get_channel_max('RPM', [session_id]), 3000)
+            self.ds.finalize_session(session_id)
+            self.assertNotIn(session_id, self.ds._channel_stats.get_uncomputed_sessions())
+            self.assertEqual(self.ds.get_channel_average('RPM', [session_id]), 2000)
+        finally:
+            self.ds.delete_session(session_id)
+        self.assertIsNone(self.ds.get_channel_max('RPM', [session_id]))
@@ -0,0 +1,117 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import os
+import os.path
+from autosportlabs.racecapture.datastore.datastore import DataStore, Filter, ColumnarDataSet
+from autosportlabs.racecapture.datastore.columnstore import pack_values, unpack_values
+
+fqp = os.path.dirname(os.path.realpath(__file__))
+db_path = os.path.join(fqp, 'rctest_columnar.sql3')
+log_path = os.path.join(fqp, 'rc_adj.log')
+
+
+class PackValuesTest(unittest.TestCase):
+
+    def test_round_trip_float32(self):
+        values = [1.0, None, 2.5, -3.25]
+        typecode, blob = pack_values(values)
+        self.assertEqual(typecode, 'f')
+        self.assertListEqual(unpack_values(typecode, blob), values)
+
+    def test_round_trip_float64(self):
+        values = [47.256164123, 1486502321000.0, None]
+        typecode, blob = pack_values(values)
+        self.assertEqual(typecode, 'd')
+        self.assertListEqual(unpack_values(typecode, blob), values)
+
+
+class ColumnStoreTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self):
+        if os.path.exists(db_path):
+            os.remove(db_path)
+
+        self.ds = DataStore(columnar=True)
+        self.ds.open_db(db_path)
+        self.session_id = self.ds.import_datalog(log_path, 'rc_adj', 'the notes')
+
+    @classmethod
+    def tearDownClass(self):
+        self.ds.close()
+        os.remove(db_path)
+
+    def _query_both(self, **kwargs):
+        columnar = self.ds.query(**kwargs).fetch_records()
+        self.ds.columnar = False
+        try:
+            rows = self.ds.query(**kwargs).fetch_records()
+        finally:
+            self.ds.columnar = True
+        return columnar, rows
+
+    def test_import_populates_columns(self):
+        self.assertTrue(self.ds._column_store.has_session(self.session_id))
+
+    def test_query_matches_row_store(self):
+        columnar, rows = self._query_both(sessions=[self.session_id],
+                                          channels=['Coolant', 'RPM', 'MAP'])
+        self.assertEqual(len(columnar), 25691)
+        self.assertListEqual(columnar, rows)
+
+    def test_filtered_query_matches_row_store(self):
+        f = Filter().gt('LapCount', 0).group(Filter().lt('RPM', 3000).or_().gt('Coolant', 200))
+        columnar, rows = self._query_both(sessions=[self.session_id],
+                                          channels=['LapCount', 'RPM', 'Coolant'],
+                                          data_filter=f)
+        self.assertTrue(len(columnar) > 0)
+        self.assertListEqual(columnar, rows)
+
+    def test_filtered_query_uses_rows(self):
+        dataset = self.ds.query(sessions=[self.session_id], channels=['RPM'])
+        self.assertIsInstance(dataset, ColumnarDataSet)
+        dataset = self.ds.query(sessions=[self.session_id], channels=['RPM'], data_filter=Filter().gt('LapCount', 0))
+        self.assertNotIsInstance(dataset, ColumnarDataSet)
+
+    def test_distinct_query(self):
+        f = Filter().gt('LapCount', 0)
+        dataset = self.ds.query(sessions=[self.session_id],
+                                channels=['LapCount', 'LapTime'],
+                                data_filter=f,
+                                distinct_records=True)
+        self.assertEqual(len(dataset.fetch_records()), 37)
+
+    def test_fetch_in_batches(self):
+        dataset = self.ds.query(sessions=[self.session_id], channels=['RPM'])
+        total = 0
+        while True:
+            records = dataset.fetch_records(1000)
+            if len(records) == 0:
+                break
+            total += len(records)
+        self.assertEqual(total, 25691)
+
+    def test_build_session_columns(self):
+        self.ds.build_session_columns(self.session_id)
+        columnar, rows = self._query_both(sessions=[self.session_id],
+                                          channels=['Latitude', 'Longitude'])
+        self.assertListEqual(columnar, rows)
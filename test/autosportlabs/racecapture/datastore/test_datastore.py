@@ -19,6 +19,7 @@
 # this code. If not, see <http://www.gnu.org/licenses/>.
 
 import itertools
+import math
 import tempfile
 import csv
 import unittest
@@ -26,7 +27,7 @@ import os
 import os.path
 from collections import namedtuple
 from autosportlabs.racecapture.datastore.datastore import DataStore, Filter, \
-    DataSet, _interp_dpoints, _smooth_dataset, _scrub_sql_value
+    DataSet, DatastoreException, _interp_dpoints, _smooth_dataset, _scrub_sql_value
 
 
 fqp = os.path.dirname(os.path.realpath(__file__))
@@ -79,6 +80,59 @@ class DataStoreTest(unittest.TestCase):
         session = self.ds.get_session_by_id(session_id)
         self.assertIsNone(session)
 
+    def test_chunked_import(self):
+        with open(log_path, 'rb') as data_file:
+            channels = self.ds._parse_datalog_headers(data_file.readline())
+            expected = list(self.ds._desparsified_data_generator(data_file))
+
+        chunk_size = DataStore.IMPORT_CHUNK_SIZE
+        workers = DataStore.IMPORT_WORKERS
+        DataStore.IMPORT_CHUNK_SIZE = 64 * 1024
+        DataStore.IMPORT_WORKERS = 2
+        try:
+            session_id = self.ds.import_datalog(log_path, 'rc_adj_chunked')
+        finally:
+            DataStore.IMPORT_CHUNK_SIZE = chunk_size
+            DataStore.IMPORT_WORKERS = workers
+
+        try:
+            records = self.ds.query(sessions=[session_id],
+                                    channels=[c.name for c in channels]).fetch_raw_records()
+            self.assertEqual(len(records), len(expected))
+            self.assertListEqual([list(r[1:]) for r in records], expected)
+        finally:
+            self.ds.delete_session(session_id)
+
+    def test_import_progress(self):
+        progress = []
+        session_id = self.ds.import_datalog(log_path, 'rc_adj_progress', '', progress.append)
+        try:
+            self.assertGreaterEqual(len(progress), DataStore.IMPORT_PROGRESS_STEPS)
+            self.assertListEqual(progress, sorted(progress))
+            self.assertAlmostEqual(progress[-1], 100)
+        finally:
+            self.ds.delete_session(session_id)
+
+    def test_insert_samples(self):
+        session_id = self.ds.init_session('batch')
+        try:
+            samples = [{'RPM': 1000 + i, 'Coolant': 180} for i in range(5)]
+            samples.append({'RPM': 2000})
+            self.ds.insert_samples(samples, session_id)
+            self.ds.insert_sample_nocommit({'Coolant': 190, 'RPM': 3000}, session_id)
+            self.ds.commit()
+
+            records = self.ds.query(sessions=[session_id], channels=['RPM', 'Coolant']).fetch_records()
+            self.assertListEqual(records, [(session_id, 1000, 180),
+                                           (session_id, 1001, 180),
+                                           (session_id, 1002, 180),
+                                           (session_id, 1003, 180),
+                                           (session_id, 1004, 180),
+                                           (session_id, 2000, None),
+                                           (session_id, 3000, 190)])
+        finally:
+            self.ds.delete_session(session_id)
+
     def test_basic_filter(self):
         f = Filter().lt('LapCount', 1)
 
@@ -142,6 +196,23 @@ class DataStoreTest(unittest.TestCase):
         for k in samples.keys():
             self.assertEqual(len(samples[k]), 100)
 
+    def test_dataset_arrays(self):
+        channels = ['Coolant', 'RPM', 'MAP', 'Latitude']
+        columns = self.ds.query(sessions=[1], channels=channels).fetch_columns()
+        arrays = self.ds.query(sessions=[1], channels=channels).fetch_arrays()
+
+        self.assertListEqual(sorted(columns.keys()), sorted(arrays.keys()))
+        for channel in channels:
+            expected = columns[channel]
+            actual = arrays[channel]
+            self.assertEqual(len(expected), len(actual))
+            for e, a in zip(expected, actual):
+                if e is None:
+                    self.assertTrue(math.isnan(a))
+                else:
+                    self.assertEqual(e, a)
+        self.assertListEqual(columns['session_id'], [int(x) for x in arrays['session_id']])
+
     def test_dataset_record_oriented(self):
         f = Filter().lt('LapCount', 1)
         dataset = self.ds.query(sessions=[1],
@@ -425,6 +496,29 @@ class DataStoreTest(unittest.TestCase):
 
             self.ds.delete_session(import_export_id)
 
+    def test_tuning_profile(self):
+        self.assertRaises(DatastoreException, DataStore, tuning_profile='bogus')
+
+        # the default profile shares the main connection for reads
+        self.assertIs(self.ds.read_connection, self.ds.connection)
+
+        tuned_db_path = os.path.join(fqp, 'rctest_tuned.sql3')
+        ds = DataStore(tuning_profile='Performance')
+        ds.open_db(tuned_db_path)
+        try:
+            self.assertEqual(ds.connection.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            self.assertIsNot(ds.read_connection, ds.connection)
+            self.assertEqual(ds.read_connection.execute('PRAGMA query_only').fetchone()[0], 1)
+
+            session_id = ds.import_datalog(import_export_path, 'tuned')
+            records = ds.query(sessions=[session_id], channels=['Interval']).fetch_records()
+            self.assertEqual(len(records), 298)
+        finally:
+            ds.close()
+            for suffix in ['', '-wal', '-shm']:
+                if os.path.exists(tuned_db_path + suffix):
+                    os.remove(tuned_db_path + suffix)
+
     def test_scrub_sql_value(self):
         ds = self.ds
         self.assertEqual(_scrub_sql_value('ABCD1234'), '"ABCD1234"')
@@ -0,0 +1,158 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+
+import unittest
+import os
+import os.path
+import tempfile
+from collections import namedtuple
+from autosportlabs.racecapture.datastore.datastore import DataStore, Filter
+
+fqp = os.path.dirname(os.path.realpath(__file__))
+db_path = os.path.join(fqp, 'rctest_lapindex.sql3')
+sonoma_path = os.path.join(fqp, 'sonoma.log')
+log_path = os.path.join(fqp, 'rc_adj.log')
+
+ChannelMeta = namedtuple('ChannelMeta', ['units', 'min', 'max', 'sampleRate'])
+
+SONOMA_LAP_TIMES = [(1, 2.135), (2, 2.105), (3, 2.13), (4, 2.1067), (5, 2.1317), (6, 2.1767), (7, 2.1133), (8, None)]
+
+
+class LapIndexTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self):
+        if os.path.exists(db_path):
+            os.remove(db_path)
+
+        self.ds = DataStore()
+        self.ds.open_db(db_path)
+        self.sonoma_id = self.ds.import_datalog(sonoma_path, 'sonoma')
+        self.no_laps_id = self.ds.import_datalog(log_path, 'rc_adj')
+
+    @classmethod
+    def tearDownClass(self):
+        self.ds.close()
+        os.remove(db_path)
+
+    def test_imported_laps(self):
+        self.assertTrue(self.ds.session_has_laps(self.sonoma_id))
+        laps = self.ds.get_laps(self.sonoma_id)
+        self.assertListEqual([(l.lap, l.lap_time) for l in laps.values()], SONOMA_LAP_TIMES)
+
+        lap = laps[1]
+        self.assertEqual(lap.first_sample_id, 1903)
+        self.assertEqual(lap.last_sample_id, 5733)
+        self.assertEqual(lap.start_interval, 1229442)
+        self.assertEqual(lap.end_interval, 1357122)
+
+    def test_lap_sample_range_query(self):
+        channels = ['CurrentLap', 'RPM', 'Latitude']
+        for lap in self.ds.get_laps(self.sonoma_id).keys():
+            sample_range = self.ds.get_lap_sample_range(self.sonoma_id, lap)
+            by_range = self.ds.query(sessions=[self.sonoma_id], channels=channels,
+                                     sample_range=sample_range).fetch_records()
+            by_filter = self.ds.query(sessions=[self.sonoma_id], channels=channels,
+                                      data_filter=Filter().eq('CurrentLap', lap)).fetch_records()
+            self.assertTrue(len(by_range) > 0)
+            self.assertListEqual(by_range, by_filter)
+
+        self.assertIsNone(self.ds.get_lap_sample_range(self.sonoma_id, 100))
+
+    def test_lap_sample_range_multiple_sessions(self):
+        sample_range = self.ds.get_lap_sample_range(self.sonoma_id, 2)
+        records = self.ds.query(sessions=[self.sonoma_id, self.no_laps_id], channels=['CurrentLap'],
+                                sample_range=sample_range).fetch_records()
+        self.assertEqual(len(records), sample_range[1] - sample_range[0] + 1)
+        self.assertTrue(all(r[1] == 2 for r in records))
+
+    def test_lap_channel_back_filled_across_chunks(self):
+        log_file = tempfile.NamedTemporaryFile(suffix='.log', delete=False)
+        try:
+            log_file.write('"Interval"|"ms"|0|0|10,"CurrentLap"|""|0|0|10,"LapCount"|""|0|0|10,"LapTime"|"min"|0|0|10\n')
+            for i in range(1000):
+                log_file.write('{},,,\n'.format(i * 100))
+            for i in range(1000, 2000):
+                log_file.write('{},1,0,0\n'.format(i * 100))
+            log_file.close()
+
+            chunk_size = DataStore.IMPORT_CHUNK_SIZE
+            min_chunk_size = DataStore.IMPORT_MIN_CHUNK_SIZE
+            DataStore.IMPORT_CHUNK_SIZE = DataStore.IMPORT_MIN_CHUNK_SIZE = 1024
+            try:
+                session_id = self.ds.import_datalog(log_file.name, 'back-filled laps')
+            finally:
+                DataStore.IMPORT_CHUNK_SIZE = chunk_size
+                DataStore.IMPORT_MIN_CHUNK_SIZE = min_chunk_size
+        finally:
+            os.remove(log_file.name)
+
+        try:
+            c = self.ds.connection.cursor()
+            c.execute('SELECT MIN(id) FROM sample WHERE session_id = ?', (session_id,))
+            first_sample_id = c.fetchone()[0]
+            lap = self.ds.get_laps(session_id)[1]
+            self.assertEqual(lap.first_sample_id, first_sample_id)
+            self.assertEqual(lap.last_sample_id - lap.first_sample_id, 1999)
+            self.assertEqual(lap.start_interval, 0)
+        finally:
+            self.ds.delete_session(session_id)
+
+    def test_session_without_laps(self):
+        self.assertFalse(self.ds.session_has_laps(self.no_laps_id))
+        laps = self.ds.get_laps(self.no_laps_id)
+        self.assertListEqual(laps.keys(), [1])
+        self.assertIsNone(laps[1].lap_time)
+
+    def test_rebuild_matches_import(self):
+        imported = [vars(l) for l in self.ds.get_laps(self.sonoma_id).values()]
+        self.ds.build_lap_index(self.sonoma_id)
+        rebuilt = [vars(l) for l in self.ds.get_laps(self.sonoma_id).values()]
+        self.assertListEqual(imported, rebuilt)
+
+    def test_unindexed_session(self):
+        self.ds._lap_index.delete_session(self.sonoma_id)
+        self.ds._lap_index.set_indexed(self.sonoma_id, False)
+        self.ds.commit()
+
+        # indexed on first read
+        all_laps = self.ds.get_all_laps()
+        self.assertListEqual([(l.lap, l.lap_time) for l in all_laps[self.sonoma_id].values()], SONOMA_LAP_TIMES)
+        self.assertListEqual(all_laps[self.no_laps_id].keys(), [1])
+        self.assertListEqual(self.ds._lap_index.get_unindexed_sessions(), [])
+        self.assertEqual(len(self.ds._lap_index.get_laps(self.sonoma_id)), len(SONOMA_LAP_TIMES))
+        self.assertEqual(self.ds.get_lap_sample_range(self.sonoma_id, 1), (1903, 5733))
+
+    def test_recorded_laps(self):
+        meta = ChannelMeta('', 0, 0, 10)
+        session_id = self.ds.init_session('recorded', {'CurrentLap': meta, 'LapCount': meta, 'LapTime': meta})
+        try:
+            samples = [{'CurrentLap': 1, 'LapCount': 0, 'LapTime': 0}] * 3
+            samples += [{'CurrentLap': 2, 'LapCount': 1, 'LapTime': 1.5}] * 3
+            self.ds.insert_samples(samples[:4], session_id)
+            self.ds.insert_samples(samples[4:], session_id)
+            self.ds.finalize_session(session_id)
+
+            laps = self.ds.get_laps(session_id)
+            self.assertListEqual([(l.lap, l.lap_time) for l in laps.values()], [(1, 1.5), (2, None)])
+            self.assertEqual(laps[2].last_sample_id - laps[1].first_sample_id, 5)
+        finally:
+            self.ds.delete_session(session_id)
@@ -0,0 +1,87 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+
+import unittest
+import os
+import os.path
+from autosportlabs.racecapture.datastore.datastore import DataStore, DatastoreException, \
+    _smooth_dataset, _smooth_array, SMOOTHING_MOVING_AVERAGE, SMOOTHING_SAVITZKY_GOLAY
+
+fqp = os.path.dirname(os.path.realpath(__file__))
+sonoma_path = os.path.join(fqp, 'sonoma.log')
+
+
+def load_log_columns(path):
+    """
+    Loads a datalog into desparsified per channel lists without a database
+    :return dict of channel name => list of values
+    """
+    ds = DataStore()
+    with open(path, 'r') as data_file:
+        channels = ds._parse_datalog_headers(data_file.readline())
+        records = list(ds._desparsified_data_generator(data_file))
+    return dict((c.name, [r[i] for r in records]) for i, c in enumerate(channels))
+
+
+class SmoothingTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self):
+        self.columns = load_log_columns(sonoma_path)
+
+    def test_linear_matches_reference(self):
+        for name, values in self.columns.iteritems():
+            for rate in [2, 3, 4, 5, 7, 10, 25]:
+                expected = _smooth_dataset(values, rate)
+                actual = list(_smooth_array(values, rate))
+                self.assertListEqual(expected, actual, 'channel {} rate {}'.format(name, rate))
+
+    def test_linear_tail_lengths(self):
+        values = [float(x * x % 17) for x in range(50)]
+        for length in range(5, 50):
+            dset = values[:length]
+            self.assertListEqual(_smooth_dataset(dset, 4), list(_smooth_array(dset, 4)))
+
+    def test_linear_short_dataset(self):
+        self.assertListEqual(list(_smooth_array([1., 2.], 4)), [1., 2.])
+
+    def test_invalid_rate(self):
+        self.assertRaises(DatastoreException, _smooth_array, [1., 2., 3.], 1)
+
+    def test_moving_average(self):
+        smoothed = list(_smooth_array([0., 0., 3., 0., 0.], 3, SMOOTHING_MOVING_AVERAGE))
+        self.assertListEqual(smoothed, [0., 1., 1., 1., 0.])
+
+    def test_savitzky_golay_preserves_quadratic(self):
+        values = [float(x * x) for x in range(20)]
+        try:
+            smoothed = _smooth_array(values, 5, SMOOTHING_SAVITZKY_GOLAY)
+        except DatastoreException:
+            # NumPy not available
+            return
+        for expected, actual in zip(values[2:-2], smoothed[2:-2]):
+            self.assertAlmostEqual(expected, actual)
+
+    def test_datastore_smoothing_mode(self):
+        ds = DataStore()
+        self.assertRaises(DatastoreException, setattr, ds, 'smoothing_mode', 'bogus')
+        ds.smoothing_mode = SMOOTHING_MOVING_AVERAGE
+        self.assertEqual(ds.smoothing_mode, SMOOTHING_MOVING_AVERAGE)
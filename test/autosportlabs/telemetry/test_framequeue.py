@@ -0,0 +1,243 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import json
+import os
+import shutil
+import socket
+import tempfile
+from collections import deque
+from time import sleep, time
+import mock
+from autosportlabs.comms.ioloop import IoLoop
+from autosportlabs.racecapture.data.channels import ChannelMeta
+from autosportlabs.telemetry.framequeue import FrameQueue, DROP_OLDEST, DROP_NEWEST, _HEADER_SIZE
+from autosportlabs.telemetry.telemetryconnection import TelemetryManager
+
+
+def wait_for(condition, timeout=3.0):
+    end = time() + timeout
+    while not condition():
+        if time() > end:
+            return False
+        sleep(0.01)
+    return True
+
+
+class FrameQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'queue.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _queue(self, ring_size, **kwargs):
+        return FrameQueue(self.path, max_size=_HEADER_SIZE + 256 + ring_size, preamble_size=256, **kwargs)
+
+    def test_fifo(self):
+        queue = FrameQueue(self.path, max_size=4096, preamble_size=256)
+        for i in range(10):
+            self.assertTrue(queue.put('frame{}'.format(i)))
+        self.assertEqual(len(queue), 10)
+        self.assertEqual([queue.get() for i in range(10)], ['frame{}'.format(i) for i in range(10)])
+        self.assertIsNone(queue.get())
+        self.assertEqual(queue.size, 0)
+        queue.close()
+
+    def test_wraps_around(self):
+        # room for a few frames of varying size, so the ring wraps many times
+        queue = self._queue(100)
+        expected = deque()
+        for i in range(500):
+            frame = 'f{}'.format(i) * (i % 7 + 1)
+            queue.put(frame)
+            expected.append(frame)
+            while sum(len(f) + 4 for f in expected) > 100:
+                expected.popleft()
+            if i % 3 == 0:
+                self.assertEqual(queue.get(), expected.popleft())
+            self.assertEqual(len(queue), len(expected))
+        self.assertEqual([queue.get() for f in range(len(queue))], list(expected))
+        queue.close()
+
+    def test_drop_oldest(self):
+        queue = self._queue(40, drop_policy=DROP_OLDEST)
+        queue.set_preamble('meta')
+        for i in range(10):
+            self.assertTrue(queue.put('frame{}'.format(i)))
+        # 10 bytes per record, so the last 4 remain
+        self.assertEqual(len(queue), 4)
+        self.assertEqual(queue.dropped, 6)
+        self.assertEqual(queue.get(), 'frame6')
+        # the preamble is never dropped
+        self.assertEqual(queue.preamble, 'meta')
+        queue.close()
+
+    def test_drop_newest(self):
+        queue = self._queue(40, drop_policy=DROP_NEWEST)
+        results = [queue.put('frame{}'.format(i)) for i in range(10)]
+        self.assertEqual(results, [True] * 4 + [False] * 6)
+        self.assertEqual(queue.get(), 'frame0')
+        queue.close()
+
+    def test_oversize_frame(self):
+        queue = self._queue(40)
+        self.assertFalse(queue.put('x' * 100))
+        self.assertEqual(len(queue), 0)
+        queue.close()
+
+    def test_persists(self):
+        queue = FrameQueue(self.path, max_size=4096, preamble_size=256)
+        queue.set_key('ABC123')
+        queue.set_preamble('meta')
+        queue.put('one')
+        queue.put('two')
+        queue.get()
+        queue.put('three')
+        queue.close()
+
+        queue = FrameQueue(self.path, max_size=4096, preamble_size=256)
+        self.assertEqual(queue.key, 'ABC123')
+        self.assertEqual(queue.preamble, 'meta')
+        self.assertEqual(len(queue), 2)
+        self.assertEqual(queue.get(), 'two')
+        self.assertEqual(queue.get(), 'three')
+        queue.close()
+
+    def test_key_change_discards(self):
+        queue = self._queue(100)
+        queue.set_key('ABC123')
+        queue.set_preamble('meta')
+        queue.put('one')
+        queue.set_key('ABC123')
+        self.assertEqual(len(queue), 1)
+        queue.set_key('XYZ789')
+        self.assertEqual(len(queue), 0)
+        self.assertIsNone(queue.preamble)
+        queue.close()
+
+    def test_preamble_change_discards(self):
+        queue = self._queue(100)
+        queue.set_preamble('meta')
+        queue.put('one')
+        self.assertTrue(queue.set_preamble('meta'))
+        self.assertEqual(len(queue), 1)
+        self.assertTrue(queue.set_preamble('other meta'))
+        self.assertEqual(len(queue), 0)
+        self.assertFalse(queue.set_preamble('x' * 257))
+        self.assertEqual(queue.preamble, 'other meta')
+        queue.close()
+
+    def test_resized_queue_is_reset(self):
+        queue = FrameQueue(self.path, max_size=4096, preamble_size=256)
+        queue.put('one')
+        queue.close()
+        queue = FrameQueue(self.path, max_size=8192, preamble_size=256)
+        self.assertEqual(len(queue), 0)
+        queue.close()
+
+
+class StandInPodium(object):
+    """
+    Local TCP stand-in for the telemetry server
+    """
+
+    def __init__(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(1)
+        self.server.settimeout(3.0)
+        self.port = self.server.getsockname()[1]
+
+    def accept(self):
+        client, address = self.server.accept()
+        client.settimeout(3.0)
+        return client, client.makefile()
+
+    def close(self):
+        self.server.close()
+
+
+class StoreAndForwardTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.loop = IoLoop()
+        self.loop.start()
+        self.podium = StandInPodium()
+        self.queue = FrameQueue(os.path.join(self.dir, 'queue.bin'), max_size=65536, preamble_size=4096)
+
+    def tearDown(self):
+        self.loop.stop(1.0)
+        self.podium.close()
+        self.queue.close()
+        shutil.rmtree(self.dir)
+
+    def test_records_outage_and_back_fills(self):
+        data_bus = mock.Mock()
+        data_bus.rcp_meta_read = False
+        manager = TelemetryManager(data_bus, device_id='ABC123', host='127.0.0.1', port=self.podium.port,
+                                   io_loop=self.loop, frame_queue=self.queue)
+        manager.RECORD_INTERVAL = 0.02
+        manager._on_meta({'RPM': ChannelMeta(name='RPM', units='RPM', sampleRate=10)})
+        manager._on_sample({'RPM': 1000})
+        manager.telemetry_enabled = True
+        manager.data_connected = True
+
+        # connect and stream
+        client, stream = self.podium.accept()
+        self.assertIn('auth', stream.readline())
+        client.sendall('{"status":"ok"}\n')
+        self.assertTrue(wait_for(lambda: manager._streaming))
+
+        # drop the connection; the manager reconnects, but the server holds off authorizing
+        client.shutdown(socket.SHUT_RDWR)
+        client.close()
+        client, stream = self.podium.accept()
+        self.assertIn('auth', stream.readline())
+        for rpm in range(2000, 2010):
+            manager._on_sample({'RPM': rpm})
+            sleep(0.03)
+        self.assertTrue(len(self.queue) > 5)
+        # the live value once reconnected
+        manager.connection._on_sample({'RPM': 9999})
+
+        client.sendall('{"status":"ok"}\n')
+        frames = []
+        while len(frames) == 0 or frames[-1] != {'s': {'d': [9999, 1]}}:
+            frames.append(json.loads(stream.readline()))
+        self.assertTrue(wait_for(lambda: len(self.queue) == 0))
+
+        # the recorded frames are sent in order, after the channel list they were recorded with
+        meta = {'s': {'meta': [{'nm': 'RPM', 'ut': 'RPM', 'sr': 10, 'min': 0, 'max': 100}]}}
+        samples = [frame['s']['d'][0] for frame in frames if 'd' in frame['s']]
+        values = samples[:-1]
+        self.assertEqual(values, sorted(values))
+        self.assertTrue(set(range(2000, 2010)).issubset(values))
+        # live samples wait for the back-fill, then resume with meta and a full frame
+        self.assertEqual(frames[-2], meta)
+        self.assertEqual(samples.count(9999), 1)
+
+        manager.telemetry_enabled = False
+        client.shutdown(socket.SHUT_RDWR)
+        client.close()
@@ -0,0 +1,118 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import json
+from collections import OrderedDict
+from autosportlabs.util.jsoncodec import JsonCodec
+from autosportlabs.telemetry.uplink import SampleEncoder, UplinkMonitor
+
+
+class SampleEncoderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.encoder = SampleEncoder(JsonCodec(), full_frame_interval=5.0)
+        self.encoder.set_channels(OrderedDict((name, None) for name in ['RPM', 'Speed', 'Coolant']))
+
+    def _encode(self, sample, now):
+        frame = self.encoder.encode(sample, now)
+        return None if frame is None else json.loads(frame)['s']['d']
+
+    def test_sends_only_changed_channels(self):
+        self.assertEqual(self._encode({'RPM': 1000, 'Speed': 50, 'Coolant': 180}, 0), [1000, 50, 180, 0b111])
+        self.assertEqual(self._encode({'RPM': 1100, 'Speed': 50, 'Coolant': 180}, 0.1), [1100, 0b001])
+        self.assertEqual(self._encode({'RPM': 1100, 'Speed': 55, 'Coolant': 181}, 0.2), [55, 181, 0b110])
+
+    def test_unchanged_sample(self):
+        self._encode({'RPM': 1000}, 0)
+        self.assertIsNone(self._encode({'RPM': 1000}, 0.1))
+
+    def test_full_frame_interval(self):
+        self._encode({'RPM': 1000, 'Speed': 50}, 0)
+        self.assertIsNone(self._encode({'RPM': 1000, 'Speed': 50}, 4.9))
+        self.assertEqual(self._encode({'RPM': 1000, 'Speed': 50}, 5.0), [1000, 50, 0b011])
+
+    def test_reset(self):
+        self._encode({'RPM': 1000}, 0)
+        self.encoder.reset()
+        self.assertEqual(self._encode({'RPM': 1000}, 0.1), [1000, 0b001])
+
+    def test_multiple_bitmasks(self):
+        names = ['sensor{}'.format(i) for i in range(40)]
+        self.encoder.set_channels(OrderedDict((name, None) for name in names))
+        data = self._encode({'sensor1': 1, 'sensor35': 35}, 0)
+        self.assertEqual(data, [1, 35, 1 << 1, 1 << 3])
+        data = self._encode({'sensor1': 1, 'sensor35': 36}, 0.1)
+        self.assertEqual(data, [36, 0, 1 << 3])
+
+
+class UplinkMonitorTest(unittest.TestCase):
+
+    def test_interval_backs_off_while_frames_queued(self):
+        monitor = UplinkMonitor(0.1, 1.0)
+        self.assertTrue(monitor.frame_due(0))
+        monitor.frame_queued(100, 0)
+        self.assertEqual(monitor.queued_frames, 1)
+        self.assertFalse(monitor.frame_due(0.05))
+        self.assertFalse(monitor.frame_due(0.1))
+        self.assertEqual(monitor.interval, 0.2)
+        self.assertFalse(monitor.frame_due(0.3))
+        self.assertEqual(monitor.interval, 0.4)
+        for now in range(1, 10):
+            monitor.frame_due(now)
+        self.assertEqual(monitor.interval, 1.0)
+
+    def test_interval_recovers_once_link_keeps_up(self):
+        monitor = UplinkMonitor(0.1, 1.0)
+        monitor.interval = 1.0
+        monitor.frame_queued(100, 0)
+        monitor.sent(100, 0.01)
+        self.assertEqual(monitor.queued_frames, 0)
+        now = 0
+        while monitor.interval > 0.1:
+            now += monitor.interval
+            self.assertTrue(monitor.frame_due(now))
+            monitor.frame_queued(100, now)
+            monitor.sent(100, now + 0.01)
+        self.assertEqual(monitor.interval, 0.1)
+
+    def test_partial_writes(self):
+        monitor = UplinkMonitor(0.1, 1.0)
+        monitor.frame_queued(100, 0)
+        monitor.frame_queued(50, 0)
+        monitor.sent(60, 0.1)
+        self.assertEqual(monitor.queued_frames, 2)
+        monitor.sent(60, 0.2)
+        self.assertEqual(monitor.queued_frames, 1)
+        self.assertAlmostEqual(monitor.write_latency, 0.2)
+        monitor.sent(30, 0.3)
+        self.assertEqual(monitor.queued_frames, 0)
+        self.assertEqual(monitor.frames_sent, 2)
+
+    def test_bytes_per_sec(self):
+        monitor = UplinkMonitor(0.1, 1.0)
+        start = monitor._rate_start
+        monitor.frame_queued(1000, start)
+        monitor.sent(1000, start + 0.5)
+        monitor.sent(1000, start + 1.0)
+        self.assertAlmostEqual(monitor.get_bytes_per_sec(start + 1.0), 2000.0)
+        stats = monitor.get_stats()
+        self.assertEqual(stats['bytes_sent'], 2000)
+        self.assertEqual(stats['queued_frames'], 0)
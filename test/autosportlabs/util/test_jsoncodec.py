@@ -0,0 +1,58 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+
+import unittest
+import json
+from autosportlabs.util.jsoncodec import JsonCodec
+
+SAMPLE_FRAME = '{"s":{"t":33,"d":[0.00,2.50,-2.50,397.0,47.256164123,0,16383]}}'
+META_FRAME = '{"s":{"t":33,"meta":[{"nm":"Battery","ut":"Volts","sr":1}],"d":[12.5,1]}}'
+
+
+class JsonCodecTest(unittest.TestCase):
+
+    def test_decode(self):
+        codec = JsonCodec()
+        self.assertEqual(json.loads(SAMPLE_FRAME), codec.decode(SAMPLE_FRAME))
+        self.assertEqual(json.loads(META_FRAME), codec.decode(META_FRAME))
+        self.assertEqual(json.loads(SAMPLE_FRAME), codec.decode(unicode(SAMPLE_FRAME)))
+
+        self.assertEqual(3, codec.decode_stats['s'].count)
+        self.assertTrue(codec.decode_stats['s'].max_decode_time > 0)
+
+    def test_illegal_characters_dropped(self):
+        codec = JsonCodec()
+        self.assertEqual({'ver': {'name': 'RCP'}}, codec.decode('{"ver":{"name":"RCP\xff"}}'))
+        self.assertEqual({'s': {'meta': [{'nm': 'Temp', 'ut': 'C'}]}},
+                         codec.decode('{"s":{"meta":[{"nm":"Temp","ut":"\xc2\xb0C"}]}}'))
+        self.assertEqual({'s': {'t': 1, 'd': [1, 1]}}, codec.decode('{"s":{"t":1,"d":[1,1]}}\xff'))
+        self.assertEqual(1, codec.decode_stats['ver'].count)
+        self.assertEqual(2, codec.decode_stats['s'].count)
+
+        with self.assertRaises(ValueError):
+            codec.decode('{"s":')
+
+    def test_encode(self):
+        codec = JsonCodec()
+        msg = {'s': {'d': [1.5, 47.256164123, -123.191297]}}
+        encoded = codec.encode(msg)
+        self.assertNotIn(' ', encoded)
+        self.assertEqual(msg, json.loads(encoded))